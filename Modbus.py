@@ -1,10 +1,40 @@
 # Modbus Implementation
+import array
+import bisect
+import logging
 import struct
+import sys
 import time
 import threading
 
 from exceptions import *
 from defines import *
+import hooks
+import utils
+
+LOGGER = logging.getLogger("modbus")
+# the application decides where the messages go (see utils.create_logger): nothing is
+# printed by the last resort handler of logging meanwhile
+LOGGER.addHandler(logging.NullHandler())
+
+# precompiled formats of the PDU fields: decoded in place with unpack_from
+_FUNCTION_CODE = struct.Struct(">B")
+_RESPONSE_HEADER = struct.Struct(">BB")
+_ADDRESS_QUANTITY = struct.Struct(">HH")
+_WRITE_MULTIPLE_HEADER = struct.Struct(">HHB")
+_READ_WRITE_HEADER = struct.Struct(">HHHHB")
+
+# registers are stored in native order and sent big endian
+_NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _pack_words(values):
+    """pack registers in bulk, big endian: negative values are sent as signed words"""
+    words = array.array("h" if values and min(values) < 0 else "H", values)
+    if _NATIVE_LITTLE_ENDIAN:
+        words.byteswap()
+    return words.tobytes()
+
 
 class Query(object):
     """ 构建封装报文帧和解析报文帧 """
@@ -29,16 +59,44 @@ class Query(object):
         raise NotImplementedError()
 
 
+class RequestPlan(object):
+    """A request compiled once by ModbusMaster.prepare and sent as many times as needed"""
+    def __init__(self, slave_id, function_code, query, request, expected_length, is_read_function, decoder,
+                 written=None):
+        """Constructor"""
+        self.slave_id = slave_id
+        self.function_code = function_code
+        # the query is kept for parsing the responses
+        self.query = query
+        # the complete request frame (crc included)
+        self.request = request
+        self.expected_length = expected_length
+        self.is_read_function = is_read_function
+        self.decoder = decoder
+        # (starting address, quantity) of the coils or registers written by the request
+        self.written = written
+
+
 class ModbusMaster(object):
+    # maximum number of requests whose plan is kept by execute
+    MAX_CACHED_PLANS = 256
+
     def __init__(self, response_timeout, delay):
         self._timeout = response_timeout
         self.delay = delay
         self.is_connect = False
+        self._plans = {}
+        self._verbose = False
+        self._cache = None
 
     def __del__(self):
         """调用对应函数断开连接"""
         self.disconnect()
 
+    def set_verbose(self, verbose):
+        """if verbose is true the sent and received packets will be logged"""
+        self._verbose = verbose
+
     def set_timeout(self, timeout_in_sec):
         """设定超时时间"""
         self._timeout = timeout_in_sec
@@ -51,7 +109,8 @@ class ModbusMaster(object):
         if not self.is_connect:
             self._do_connect()
             self.is_connect = True
-            print('Modbus master connected!')
+            if self._verbose:
+                LOGGER.info('Modbus master connected!')
             return True
 
     def disconnect(self):
@@ -83,16 +142,19 @@ class ModbusMaster(object):
         """
         raise NotImplementedError()
 
-    def execute(self, slave_id, function_code, starting_address=0,
+    def prepare(self, slave_id, function_code, starting_address=0,
                 quantity=0, output_value=0, data_format='',
-                expected_length=-1, pdu="", returns_raw=False):
+                expected_length=-1, pdu="", write_starting_address_fc23=0):
+        """
+        Compile a request once: returns a RequestPlan holding the complete frame,
+        the expected length of the response and its decoder. The plan can be
+        given to execute_plan as many times as needed
+        """
         is_read_function = False
         nb_of_digits = 0
-        # 打开串口连接
-        self.connect()
+        written = None
         # 判断功能码类型
-        if function_code == READ_HOLDING_REGISTERS: # 功能码03H读保持寄存器
-            print('Reading holding registers...')
+        if function_code in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS): # 功能码03H/04H读保持/输入寄存器
             is_read_function = True
             pdu = struct.pack(">BHH", function_code, starting_address, quantity)
 
@@ -103,8 +165,7 @@ class ModbusMaster(object):
                 # slave + function_code + data_bytes + quantity x 2 + crc1 + crc2
                 expected_length = 2 * quantity + 5
 
-        elif function_code == READ_COILS: # 功能码01H读线圈寄存器
-            print('reading coils..')
+        elif function_code in (READ_COILS, READ_DISCRETE_INPUTS): # 功能码01H/02H读线圈/离散输入寄存器
             is_read_function = True
             pdu = struct.pack(">BHH", function_code, starting_address, quantity)
             byte_count = quantity // 8
@@ -117,15 +178,14 @@ class ModbusMaster(object):
                 # 计算响应数据帧的字节数
                 # slave + function_code + data_bytes + byte_count + crc1 + crc2
                 expected_length = byte_count + 5
-            
 
         elif function_code == WRITE_SINGLE_COIL: # 功能码05H写单个线圈寄存器
-            print('writing single coil...')
             if output_value != 0:
                 output_value = 0xff00
             fmt = ">BHH"
 
             pdu = struct.pack(fmt, function_code, starting_address, output_value)
+            written = (starting_address, 1)
             if not data_format:
                 data_format = ">HH"
             if expected_length < 0:
@@ -133,64 +193,248 @@ class ModbusMaster(object):
                 # slave + func + address1 + address2 + value1+value2 + crc1 + crc2
                 expected_length = 8
 
+        elif function_code == WRITE_MULTIPLE_COILS: # 功能码0FH写多个线圈寄存器
+            # the quantity is the number of values: they are packed 8 per byte
+            byte_count = (len(output_value) + 7) // 8
+            pdu = struct.pack(">BHHB", function_code, starting_address, len(output_value), byte_count)
+            pdu += utils.pack_bits(output_value)
+            written = (starting_address, len(output_value))
+            data_format = ">HH"
+            if expected_length < 0:
+                # slave + func + address1 + address2 + quantity1 + quantity2 + crc1 + crc2
+                expected_length = 8
+
+        elif function_code == WRITE_MULTIPLE_REGISTERS: # 功能码10H写多个保持寄存器
+            if data_format:
+                # the values are packed with the given format (floats, longs...)
+                values = struct.pack(data_format, *output_value)
+            else:
+                values = _pack_words(output_value)
+            byte_count = len(values)
+            pdu = struct.pack(">BHHB", function_code, starting_address, byte_count // 2, byte_count) + values
+            # a value of data_format can take several registers
+            written = (starting_address, byte_count // 2)
+            data_format = ">HH"
+            if expected_length < 0:
+                # slave + func + address1 + address2 + quantity1 + quantity2 + crc1 + crc2
+                expected_length = 8
+
+        elif function_code == READ_WRITE_MULTIPLE_REGISTERS: # 功能码17H读写多个保持寄存器
+            # the registers are written then read by the slave in the same transaction
+            is_read_function = True
+            values = _pack_words(output_value)
+            pdu = struct.pack(">BHHHHB", function_code, starting_address, quantity,
+                              write_starting_address_fc23, len(values) // 2, len(values)) + values
+            written = (write_starting_address_fc23, len(values) // 2)
+            if not data_format:
+                data_format = ">" + (quantity * "H")
+            if expected_length < 0:
+                # slave + function_code + data_bytes + quantity x 2 + crc1 + crc2
+                expected_length = 2 * quantity + 5
+
+        # precompile the decoder of the response
+        if nb_of_digits > 0:
+            def decoder(data):
+                return utils.unpack_bits(data, nb_of_digits)
+        else:
+            decoder = struct.Struct(data_format).unpack
+
         # make query
         query = self._make_query() # 创建Query对象
         # 根据PDU和从站地址构建得到请求数据帧
         request = query.build_request(pdu, slave_id)
-        print('Request: ', request)
+        return RequestPlan(slave_id, function_code, query, request, expected_length, is_read_function, decoder,
+                           written)
+
+    def execute(self, slave_id, function_code, starting_address=0,
+                quantity=0, output_value=0, data_format='',
+                expected_length=-1, pdu="", returns_raw=False, write_starting_address_fc23=0):
+        plan = self._get_plan(slave_id, function_code, starting_address, quantity,
+                              output_value, data_format, expected_length, pdu, write_starting_address_fc23)
+        if self._cache is not None:
+            return self._cache.execute(self, plan, starting_address, quantity, data_format, returns_raw)
+        return self.execute_plan(plan, returns_raw)
+
+    def set_cache(self, cache):
+        """put a cache.ReadCache in front of execute (None removes it)"""
+        self._cache = cache
+
+    def _get_plan(self, *args):
+        """returns the plan of a request (args are the arguments of prepare)"""
+        if isinstance(args[4], (list, tuple)):
+            # the values written at once change from a call to the other: their plans are not kept
+            return self.prepare(*args)
+        # the same requests are sent again and again: their plans are cached
+        try:
+            plan = self._plans.get(args)
+        except TypeError:
+            # an argument can not be a key (bytearray pdu...): the request is compiled every time
+            return self.prepare(*args)
+        if plan is None:
+            plan = self.prepare(*args)
+            if len(self._plans) >= self.MAX_CACHED_PLANS:
+                self._plans.clear()
+            self._plans[args] = plan
+        return plan
+
+    def execute_plan(self, plan, returns_raw=False):
+        """send the request of a plan returned by prepare and decode the response"""
+        # 打开串口连接
+        self.connect()
+        # hooks and logging are checked once: nothing is paid when they are off
+        hooked = hooks.has_hooks()
+        verbose = self._verbose
+        request = plan.request
+        if hooked:
+            retval = hooks.call_hooks("modbus.Master.before_send", (self, request))
+            if retval is not None:
+                request = retval
+        if verbose:
+            LOGGER.debug(utils.get_log_buffer("-> ", request))
         self._send(request) # 发送请求报文帧
-        time.sleep(self.delay)
+        if self.delay:
+            time.sleep(self.delay)
 
-        if slave_id != 0:
+        if plan.slave_id != 0:
             # receive the data from the slave
-            response = self._recv(expected_length)
-            print('response: ', bytes(response))
-            # extract the pdu part of the response
-            response_pdu = query.parse_response(response)
-            # analyze the received data
-            (return_code, byte_2) = struct.unpack(">BB", response_pdu[0:2])
-
-            if return_code > 0x80:
-                # the slave has returned an error
-                exception_code = byte_2 # 返回功能码出错
-                raise ModbusError(exception_code)
+            response = self._recv(plan.expected_length)
+            if hooked:
+                retval = hooks.call_hooks("modbus.Master.after_recv", (self, response))
+                if retval is not None:
+                    response = retval
+            if verbose:
+                LOGGER.debug(utils.get_log_buffer("<- ", response))
+            try:
+                return self._decode_response(plan, response, returns_raw)
+            except (ModbusError, ModbusInvalidResponseError) as excpt:
+                if hooked:
+                    hooks.call_hooks("modbus.Master.on_error", (self, excpt))
+                raise
+
+    def _decode_response(self, plan, response, returns_raw, query=None):
+        """check the response to a plan (sent with query if given) and returns the data"""
+        # extract the pdu part of the response
+        response_pdu = (query or plan.query).parse_response(response)
+        # analyze the received data
+        (return_code, byte_2) = _RESPONSE_HEADER.unpack_from(response_pdu)
+
+        if return_code > 0x80:
+            # the slave has returned an error
+            exception_code = byte_2 # 返回功能码出错
+            raise ModbusError(exception_code)
+        else:
+            if plan.is_read_function:
+                # get the values returned by the reading function
+                byte_count = byte_2
+                data = response_pdu[2:]
+                if byte_count != len(data):
+                    # the byte count in the pdu is invalid
+                    raise ModbusInvalidResponseError("Byte count is {0} "
+                     "while actual number of bytes is {1}. ".format(byte_count, len(data))
+                    )
             else:
-                if is_read_function:
-                    # get the values returned by the reading function
-                    byte_count = byte_2
-                    data = response_pdu[2:]
-                    if byte_count != len(data):
-                        # the byte count in the pdu is invalid
-                        raise ModbusInvalidResponseError("Byte count is {0} "
-                         "while actual number of bytes is {1}. ".format(byte_count, len(data))
-                        )
-                else:
-                    # returns what is returned by the slave after a writing function
-                    data = response_pdu[1:]
-                if returns_raw:
-                    return data
-                # returns the data as a tuple according to the data_format
-                result = struct.unpack(data_format, data)
-                if nb_of_digits > 0:
-                    digits = []
-                    for byte_val in result:
-                        for i in range(8):
-                            if len(digits) >= nb_of_digits:
-                                break
-                            digits.append(byte_val % 2)
-                            byte_val = byte_val >> 1
-                    result = tuple(digits)
-
-                return result
+                # returns what is returned by the slave after a writing function
+                data = response_pdu[1:]
+            if returns_raw:
+                return bytes(data)
+            # returns the data as a tuple according to the data_format
+            return plan.decoder(data)
+
+
+class PackedBits(object):
+    """An array of bits packed 8 per byte, the first bit being the lsb of the first byte (as on the wire)"""
+    def __init__(self, size):
+        """Constructor: all the bits are cleared"""
+        self._size = size
+        self._bytes = bytearray((size + 7) // 8)
+
+    def __len__(self):
+        return self._size
+
+    def _get_int(self, start, count):
+        """returns count bits from start as an integer"""
+        first, last = start >> 3, (start + count + 7) >> 3
+        return (int.from_bytes(self._bytes[first:last], "little") >> (start & 7)) & ((1 << count) - 1)
+
+    def _set_int(self, start, count, value):
+        """write count bits from start given as an integer"""
+        first, last = start >> 3, (start + count + 7) >> 3
+        shift = start & 7
+        mask = ((1 << count) - 1) << shift
+        current = int.from_bytes(self._bytes[first:last], "little")
+        self._bytes[first:last] = ((current & ~mask) | ((value << shift) & mask)).to_bytes(last - first, "little")
+
+    def _index(self, item):
+        """check the index and make it positive"""
+        if item < 0:
+            item += self._size
+        if not 0 <= item < self._size:
+            raise IndexError("bit index out of range")
+        return item
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._size)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            count = stop - start
+            if count <= 0:
+                return []
+            return list(map(int, format(self._get_int(start, count), "0{0}b".format(count))[::-1]))
+        item = self._index(item)
+        return (self._bytes[item >> 3] >> (item & 7)) & 1
+
+    def __setitem__(self, item, value):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._size)
+            indexes = range(start, stop, step)
+            values = list(value)
+            if len(values) != len(indexes):
+                raise ValueError("can not change the size of a block")
+            if step != 1:
+                for i, bit in zip(indexes, values):
+                    self[i] = bit
+            elif values:
+                self._set_int(start, len(values), int.from_bytes(utils.pack_bits(values), "little"))
+            return
+        item = self._index(item)
+        if value:
+            self._bytes[item >> 3] |= 1 << (item & 7)
+        else:
+            self._bytes[item >> 3] &= ~(1 << (item & 7)) & 0xFF
+
+    def pack_into(self, buffer, position, start, count):
+        """write count bits from start packed in bytes in the buffer at the given position"""
+        byte_count = (count + 7) // 8
+        buffer[position:position + byte_count] = self._get_int(start, count).to_bytes(byte_count, "little")
+
+    def unpack_from(self, buffer, position, start, count):
+        """set count bits from start with the bits packed in the buffer at the given position"""
+        byte_count = (count + 7) // 8
+        self._set_int(start, count, int.from_bytes(buffer[position:position + byte_count], "little"))
+
+    def copy(self):
+        """returns a copy of the bits"""
+        bits = PackedBits.__new__(PackedBits)
+        bits._size = self._size
+        bits._bytes = bytearray(self._bytes)
+        return bits
 
 
 class ModbusBlock(object):
     """This class represents the values for a range of addresses"""
-    def __init__(self, starting_address, size, name=''):
+    def __init__(self, starting_address, size, name='', block_type=HOLDING_REGISTERS, unsigned=True):
         """ Constructor: defines the address range and creates the array of values """
         self.starting_address = starting_address
-        self._data = [0] * size
+        self.block_type = block_type
+        # bits are stored packed, registers in an array of 16 bits words
+        if block_type in (COILS, DISCRETE_INPUTS):
+            self._data = PackedBits(size)
+        else:
+            self._data = array.array("H" if unsigned else "h", bytes(2 * size))
         self.size = len(self._data)
+        # changed on every write: the snapshots copy again the blocks whose version has changed
+        self.version = 0
 
     def is_in(self, starting_address, size):
         """ 判断数据块是否在给定的地址范围内 """
@@ -206,7 +450,90 @@ class ModbusBlock(object):
 
     def __setitem__(self, item, value):
         """"""
-        return self._data.__setitem__(item, value)
+        if isinstance(item, slice) and isinstance(self._data, array.array):
+            if len(range(*item.indices(self.size))) != len(value):
+                raise ValueError("can not change the size of a block")
+            value = array.array(self._data.typecode, value)
+        self._data.__setitem__(item, value)
+        self.version += 1
+
+    def pack_into(self, buffer, position, offset, count):
+        """write count values from offset in the buffer at the given position, as sent in a response"""
+        if isinstance(self._data, PackedBits):
+            self._data.pack_into(buffer, position, offset, count)
+        else:
+            words = self._data[offset:offset + count]
+            if _NATIVE_LITTLE_ENDIAN:
+                words.byteswap()
+            buffer[position:position + 2 * count] = words
+
+    def unpack_from(self, buffer, position, offset, count):
+        """set count values from offset with the values of the buffer at the given position, as sent in a request"""
+        if isinstance(self._data, PackedBits):
+            self._data.unpack_from(buffer, position, offset, count)
+        else:
+            words = array.array(self._data.typecode)
+            words.frombytes(buffer[position:position + 2 * count])
+            if _NATIVE_LITTLE_ENDIAN:
+                words.byteswap()
+            self._data[offset:offset + count] = words
+        self.version += 1
+
+    def copy(self):
+        """returns a copy of the block and of its values"""
+        block = ModbusBlock.__new__(ModbusBlock)
+        block.starting_address = self.starting_address
+        block.block_type = self.block_type
+        block.size = self.size
+        block.version = self.version
+        block._data = self._data.copy() if isinstance(self._data, PackedBits) else self._data[:]
+        return block
+
+    def get_values(self, block_name, address, size):
+        """returns size values from address (block_name is used in the error message)"""
+        offset = address - self.starting_address
+        # check that it doesn't read out of the block
+        if (offset < 0) or ((offset + size) > self.size):
+            raise OutOfModbusBlockError(
+                "address {0} size {1} is out of block {2}".format(address, size, block_name)
+            )
+        if size == 1:
+            return tuple([self[offset], ])
+        else:
+            return tuple(self[offset:offset+size])
+
+
+class SlaveSnapshot(object):
+    """
+    A consistent copy of all the blocks of a slave, returned by ModbusSlave.snapshot.
+    It is never changed: it can be read without any lock while the slave
+    goes on handling the requests
+    """
+    def __init__(self, layout_version, blocks):
+        """Constructor: blocks is a dictionnary {name: (block of the slave, its copy)}"""
+        self._layout_version = layout_version
+        self._blocks = blocks
+        # the versions of the blocks when they have been copied
+        self._sources = tuple((block, copy.version) for (block, copy) in blocks.values())
+
+    def is_current(self, layout_version):
+        """True if no block has been written, added or removed since the snapshot"""
+        if layout_version != self._layout_version:
+            return False
+        for (block, version) in self._sources:
+            if block.version != version:
+                return False
+        return True
+
+    def get_block_names(self):
+        """returns the names of the blocks"""
+        return list(self._blocks)
+
+    def get_values(self, block_name, address, size=1):
+        """ 获取快照中指定地址数据块中的数据 """
+        if block_name not in self._blocks:
+            raise MissingKeyError("block {0} not found".format(block_name))
+        return self._blocks[block_name][1].get_values(block_name, address, size)
 
 
 class ModbusSlave(object):
@@ -228,54 +555,56 @@ class ModbusSlave(object):
             }
         else:
             self._memory = memory
+        # interval index: the blocks of every type are sorted by starting address
+        # and the sorted starting addresses are searched with bisect
+        self._starting_addresses = {}
+        for block_type, blocks in self._memory.items():
+            blocks.sort(key=lambda block: block.starting_address)
+            self._starting_addresses[block_type] = [block.starting_address for block in blocks]
         # 线程锁
         self._data_lock = threading.RLock()
+        # the last snapshot and the version of the list of blocks (changed by add and remove)
+        self._snapshot = None
+        self._layout_version = 0
         # 函数功能码映射
         self._fn_code_map = {
             READ_COILS: self._read_coils,
+            READ_DISCRETE_INPUTS: self._read_discrete_inputs,
             READ_HOLDING_REGISTERS: self._read_holding_registers,
-            WRITE_SINGLE_COIL: self._write_single_coil
+            READ_INPUT_REGISTERS: self._read_input_registers,
+            WRITE_SINGLE_COIL: self._write_single_coil,
+            WRITE_MULTIPLE_COILS: self._write_multiple_coils,
+            WRITE_MULTIPLE_REGISTERS: self._write_multiple_registers,
+            READ_WRITE_MULTIPLE_REGISTERS: self._read_write_multiple_registers,
         }
 
     def _get_block_and_offset(self, block_type, address, length):
         """returns the block and offset corresponding to the given address"""
-        for block in self._memory[block_type]:
-            if address >= block.starting_address:
-                offset = address - block.starting_address
-                if block.size >= offset + length:
-                    return block, offset
+        # blocks don't overlap: only the last block starting before the address can contain it
+        index = bisect.bisect_right(self._starting_addresses[block_type], address) - 1
+        if index >= 0:
+            block = self._memory[block_type][index]
+            offset = address - block.starting_address
+            if block.size >= offset + length:
+                return block, offset
         raise ModbusError(ILLEGAL_DATA_ADDRESS)
 
 
     def _read_digital(self, block_type, request_pdu):
         """read the value of coils """
-        (starting_address, quantity_of_x) = struct.unpack(">HH", request_pdu[1:5])
-        if (quantity_of_x <= 0) or (quantity_of_x > 2000):
+        (starting_address, quantity_of_x) = _ADDRESS_QUANTITY.unpack_from(request_pdu, 1)
+        if (quantity_of_x <= 0) or (quantity_of_x > MAX_READ_BITS):
             # maximum allowed size is 2000 bits in one reading
             raise ModbusError(ILLEGAL_DATA_VALUE)
         block, offset = self._get_block_and_offset(block_type, starting_address, quantity_of_x)
-        values = block[offset:offset + quantity_of_x]
         # pack bits in bytes
         byte_count = quantity_of_x // 8
         if (quantity_of_x % 8) > 0:
             byte_count += 1
-        # write the response header
-        response = struct.pack(">B", byte_count)
-
-        i, byte_value = 0, 0
-        for coil in values:
-            if coil:
-                byte_value += (1 << i)
-            if i >= 7:
-                # write the values of 8 bits in a byte
-                response += struct.pack(">B", byte_value)
-                # reset the counters
-                i, byte_value = 0, 0
-            else:
-                i += 1
-        if i > 0:
-            fmt = "B" if self.unsigned else "b"
-            response += struct.pack(">" + fmt, byte_value)
+        # the response (header + packed bits) is built in a single buffer
+        response = bytearray(1 + byte_count)
+        response[0] = byte_count
+        block.pack_into(response, 1, offset, quantity_of_x)
         return response
 
     def _read_coils(self, request_pdu):
@@ -283,23 +612,24 @@ class ModbusSlave(object):
         """handle read coils modbus function"""
         return self._read_digital(COILS, request_pdu)
 
+    def _read_discrete_inputs(self, request_pdu):
+        """handle read discrete inputs modbus function"""
+        self.request_received = READ_DISCRETE_INPUTS
+        return self._read_digital(DISCRETE_INPUTS, request_pdu)
+
 
     def _read_registers(self, block_type, request_pdu):
         """read the value of holding  registers"""
-        (starting_address, quantity_of_x) = struct.unpack(">HH", request_pdu[1:5])
-        if (quantity_of_x <= 0) or (quantity_of_x > 125):
+        (starting_address, quantity_of_x) = _ADDRESS_QUANTITY.unpack_from(request_pdu, 1)
+        if (quantity_of_x <= 0) or (quantity_of_x > MAX_READ_REGISTERS):
             # maximum allowed size is 125 registers in one reading
             raise ModbusError(ILLEGAL_DATA_VALUE)
         # get the block corresponding to the request
         block, offset = self._get_block_and_offset(block_type, starting_address, quantity_of_x)
-        # get the values
-        values = block[offset:offset+quantity_of_x]
-        # write the response header
-        response = struct.pack(">B", 2 * quantity_of_x)
-        # add the values of every register on 2 bytes
-        for reg in values:
-            fmt = "H" if self.unsigned else "h"
-            response += struct.pack(">"+fmt, reg)
+        # write the response header and the values of every register on 2 bytes in a single buffer
+        response = bytearray(1 + 2 * quantity_of_x)
+        response[0] = 2 * quantity_of_x
+        block.pack_into(response, 1, offset, quantity_of_x)
         return response
 
     def _read_holding_registers(self, request_pdu):
@@ -307,11 +637,16 @@ class ModbusSlave(object):
         """handle read coils modbus function"""
         return self._read_registers(HOLDING_REGISTERS, request_pdu)
 
+    def _read_input_registers(self, request_pdu):
+        """handle read input registers modbus function"""
+        self.request_received = READ_INPUT_REGISTERS
+        return self._read_registers(ANALOG_INPUTS, request_pdu)
+
 
     def _write_single_coil(self, request_pdu):
         self.request_received = WRITE_SINGLE_COIL
         """execute modbus function 5"""
-        (data_address, value) = struct.unpack(">HH", request_pdu[1:5])
+        (data_address, value) = _ADDRESS_QUANTITY.unpack_from(request_pdu, 1)
         block, offset = self._get_block_and_offset(COILS, data_address, 1)
         self.changed_data_address = data_address
         self.changed_data = value
@@ -324,32 +659,89 @@ class ModbusSlave(object):
         # returns echo of the command
         return request_pdu[1:]
 
+    def _write_multiple(self, block_type, max_quantity, request_pdu):
+        """write the values of a request to write several coils or registers"""
+        (starting_address, quantity_of_x, byte_count) = _WRITE_MULTIPLE_HEADER.unpack_from(request_pdu, 1)
+        if block_type == COILS:
+            expected_byte_count = (quantity_of_x + 7) // 8
+        else:
+            expected_byte_count = 2 * quantity_of_x
+        if (quantity_of_x <= 0) or (quantity_of_x > max_quantity) or (byte_count != expected_byte_count) \
+                or (len(request_pdu) != 6 + byte_count):
+            raise ModbusError(ILLEGAL_DATA_VALUE)
+        # the whole range must be in a block: nothing is written otherwise
+        block, offset = self._get_block_and_offset(block_type, starting_address, quantity_of_x)
+        block.unpack_from(request_pdu, 6, offset, quantity_of_x)
+        self.changed_data_address = starting_address
+        self.changed_data = block[offset:offset + quantity_of_x]
+        # returns the starting address and the quantity
+        return request_pdu[1:5]
+
+    def _write_multiple_coils(self, request_pdu):
+        """execute modbus function 15"""
+        self.request_received = WRITE_MULTIPLE_COILS
+        return self._write_multiple(COILS, MAX_WRITE_BITS, request_pdu)
+
+    def _write_multiple_registers(self, request_pdu):
+        """execute modbus function 16"""
+        self.request_received = WRITE_MULTIPLE_REGISTERS
+        return self._write_multiple(HOLDING_REGISTERS, MAX_WRITE_REGISTERS, request_pdu)
+
+    def _read_write_multiple_registers(self, request_pdu):
+        """execute modbus function 23: the registers are written then read"""
+        self.request_received = READ_WRITE_MULTIPLE_REGISTERS
+        (read_address, read_quantity, write_address, write_quantity, byte_count) = \
+            _READ_WRITE_HEADER.unpack_from(request_pdu, 1)
+        if (read_quantity <= 0) or (read_quantity > MAX_READ_REGISTERS) \
+                or (write_quantity <= 0) or (write_quantity > MAX_READ_WRITE_REGISTERS) \
+                or (byte_count != 2 * write_quantity) or (len(request_pdu) != 10 + byte_count):
+            raise ModbusError(ILLEGAL_DATA_VALUE)
+        # both ranges are checked before anything is written
+        read_block, read_offset = self._get_block_and_offset(HOLDING_REGISTERS, read_address, read_quantity)
+        write_block, write_offset = self._get_block_and_offset(HOLDING_REGISTERS, write_address, write_quantity)
+        # handle_request holds the lock: no other request sees the registers written but not read
+        write_block.unpack_from(request_pdu, 10, write_offset, write_quantity)
+        self.changed_data_address = write_address
+        self.changed_data = write_block[write_offset:write_offset + write_quantity]
+        response = bytearray(1 + 2 * read_quantity)
+        response[0] = 2 * read_quantity
+        read_block.pack_into(response, 1, read_offset, read_quantity)
+        return response
+
 
     def handle_request(self, request_pdu, broadcast=False):
         """ 解析请求PDU并做出相应处理，然后返回响应报文帧 """
         # thread-safe
         with self._data_lock:
+            # get the function code: known by the except clause, even if a hook raises
+            function_code = request_pdu[0]
             try:
-                # get the function code
-                (function_code, ) = struct.unpack(">B", request_pdu[0:1])
+                hooked = hooks.has_hooks()
+                if hooked:
+                    retval = hooks.call_hooks("modbus.Slave.on_handle_request", (self, request_pdu))
+                    if retval is not None:
+                        return retval
                 # 判断功能码是否合法
                 if function_code not in self._fn_code_map:
                     raise ModbusError(ILLEGAL_FUNCTION)
                 # if read query is broadcasted raises an error
                 cant_be_broadcasted = (
                     READ_COILS,
-                    READ_HOLDING_REGISTERS ) # 读数据功能码不能被广播
+                    READ_DISCRETE_INPUTS,
+                    READ_HOLDING_REGISTERS,
+                    READ_INPUT_REGISTERS,
+                    READ_WRITE_MULTIPLE_REGISTERS ) # 读数据功能码不能被广播
                 if broadcast and (function_code in cant_be_broadcasted):
                     raise ModbusInvalidRequestError("Function %d can not be broadcasted" % function_code)
                 # execute the corresponding function
                 response_pdu = self._fn_code_map[function_code](request_pdu)
                 if response_pdu:
                     if broadcast:
-                        # call_hooks("modbus.Slave.on_handle_broadcast", (self, response_pdu))
-                        # LOGGER.debug("broadcast: %s", get_log_buffer("!!", response_pdu))
+                        if hooked:
+                            hooks.call_hooks("modbus.Slave.on_handle_broadcast", (self, response_pdu))
                         return ""
                     else:
-                        return struct.pack(">B", function_code) + response_pdu
+                        return _FUNCTION_CODE.pack(function_code) + response_pdu
                 raise Exception("No response for function %d" % function_code)
 
             except ModbusError as excpt:
@@ -375,21 +767,22 @@ class ModbusSlave(object):
             # check that the new block doesn't overlap an existing block
             # it means that only 1 block per type must correspond to a given address
             # for example: it must not have 2 holding registers at address 100
-            index = 0
-            for i in range(len(self._memory[block_type])):
-                block = self._memory[block_type][i]
+            # only the blocks just before and just after the insertion point may overlap
+            blocks = self._memory[block_type]
+            starting_addresses = self._starting_addresses[block_type]
+            index = bisect.bisect_left(starting_addresses, starting_address)
+            for block in blocks[max(index - 1, 0):index + 1]:
                 if block.is_in(starting_address, size):
                     raise OverlapModbusBlockError(
                         "Overlap block at {0} size {1}".format(block.starting_address, block.size)
                     )
-                if block.starting_address > starting_address:
-                    index = i
-                    break
 
             # if the block is ok: register it
             self._blocks[block_name] = (block_type, starting_address)
             # add it in the 'per type' shortcut
-            self._memory[block_type].insert(index, ModbusBlock(starting_address, size, block_name))
+            blocks.insert(index, ModbusBlock(starting_address, size, block_name, block_type, self.unsigned))
+            starting_addresses.insert(index, starting_address)
+            self._layout_version += 1
 
     def remove_block(self, block_name):
         """ 移除从站中指定的数据块 """
@@ -399,7 +792,10 @@ class ModbusSlave(object):
 
             # the block has been found: remove it from the shortcut
             block_type = self._blocks.pop(block_name)[0]
-            self._memory[block_type].remove(block)
+            index = bisect.bisect_left(self._starting_addresses[block_type], block.starting_address)
+            del self._memory[block_type][index]
+            del self._starting_addresses[block_type][index]
+            self._layout_version += 1
 
     def remove_all_blocks(self):
         """
@@ -410,15 +806,18 @@ class ModbusSlave(object):
             self._blocks.clear()
             for key in self._memory:
                 self._memory[key] = []
+                self._starting_addresses[key] = []
+            self._layout_version += 1
 
     def _get_block(self, block_name):
         """Find a block by its name and raise and exception if not found"""
         if block_name not in self._blocks:
             raise MissingKeyError("block {0} not found".format(block_name))
         (block_type, starting_address) = self._blocks[block_name]
-        for block in self._memory[block_type]:
-            if block.starting_address == starting_address:
-                return block
+        index = bisect.bisect_left(self._starting_addresses[block_type], starting_address)
+        blocks = self._memory[block_type]
+        if index < len(blocks) and blocks[index].starting_address == starting_address:
+            return blocks[index]
         raise Exception("Bug?: the block {0} is not registered properly in memory".format(block_name))
 
     def set_values(self, block_name, address, values):
@@ -435,32 +834,46 @@ class ModbusSlave(object):
                 raise OutOfModbusBlockError(
                     "address {0} size {1} is out of block {2}".format(address, size, block_name)
                 )
-            # if Ok: write the values
-            if isinstance(values, list) or isinstance(values, tuple):
-                block[offset:offset+len(values)] = values
-            else:
-                block[offset] = values
+            # if Ok: write the values. The registers are 16 bits integers: nothing
+            # is written if one of the values doesn't fit
+            try:
+                if isinstance(values, list) or isinstance(values, tuple):
+                    block[offset:offset+len(values)] = values
+                else:
+                    block[offset] = values
+            except (OverflowError, TypeError) as excpt:
+                raise InvalidArgumentError(
+                    "invalid value for block {0}: {1}".format(block_name, excpt)
+                )
 
     def get_values(self, block_name, address, size=1):
         """ 获取指定地址数据块中的数据 """
         # thread safe
         with self._data_lock:
-            block = self._get_block(block_name)
+            # the block has been found: returns the values
+            return self._get_block(block_name).get_values(block_name, address, size)
 
-            # the block has been found
-            # check that it doesn't write out of the block
-            offset = address - block.starting_address
-
-            if (offset < 0) or ((offset + size) > block.size):
-                raise OutOfModbusBlockError(
-                    "address {0} size {1} is out of block {2}".format(address, size, block_name)
-                )
-
-            # returns the values
-            if size == 1:
-                return tuple([block[offset], ])
-            else:
-                return tuple(block[offset:offset+size])
+    def snapshot(self):
+        """
+        returns a SlaveSnapshot of all the blocks: readers (GUI, historian...) use
+        it without taking the lock of the slave. The snapshot is given again
+        without any lock as long as nothing is written; otherwise only the
+        blocks written since the last snapshot are copied, under the lock
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.is_current(self._layout_version):
+            return snapshot
+        with self._data_lock:
+            previous = snapshot._blocks if snapshot is not None else {}
+            blocks = {}
+            for block_name in self._blocks:
+                block = self._get_block(block_name)
+                (source, copy) = previous.get(block_name, (None, None))
+                if source is not block or copy.version != block.version:
+                    copy = block.copy()
+                blocks[block_name] = (block, copy)
+            snapshot = self._snapshot = SlaveSnapshot(self._layout_version, blocks)
+        return snapshot
 
 
 class DataBank(object):
@@ -538,12 +951,13 @@ class DataBank(object):
             # No slave with this ID in server, do not send any response
             return ""
         except Exception as excpt:
-            pass
+            if hooks.has_hooks():
+                hooks.call_hooks("modbus.Databank.on_error", (self, excpt, request_pdu))
 
         # If the request was not handled correctly, return a server error response
         func_code = 1
         if len(request_pdu) > 0:
-            (func_code, ) = struct.unpack(">B", request_pdu[0:1])
+            func_code = request_pdu[0]
 
         return struct.pack(">BB", func_code + 0x80, SLAVE_DEVICE_FAILURE)
 
@@ -631,11 +1045,11 @@ class ModbusServer(object):
     def _handle(self, request):
         """handle a received message"""
         if self._verbose:
-            pass
+            LOGGER.debug(utils.get_log_buffer("-->", request))
         # gets a query for analyzing the request
         query = self._make_query()
         response = self._databank.handle_request(query, request)
 
         if response and self._verbose:
-            pass
+            LOGGER.debug(utils.get_log_buffer("<--", response))
         return response
\ No newline at end of file
@@ -0,0 +1,415 @@
+""" Modbus on asyncio streams: many serial lines and TCP links driven by one event loop """
+
+import asyncio
+
+from Modbus import ModbusMaster, DataBank, LOGGER
+from ModbusSerial import RtuQuery, expected_request_length
+from ModbusTcp import TcpQuery, _check_response_length, _MBAP_LENGTH, _TRANSACTION_ID
+from exceptions import *
+import crc
+import hooks
+import utils
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+
+class AsyncRtuMaster(ModbusMaster):
+    """
+    Modbus RTU master on an asyncio (reader, writer) stream pair: use
+    'await master.execute(...)'. The responses are framed by their length,
+    so nothing waits for a timeout when the slave answers.
+    """
+
+    # silence ending a response whose length is unknown (function without expected_length)
+    frame_silence = 0.05
+
+    def __init__(self, reader, writer, response_timeout=1.0, delay=0):
+        super(AsyncRtuMaster, self).__init__(response_timeout=response_timeout, delay=delay)
+        self._reader = reader
+        self._writer = writer
+        # one transaction at a time on a line
+        self._lock = asyncio.Lock()
+        # True when a response may still come after its transaction (timeout...)
+        self._out_of_sync = False
+        self.is_connect = True
+
+    @classmethod
+    async def open_serial(cls, url, baudrate=9600, response_timeout=1.0, delay=0, **kwargs):
+        """open a serial port (requires pyserial-asyncio)"""
+        if serial_asyncio is None:
+            raise ImportError("pyserial-asyncio is required for opening a serial port")
+        reader, writer = await serial_asyncio.open_serial_connection(url=url, baudrate=baudrate, **kwargs)
+        return cls(reader, writer, response_timeout, delay)
+
+    @classmethod
+    async def open_tcp(cls, host, port, response_timeout=1.0, delay=0):
+        """open a TCP link to a RTU device (serial to ethernet converter...)"""
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, response_timeout, delay)
+
+    def _do_connect(self):
+        """the stream is opened by the constructor"""
+        pass
+
+    def _do_disconnect(self):
+        """Close the stream"""
+        self._writer.close()
+        return True
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus RTU protocol"""
+        return RtuQuery()
+
+    async def execute(self, slave_id, function_code, starting_address=0,
+                      quantity=0, output_value=0, data_format='',
+                      expected_length=-1, pdu="", returns_raw=False, write_starting_address_fc23=0):
+        """same as ModbusMaster.execute: returns an awaitable"""
+        plan = self._get_plan(slave_id, function_code, starting_address, quantity,
+                              output_value, data_format, expected_length, pdu, write_starting_address_fc23)
+        return await self.execute_plan(plan, returns_raw)
+
+    async def execute_plan(self, plan, returns_raw=False):
+        """send the request of a plan returned by prepare and decode the response"""
+        async with self._lock:
+            hooked = hooks.has_hooks()
+            request = plan.request
+            if hooked:
+                retval = hooks.call_hooks("modbus.Master.before_send", (self, request))
+                if retval is not None:
+                    request = retval
+            if self._verbose:
+                LOGGER.debug(utils.get_log_buffer("-> ", request))
+            if self._out_of_sync:
+                # the late response of the previous transaction must not be taken for this one
+                await self._discard_input()
+            self._writer.write(request)
+            await self._writer.drain()
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+            if plan.slave_id == 0:
+                return None
+            try:
+                response = await asyncio.wait_for(self._recv_frame(plan.expected_length), self._timeout)
+            except asyncio.TimeoutError:
+                self._out_of_sync = True
+                raise ModbusInvalidResponseError("Response timeout")
+            except asyncio.IncompleteReadError as excpt:
+                raise ModbusInvalidResponseError("Response length is invalid {0}".format(len(excpt.partial)))
+            if hooked:
+                retval = hooks.call_hooks("modbus.Master.after_recv", (self, response))
+                if retval is not None:
+                    response = retval
+            if self._verbose:
+                LOGGER.debug(utils.get_log_buffer("<- ", response))
+            try:
+                return self._decode_response(plan, response, returns_raw)
+            except (ModbusError, ModbusInvalidResponseError) as excpt:
+                if isinstance(excpt, ModbusInvalidResponseError):
+                    # the bytes of a garbled frame may follow
+                    self._out_of_sync = True
+                if hooked:
+                    hooks.call_hooks("modbus.Master.on_error", (self, excpt))
+                raise
+
+    async def _discard_input(self):
+        """discard the bytes received until the line is silent (as reset_input_buffer of RtuMaster)"""
+        while True:
+            try:
+                read_bytes = await asyncio.wait_for(self._reader.read(256), self.frame_silence)
+            except asyncio.TimeoutError:
+                break
+            if not read_bytes:
+                break
+            if self._verbose:
+                LOGGER.debug(utils.get_log_buffer("discarded ", read_bytes))
+        self._out_of_sync = False
+
+    async def _recv_frame(self, expected_length):
+        """read a response: its length is known once the function code is received"""
+        if expected_length < 0:
+            return await self._recv_until_silence()
+        response = bytearray(await self._reader.readexactly(2))
+        if response[1] & 0x80:
+            # exception response: slave + function + exception code + crc1 + crc2
+            expected_length = 5
+        response += await self._reader.readexactly(expected_length - 2)
+        return response
+
+    async def _recv_until_silence(self):
+        """read a response until the line is silent"""
+        response = bytearray(await self._reader.read(256))
+        while True:
+            try:
+                read_bytes = await asyncio.wait_for(self._reader.read(256), self.frame_silence)
+            except asyncio.TimeoutError:
+                break
+            if not read_bytes:
+                break
+            response += read_bytes
+        return response
+
+
+class AsyncTcpMaster(ModbusMaster):
+    """
+    Modbus TCP master on an asyncio stream keeping up to window requests in flight.
+    The responses are matched to the requests by transaction id: they can come
+    back in any order. Every request has its own timeout.
+    """
+
+    def __init__(self, reader, writer, timeout_in_sec=5.0, window=8):
+        super(AsyncTcpMaster, self).__init__(timeout_in_sec, delay=0)
+        self._reader = reader
+        self._writer = writer
+        self.window = window
+        self._slots = asyncio.Semaphore(window)
+        # transaction id -> future of the response
+        self._pending = {}
+        self._reader_task = None
+        # why the connection has been lost: the next requests fail at once
+        self._error = None
+        self.is_connect = True
+
+    @classmethod
+    async def open(cls, host="127.0.0.1", port=502, timeout_in_sec=5.0, window=8):
+        """open a connection to a Modbus TCP slave"""
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, timeout_in_sec, window)
+
+    def _do_connect(self):
+        """the stream is opened by the constructor"""
+        pass
+
+    def _do_disconnect(self):
+        """Close the stream: the requests in flight fail"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._writer.close()
+        return True
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
+        return TcpQuery()
+
+    def get_nb_in_flight(self):
+        """number of requests waiting for their response"""
+        return len(self._pending)
+
+    async def execute(self, slave_id, function_code, starting_address=0,
+                      quantity=0, output_value=0, data_format='',
+                      expected_length=-1, pdu="", returns_raw=False, write_starting_address_fc23=0):
+        """same as ModbusMaster.execute: returns an awaitable"""
+        plan = self._get_plan(slave_id, function_code, starting_address, quantity,
+                              output_value, data_format, expected_length, pdu, write_starting_address_fc23)
+        return await self.execute_plan(plan, returns_raw)
+
+    async def execute_plan(self, plan, returns_raw=False, timeout=None):
+        """send the request of a plan returned by prepare and decode the response"""
+        if self._reader_task is None:
+            self._reader_task = asyncio.ensure_future(self._run_reader())
+        async with self._slots:
+            if self._error is not None:
+                raise ModbusInvalidResponseError(str(self._error))
+            query = TcpQuery()
+            request = query.renew_request(plan.request)
+            transaction_id = query.transaction_id
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = future
+            hooked = hooks.has_hooks()
+            try:
+                if hooked:
+                    retval = hooks.call_hooks("modbus.Master.before_send", (self, request))
+                    if retval is not None:
+                        request = retval
+                if self._verbose:
+                    LOGGER.debug(utils.get_log_buffer("-> ", request))
+                self._writer.write(request)
+                await self._writer.drain()
+                try:
+                    response = await asyncio.wait_for(future, self._timeout if timeout is None else timeout)
+                except asyncio.TimeoutError:
+                    raise ModbusInvalidResponseError("Response timeout")
+            finally:
+                self._pending.pop(transaction_id, None)
+        if hooked:
+            retval = hooks.call_hooks("modbus.Master.after_recv", (self, response))
+            if retval is not None:
+                response = retval
+        if self._verbose:
+            LOGGER.debug(utils.get_log_buffer("<- ", response))
+        try:
+            return self._decode_response(plan, response, returns_raw, query)
+        except (ModbusError, ModbusInvalidResponseError) as excpt:
+            if hooked:
+                hooks.call_hooks("modbus.Master.on_error", (self, excpt))
+            raise
+
+    async def execute_many(self, requests, return_exceptions=False):
+        """
+        send a batch of requests concurrently. requests are tuples of arguments of
+        execute. Returns the list of results in the same order
+        """
+        return await asyncio.gather(*[self.execute(*request) for request in requests],
+                                    return_exceptions=return_exceptions)
+
+    async def _run_reader(self):
+        """receive the responses and give them to the requests waiting for them"""
+        error = None
+        try:
+            while True:
+                header = await self._reader.readexactly(_MBAP_LENGTH)
+                length = _check_response_length(header)
+                response = header + await self._reader.readexactly(length - _MBAP_LENGTH)
+                (transaction_id, ) = _TRANSACTION_ID.unpack_from(response)
+                future = self._pending.get(transaction_id)
+                # unknown transactions have timed out
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except asyncio.IncompleteReadError:
+            error = ModbusInvalidResponseError("Connection closed by the slave")
+        except asyncio.CancelledError:
+            error = ModbusInvalidResponseError("Connection closed")
+        except (OSError, ModbusInvalidResponseError) as excpt:
+            error = ModbusInvalidResponseError("Connection lost: {0}".format(excpt))
+        self._error = error
+        self.is_connect = False
+        # the stream is out of sync or closed: nothing else can be received on it
+        self._writer.close()
+        for future in list(self._pending.values()):
+            if not future.done():
+                future.set_exception(error)
+
+
+class AsyncRtuServer(object):
+    """
+    Modbus RTU server on asyncio streams: the requests received on every serial
+    port or TCP connection are handled by one databank in one event loop.
+    A request is handled as soon as all its bytes are received: its length is known
+    from the function code. The silence of the line is only waited for the
+    functions whose length is unknown.
+    """
+
+    def __init__(self, databank=None, error_on_missing_slave=True):
+        """Constructor"""
+        self._databank = databank if databank else DataBank(error_on_missing_slave=error_on_missing_slave)
+        self._verbose = False
+        self._tasks = set()
+        self._servers = []
+
+    def set_verbose(self, verbose):
+        """if verbose is true the sent and received packets will be logged"""
+        self._verbose = verbose
+
+    def get_db(self):
+        """returns the databank"""
+        return self._databank
+
+    def add_slave(self, slave_id, unsigned=True, memory=None):
+        """add slave to the server"""
+        return self._databank.add_slave(slave_id, unsigned, memory)
+
+    def get_slave(self, slave_id):
+        """get the slave with the given id"""
+        return self._databank.get_slave(slave_id)
+
+    def remove_slave(self, slave_id):
+        """remove the slave with the given id"""
+        self._databank.remove_slave(slave_id)
+
+    async def open_serial(self, url, baudrate=9600, **kwargs):
+        """serve the requests received on a serial port (requires pyserial-asyncio)"""
+        if serial_asyncio is None:
+            raise ImportError("pyserial-asyncio is required for opening a serial port")
+        reader, writer = await serial_asyncio.open_serial_connection(url=url, baudrate=baudrate, **kwargs)
+        interframe_timeout = 3.5 * utils.calculate_rtu_inter_char(baudrate)
+        task = asyncio.ensure_future(self.serve(reader, writer, interframe_timeout))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def start_tcp(self, host="127.0.0.1", port=502, interframe_timeout=0.05):
+        """serve the RTU requests received on the TCP connections to host:port"""
+        async def on_connection(reader, writer):
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                await self.serve(reader, writer, interframe_timeout)
+            except asyncio.CancelledError:
+                # the server is stopped
+                pass
+            finally:
+                self._tasks.discard(task)
+        server = await asyncio.start_server(on_connection, host, port)
+        self._servers.append(server)
+        return server
+
+    async def stop(self):
+        """stop all the listeners and the streams being served"""
+        for server in self._servers:
+            server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    async def serve(self, reader, writer, interframe_timeout=0.05):
+        """handle the requests received on a stream until it is closed"""
+        buffer = bytearray()
+        try:
+            while True:
+                if not buffer:
+                    # wait for the beginning of a request
+                    read_bytes = await reader.read(256)
+                    if not read_bytes:
+                        break
+                    buffer += read_bytes
+                length = expected_request_length(buffer)
+                if length is None or len(buffer) < length:
+                    # the rest of the request must follow without silence
+                    try:
+                        read_bytes = await asyncio.wait_for(reader.read(256), interframe_timeout)
+                    except asyncio.TimeoutError:
+                        # incomplete request
+                        del buffer[:]
+                        continue
+                    if not read_bytes:
+                        break
+                    buffer += read_bytes
+                    continue
+                if length < 0:
+                    # unknown function: the request ends with the silence of the line
+                    while True:
+                        try:
+                            read_bytes = await asyncio.wait_for(reader.read(256), interframe_timeout)
+                        except asyncio.TimeoutError:
+                            break
+                        if not read_bytes:
+                            break
+                        buffer += read_bytes
+                    length = len(buffer)
+                request = buffer[:length]
+                del buffer[:length]
+                if not crc.check_frame(request):
+                    # lost synchronization: drop what has been received
+                    del buffer[:]
+                    continue
+                response = self._handle(request)
+                if response:
+                    writer.write(response)
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    def _handle(self, request):
+        """handle a received message"""
+        if self._verbose:
+            LOGGER.debug(utils.get_log_buffer("-->", request))
+        response = self._databank.handle_request(RtuQuery(), request)
+        if response and self._verbose:
+            LOGGER.debug(utils.get_log_buffer("<--", response))
+        return response
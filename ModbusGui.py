@@ -9,6 +9,7 @@ from threading import Thread
 import Modbus
 import ModbusSerial
 from defines import *
+from exceptions import InvalidArgumentError
 
 
 class MasterGui:
@@ -417,7 +418,10 @@ class SlaveGui:
             item = self.ui.HoldingRegister.item(row, col)
             if item is not None:
                 print(f"Cell at row {row}, column {col} changed to: {item.text()}")
-                self.slave.set_values('3', self.register_address+row, int(item.text()))
+                try:
+                    self.slave.set_values('3', self.register_address+row, int(item.text()))
+                except (ValueError, InvalidArgumentError) as excpt:
+                    QMessageBox.about(self.ui, 'Error', 'Invalid value: {0}'.format(excpt))
         else:
             QMessageBox.about(self.ui, 'Error', 'Please run server first!')
 
@@ -1,12 +1,103 @@
 from Modbus import ModbusMaster, Query, DataBank, ModbusServer
+from defines import *
 from exceptions import *
+import hooks
 import utils
+import crc
+import rtt
 
 # import serial
 import struct
 from typing import Any
 import time
 
+# length of the requests (slave + pdu + crc) of the functions with a fixed size
+_FIXED_REQUEST_LENGTHS = {
+    READ_COILS: 8,
+    READ_DISCRETE_INPUTS: 8,
+    READ_HOLDING_REGISTERS: 8,
+    READ_INPUT_REGISTERS: 8,
+    WRITE_SINGLE_COIL: 8,
+}
+# functions whose request carries a byte count: position of the byte count, length without the data
+_BYTE_COUNT_REQUESTS = {
+    WRITE_MULTIPLE_COILS: (6, 9),
+    WRITE_MULTIPLE_REGISTERS: (6, 9),
+    READ_WRITE_MULTIPLE_REGISTERS: (10, 13),
+}
+
+
+def expected_request_length(frame):
+    """
+    returns the length of the RTU request beginning with the given bytes:
+    None if more bytes are needed for knowing it, -1 if the function is unknown
+    """
+    if len(frame) < 2:
+        return None
+    function_code = frame[1]
+    length = _FIXED_REQUEST_LENGTHS.get(function_code)
+    if length is not None:
+        return length
+    if function_code in _BYTE_COUNT_REQUESTS:
+        (position, length) = _BYTE_COUNT_REQUESTS[function_code]
+        if len(frame) <= position:
+            return None
+        return length + frame[position]
+    return -1
+
+
+class RtuTiming(object):
+    """
+    Silence of 3.5 characters between the frames of a RTU line. The end of the
+    last frame is measured with time.monotonic_ns and the transmission time of
+    the frames sent, so a frame is only delayed by what remains of the silence.
+    With no_delay (USB adapters doing their own timing), nothing is waited for
+    except the turnaround given after a broadcast.
+    """
+    def __init__(self, baudrate, no_delay=False):
+        """Constructor"""
+        self.no_delay = no_delay
+        # 11 bits per character: start, 8 data bits, parity or stop, stop
+        self.char_time_ns = int(11e9 / baudrate)
+        self.silence_ns = int(3.5 * utils.calculate_rtu_inter_char(baudrate) * 1e9)
+        self._end_of_frame_ns = 0
+        # no frame is sent before (the slaves handle a broadcast request meanwhile)
+        self._ready_ns = 0
+
+    def frame_time_ns(self, nb_bytes):
+        """transmission time of a frame"""
+        return nb_bytes * self.char_time_ns
+
+    def wait_silence(self):
+        """wait until the line has been silent for 3.5 characters and the turnaround is over"""
+        if self.no_delay:
+            deadline_ns = self._ready_ns
+        else:
+            deadline_ns = max(self._end_of_frame_ns + self.silence_ns, self._ready_ns)
+        if not deadline_ns:
+            return
+        remaining_ns = deadline_ns - time.monotonic_ns()
+        if remaining_ns > 0:
+            time.sleep(remaining_ns / 1e9)
+
+    def frame_sent(self, nb_bytes, start_ns):
+        """a frame written at start_ns is sent: it is on the line until its last character is"""
+        self._end_of_frame_ns = max(time.monotonic_ns(), start_ns + self.frame_time_ns(nb_bytes))
+
+    def turnaround(self, delay_ns):
+        """the next frame is sent delay_ns after the end of the last frame at the earliest"""
+        self._ready_ns = self._end_of_frame_ns + delay_ns
+
+    def frame_received(self):
+        """the last character of a frame has just been received"""
+        self._end_of_frame_ns = time.monotonic_ns()
+
+    @property
+    def end_of_frame_ns(self):
+        """time of the end of the last frame sent or received"""
+        return self._end_of_frame_ns
+
+
 class RtuQuery(Query):
     def __init__(self):
         """Constructor"""
@@ -20,52 +111,58 @@ class RtuQuery(Query):
         if (self._request_address < 0) or (self._request_address > 255):
             raise InvalidArgumentError("Invalid address {0}".format(self._request_address))
         data = struct.pack(">B", self._request_address) + pdu
-        crc = struct.pack(">H", utils.calculate_crc(data))
-        return data + crc
+        return data + crc.pack_crc(crc.crc16(data))
 
     def parse_response(self, response):
-        """Extract the pdu from the Modbus RTU response"""
+        """Extract the pdu from the Modbus RTU response (a memoryview on the response: no copy)"""
         if len(response) < 3:
             raise ModbusInvalidResponseError("Response length is invalid {0}".format(len(response)))
 
-        (self._response_address, ) = struct.unpack(">B", response[0:1])
+        self._response_address = response[0]
         if self._request_address != self._response_address:
             raise ModbusInvalidResponseError(
                 "Response address {0} is different from request address {1}".format(
                     self._response_address, self._request_address
                 )
             )
-        (crc, ) = struct.unpack(">H", response[-2:])
-        if crc != utils.calculate_crc(response[:-2]):
+        if not crc.check_frame(response):
             raise ModbusInvalidResponseError("Invalid CRC in response")
 
-        return response[1:-2]
+        return memoryview(response)[1:-2]
 
     def parse_request(self, request):
-        """Extract the pdu from the Modbus RTU request"""
+        """Extract the pdu from the Modbus RTU request (a memoryview on the request: no copy)"""
         if len(request) < 3:
             raise ModbusInvalidRequestError("Request length is invalid {0}".format(len(request)))
 
-        (self._request_address, ) = struct.unpack(">B", request[0:1])
+        self._request_address = request[0]
 
-        (crc, ) = struct.unpack(">H", request[-2:])
-        if crc != utils.calculate_crc(request[:-2]):
+        if not crc.check_frame(request):
             raise ModbusInvalidRequestError("Invalid CRC in request")
 
-        return self._request_address, request[1:-2]
+        return self._request_address, memoryview(request)[1:-2]
 
     def build_response(self, response_pdu):
         """Build the response"""
         self._response_address = self._request_address
         data = struct.pack(">B", self._response_address) + response_pdu
-        crc = struct.pack(">H", utils.calculate_crc(data))
-        return data + crc
+        return data + crc.pack_crc(crc.crc16(data))
 
 
 class RtuMaster(ModbusMaster):
-    """Subclass of ModbusMaster. Implements the Modbus RTU MAC layer"""
-
-    def __init__(self, serial,  delay=0.05, **kwargs: Any):
+    """
+    Subclass of ModbusMaster. Implements the Modbus RTU MAC layer.
+    The 3.5 characters of silence between frames are enforced by a RtuTiming
+    (no_delay=True disables it); delay is an extra wait after every request.
+    The next request waits broadcast_delay seconds after a broadcast request
+    (0.05s by default, the delay the master waited after every request before)
+    so that the slaves have handled it.
+    The time waited for a response is adapted to the round trip time measured
+    for every slave and function code, between timeout_floor and the timeout
+    of the master (see rtt.RttEstimator and get_rtt_stats)
+    """
+
+    def __init__(self, serial,  delay=0, **kwargs: Any):
         # self._serial = serial.Serial(port=serial_port,
         #                              baudrate=baud_rate,
         #                              bytesize=byte_size,
@@ -74,14 +171,23 @@ class RtuMaster(ModbusMaster):
         #                              xonxoff=0)  # 创建串口对象
         self._serial = serial
         self.use_sw_timeout = False
-        super(RtuMaster, self).__init__(response_timeout=self._serial.timeout, delay=delay)
+        # the timeout of the serial port is the longest time waited for a response
+        response_timeout = self._serial.timeout if self._serial.timeout is not None else 1.0
+        super(RtuMaster, self).__init__(response_timeout=response_timeout, delay=delay)
 
 
         interchar_multiplier = 1.5
         interframe_multiplier = 3.5
         self._t0 = utils.calculate_rtu_inter_char(self._serial.baudrate)
         self._serial.inter_byte_timeout = interchar_multiplier * self._t0
-        self.set_timeout(interframe_multiplier * self._t0)
+        # end of a response whose length is unknown
+        self._interframe_timeout = interframe_multiplier * self._t0
+        self._timing = RtuTiming(self._serial.baudrate, kwargs.pop('no_delay', False))
+        self._rtt = rtt.RttEstimator(kwargs.pop('timeout_floor', 0.05), response_timeout)
+        self.broadcast_delay = kwargs.pop('broadcast_delay', 0.05)
+        self._request_end_ns = 0
+        self._nb_received = 0
+        self.set_timeout(response_timeout)
 
         # self._bandrate = band_rate
         # self._bytesize = byte_size
@@ -97,13 +203,14 @@ class RtuMaster(ModbusMaster):
         """Close the serial port if still opened"""
         if self._serial.is_open:
             self._serial.close()
-            # call_hooks("modbus_rtu.RtuMaster.after_close", (self,))
+            hooks.call_hooks("modbus_rtu.RtuMaster.after_close", (self,))
             return True
 
     def set_timeout(self, timeout_in_sec, use_sw_timeout=False):
         """Change the timeout value"""
         ModbusMaster.set_timeout(self, timeout_in_sec)
         self._serial.timeout = timeout_in_sec
+        self._rtt.ceiling = timeout_in_sec
         # Use software based timeout in case the timeout functionality provided by the serial port is unreliable
         self.use_sw_timeout = use_sw_timeout
 
@@ -112,9 +219,51 @@ class RtuMaster(ModbusMaster):
         self._serial.reset_input_buffer()
         self._serial.reset_output_buffer()
 
+        self._timing.wait_silence()
+        start_ns = time.monotonic_ns()
         self._serial.write(request)
         self._serial.flush()
-
+        self._timing.frame_sent(len(request), start_ns)
+        self._request_end_ns = self._timing.end_of_frame_ns
+
+    def get_rtt_stats(self):
+        """returns the round trip time estimations and the timeouts by (slave, function code)"""
+        return self._rtt.get_stats()
+
+    def execute_plan(self, plan, returns_raw=False):
+        """wait for the response as long as the round trip time of the slave requires"""
+        if plan.slave_id == 0:
+            result = super(RtuMaster, self).execute_plan(plan, returns_raw)
+            self._timing.turnaround(int(self.broadcast_delay * 1e9))
+            return result
+        key = (plan.slave_id, plan.function_code)
+        # the time the response takes on the line is not part of the round trip time
+        transmission_ns = self._timing.frame_time_ns(plan.expected_length) if plan.expected_length > 0 else 0
+        self._set_serial_timeout(self._rtt.get_timeout(key, transmission_ns / 1e9))
+        self._nb_received = 0
+        try:
+            result = super(RtuMaster, self).execute_plan(plan, returns_raw)
+        except ModbusInvalidResponseError:
+            if self._nb_received == 0:
+                self._rtt.add_timeout(key)
+            raise
+        # the exception responses are shorter than the responses expected: they are not measured
+        if plan.expected_length < 0 or self._nb_received == plan.expected_length:
+            self._add_rtt_sample(key, plan.expected_length)
+        return result
+
+    def _set_serial_timeout(self, timeout):
+        """change the timeout of the serial port (reconfigured by pyserial every time it is set)"""
+        if self._serial.timeout != timeout:
+            self._serial.timeout = timeout
+
+    def _add_rtt_sample(self, key, expected_length):
+        """measure the round trip time of the last transaction"""
+        rtt_ns = self._timing.end_of_frame_ns - self._request_end_ns - self._timing.frame_time_ns(self._nb_received)
+        if expected_length < 0:
+            # the end of the response has been detected by the silence of the line
+            rtt_ns -= int(self._interframe_timeout * 1e9)
+        self._rtt.add_sample(key, max(rtt_ns, 0) / 1e9)
 
     def _recv(self, expected_length=-1):
         """Receive the response from the slave"""
@@ -133,11 +282,16 @@ class RtuMaster(ModbusMaster):
                 read_duration = 0
             if (not read_bytes) or (read_duration > self._serial.timeout):
                 break
+            if expected_length < 0 and not response:
+                # the response has begun: it ends with the silence of the line
+                self._set_serial_timeout(self._interframe_timeout)
             response += read_bytes
 
             if 0 <= expected_length <= len(response):
                 break
             readed_len += len(read_bytes)
+        self._timing.frame_received()
+        self._nb_received = len(response)
         return response
 
 
@@ -152,6 +306,7 @@ class RtuServer(ModbusServer):
     def __init__(self, serial, databank=None, error_on_missing_slave=True, **kwargs):
         interframe_multiplier = kwargs.pop('interframe_multiplier', 3.5)
         interchar_multiplier = kwargs.pop('interchar_multiplier', 1.5)
+        no_delay = kwargs.pop('no_delay', False)
 
         databank = databank if databank else DataBank(error_on_missing_slave=error_on_missing_slave)
         super(RtuServer, self).__init__(databank)
@@ -161,15 +316,16 @@ class RtuServer(ModbusServer):
         self._t0 = utils.calculate_rtu_inter_char(self._serial.baudrate)
         self._serial.inter_byte_timeout = interchar_multiplier * self._t0
         self.set_timeout(interframe_multiplier * self._t0)
+        self._timing = RtuTiming(self._serial.baudrate, no_delay)
 
         self._block_on_first_byte = False
 
     def close(self):
         """close the serial communication"""
         if self._serial.is_open:
-            # call_hooks("modbus_rtu.RtuServer.before_close", (self, ))
+            hooks.call_hooks("modbus_rtu.RtuServer.before_close", (self, ))
             self._serial.close()
-            # call_hooks("modbus_rtu.RtuServer.after_close", (self, ))
+            hooks.call_hooks("modbus_rtu.RtuServer.after_close", (self, ))
 
     def set_timeout(self, timeout):
         self._timeout = timeout
@@ -202,9 +358,9 @@ class RtuServer(ModbusServer):
     def _do_init(self):
         """initialize the serial connection"""
         if not self._serial.is_open:
-            # call_hooks("modbus_rtu.RtuServer.before_open", (self, ))
+            hooks.call_hooks("modbus_rtu.RtuServer.before_open", (self, ))
             self._serial.open()
-            # call_hooks("modbus_rtu.RtuServer.after_open", (self, ))
+            hooks.call_hooks("modbus_rtu.RtuServer.after_open", (self, ))
 
     def _do_exit(self):
         """close the serial connection"""
@@ -226,10 +382,20 @@ class RtuServer(ModbusServer):
                     self._serial.open()
                 self._serial.timeout = self._timeout
 
-            # Read rest of the request
+            # Read rest of the request: its length is known from the function code
             while True:
+                length = expected_request_length(request)
+                if length is not None and length < 0:
+                    # unknown function: the end of the request is the silence of the line
+                    nb_bytes = 128
+                elif length is None:
+                    nb_bytes = 1
+                else:
+                    nb_bytes = length - len(request)
+                    if nb_bytes <= 0:
+                        break
                 try:
-                    read_bytes = self._serial.read(128)
+                    read_bytes = self._serial.read(nb_bytes)
                     if not read_bytes:
                         break
                 except Exception as e:
@@ -240,15 +406,18 @@ class RtuServer(ModbusServer):
 
             # parse the request
             if request:
+                self._timing.frame_received()
                 response = self._handle(request)
 
                 if response:
                     if self._serial.in_waiting > 0:
                         pass
                     else:
+                        self._timing.wait_silence()
+                        start_ns = time.monotonic_ns()
                         self._serial.write(response)
                         self._serial.flush()
-                        time.sleep(self.get_timeout())
+                        self._timing.frame_sent(len(response), start_ns)
 
         except Exception as excpt:
             pass
@@ -0,0 +1,684 @@
+""" Modbus TCP: MBAP framing, masters with persistent connections and a selector based server """
+
+import collections
+from concurrent.futures import Future
+import select
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from Modbus import ModbusMaster, ModbusServer, DataBank, Query, LOGGER
+from exceptions import *
+import hooks
+
+# transaction id, protocol id, length, unit id
+_MBAP = struct.Struct(">HHHB")
+_MBAP_LENGTH = _MBAP.size
+_TRANSACTION_ID = struct.Struct(">H")
+# largest frame: MBAP header + pdu of 253 bytes
+_MAX_ADU_LENGTH = 260
+
+
+class TcpQuery(Query):
+    """Subclass of a Query. Adds the Modbus TCP (MBAP) header to the PDU"""
+
+    _last_transaction_id = 0
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Constructor"""
+        super(TcpQuery, self).__init__()
+        self._request_mbap = (0, 0, 0, 0)
+        self._response_mbap = (0, 0, 0, 0)
+
+    @classmethod
+    def _get_transaction_id(cls):
+        """returns a new transaction id"""
+        with cls._lock:
+            cls._last_transaction_id = (cls._last_transaction_id + 1) & 0xFFFF
+            return cls._last_transaction_id
+
+    def build_request(self, pdu, slave):
+        """Add the Modbus TCP part to the request"""
+        if (slave < 0) or (slave > 255):
+            raise InvalidArgumentError("{0} Invalid value for slave id".format(slave))
+        self._request_mbap = (self._get_transaction_id(), 0, len(pdu) + 1, slave)
+        return _MBAP.pack(*self._request_mbap) + pdu
+
+    def renew_request(self, request):
+        """returns the same request with a new transaction id"""
+        transaction_id = self._get_transaction_id()
+        self._request_mbap = (transaction_id, ) + _MBAP.unpack_from(request)[1:]
+        return _TRANSACTION_ID.pack(transaction_id) + request[2:]
+
+    @property
+    def transaction_id(self):
+        """the transaction id of the last request built"""
+        return self._request_mbap[0]
+
+    def parse_response(self, response):
+        """Extract the pdu from the Modbus TCP response (a memoryview on the response: no copy)"""
+        if len(response) <= _MBAP_LENGTH:
+            raise ModbusInvalidResponseError("Response length is only {0} bytes. ".format(len(response)))
+        self._response_mbap = _MBAP.unpack_from(response)
+        (transaction_id, protocol_id, length, unit_id) = self._response_mbap
+        if transaction_id != self._request_mbap[0]:
+            raise ModbusInvalidResponseError(
+                "Response transaction id {0} is different from request transaction id {1}".format(
+                    transaction_id, self._request_mbap[0]
+                )
+            )
+        if protocol_id != 0:
+            raise ModbusInvalidResponseError("Invalid protocol id {0}".format(protocol_id))
+        if length != len(response) - 6:
+            raise ModbusInvalidResponseError(
+                "Response length is {0} while receiving {1} bytes. ".format(length, len(response) - 6)
+            )
+        if unit_id != self._request_mbap[3]:
+            raise ModbusInvalidResponseError(
+                "Response unit id {0} is different from request unit id {1}".format(unit_id, self._request_mbap[3])
+            )
+        return memoryview(response)[_MBAP_LENGTH:]
+
+    def parse_request(self, request):
+        """Extract the pdu from a Modbus TCP request (a memoryview on the request: no copy)"""
+        if len(request) <= _MBAP_LENGTH:
+            raise ModbusInvalidRequestError("Request length is only {0} bytes. ".format(len(request)))
+        self._request_mbap = _MBAP.unpack_from(request)
+        (transaction_id, protocol_id, length, unit_id) = self._request_mbap
+        if protocol_id != 0:
+            raise ModbusInvalidRequestError("Invalid protocol id {0}".format(protocol_id))
+        if length != len(request) - 6:
+            raise ModbusInvalidRequestError(
+                "Request length is {0} while receiving {1} bytes. ".format(length, len(request) - 6)
+            )
+        return unit_id, memoryview(request)[_MBAP_LENGTH:]
+
+    def build_response(self, response_pdu):
+        """Build the response: same transaction and unit id as the request"""
+        (transaction_id, protocol_id, length, unit_id) = self._request_mbap
+        self._response_mbap = (transaction_id, protocol_id, len(response_pdu) + 1, unit_id)
+        return _MBAP.pack(*self._response_mbap) + response_pdu
+
+
+def get_frame_length(header):
+    """returns the length of the TCP frame beginning with the given MBAP header"""
+    (length, ) = struct.unpack_from(">H", header, 4)
+    return 6 + length
+
+
+def _check_response_length(header):
+    """returns the length of the response beginning with the given MBAP header, if it is valid"""
+    length = get_frame_length(header)
+    # the length counts the unit id and the pdu: at least the function code
+    if length < _MBAP_LENGTH + 1 or length > _MAX_ADU_LENGTH:
+        raise ModbusInvalidResponseError("Invalid MBAP length {0}".format(length - 6))
+    return length
+
+
+class TcpConnectionPool(object):
+    """Persistent TCP connections kept open between the transactions, keyed by host:port"""
+
+    def __init__(self, max_idle_per_host=8):
+        """Constructor"""
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.nb_connections = 0
+
+    @staticmethod
+    def _key(host, port):
+        return "{0}:{1}".format(host, port)
+
+    def acquire(self, host, port, timeout):
+        """returns an idle connection to host:port or a new one"""
+        key = self._key(host, port)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                sock = idle.pop() if idle else None
+            if sock is None:
+                break
+            if self._is_alive(sock):
+                sock.settimeout(timeout)
+                return sock
+            sock.close()
+        sock = socket.create_connection((host, port), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self.nb_connections += 1
+        return sock
+
+    @staticmethod
+    def _is_alive(sock):
+        """an idle connection is readable only if it has been closed by the peer (or has garbage)"""
+        try:
+            readable = select.select([sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def release(self, host, port, sock):
+        """give back a connection: it is kept open for the next transactions"""
+        key = self._key(host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(sock)
+                return
+        sock.close()
+
+    def close_all(self):
+        """close all the idle connections"""
+        with self._lock:
+            connections = [sock for idle in self._idle.values() for sock in idle]
+            self._idle.clear()
+        for sock in connections:
+            sock.close()
+
+
+# the pool shared by the masters by default
+DEFAULT_POOL = TcpConnectionPool()
+
+
+class TcpMaster(ModbusMaster):
+    """
+    Subclass of ModbusMaster. Implements the Modbus TCP MAC layer.
+    The connections come from a pool: disconnect gives the connection back to
+    the pool and the next connect to the same host:port reuses it.
+    With pool=None, the connection is really opened and closed.
+    """
+
+    def __init__(self, host="127.0.0.1", port=502, timeout_in_sec=5.0, delay=0, pool=DEFAULT_POOL):
+        super(TcpMaster, self).__init__(response_timeout=timeout_in_sec, delay=delay)
+        self._host = host
+        self._port = port
+        self._pool = pool
+        self._sock = None
+
+    def _do_connect(self):
+        """Connect to the Modbus slave"""
+        if self._pool is not None:
+            self._sock = self._pool.acquire(self._host, self._port, self._timeout)
+        else:
+            self._sock = socket.create_connection((self._host, self._port), self._timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _do_disconnect(self):
+        """give back or close the connection"""
+        if self._sock is not None:
+            if self._pool is not None:
+                self._pool.release(self._host, self._port, self._sock)
+            else:
+                self._sock.close()
+            self._sock = None
+            if hooks.has_hooks():
+                hooks.call_hooks("modbus_tcp.TcpMaster.after_disconnect", (self, ))
+        return True
+
+    def _drop_connection(self):
+        """close a connection which is broken: it must not go back to the pool"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self.is_connect = False
+
+    def set_timeout(self, timeout_in_sec):
+        """Change the timeout value"""
+        super(TcpMaster, self).set_timeout(timeout_in_sec)
+        if self._sock is not None:
+            self._sock.settimeout(timeout_in_sec)
+
+    def _send(self, request):
+        """Send request to the slave"""
+        try:
+            self._sock.sendall(request)
+        except OSError:
+            # the pooled connection may have been closed by the slave: retry once with a new one
+            self._drop_connection()
+            self.connect()
+            self._sock.sendall(request)
+
+    def _recv(self, expected_length=-1):
+        """Receive the response from the slave: its length is given by the MBAP header"""
+        try:
+            response = self._recv_exactly(_MBAP_LENGTH)
+            response += self._recv_exactly(_check_response_length(response) - _MBAP_LENGTH)
+        except socket.timeout:
+            self._drop_connection()
+            raise ModbusInvalidResponseError("Response timeout")
+        except (OSError, ModbusInvalidResponseError):
+            self._drop_connection()
+            raise
+        return response
+
+    def _recv_exactly(self, length):
+        """read length bytes from the socket"""
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        while received < length:
+            nb_bytes = self._sock.recv_into(view[received:])
+            if nb_bytes == 0:
+                raise ModbusInvalidResponseError("Connection closed by the slave")
+            received += nb_bytes
+        return data
+
+    def execute_plan(self, plan, returns_raw=False):
+        """every transaction gets a new transaction id"""
+        plan.request = plan.query.renew_request(plan.request)
+        return super(TcpMaster, self).execute_plan(plan, returns_raw)
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
+        return TcpQuery()
+
+
+class _Transaction(object):
+    """a request waiting for its response"""
+    __slots__ = ("future", "plan", "query", "deadline", "returns_raw")
+
+    def __init__(self, future, plan, query, deadline, returns_raw):
+        self.future = future
+        self.plan = plan
+        self.query = query
+        self.deadline = deadline
+        self.returns_raw = returns_raw
+
+
+class PipelinedTcpMaster(TcpMaster):
+    """
+    Modbus TCP master keeping up to window requests in flight on its connection.
+    The responses are matched to the requests by transaction id: they can
+    come back in any order. Every request has its own timeout.
+    submit returns a concurrent.futures.Future, execute waits for the result and
+    execute_many sends a batch of requests.
+    """
+
+    def __init__(self, host="127.0.0.1", port=502, timeout_in_sec=5.0, window=8):
+        super(PipelinedTcpMaster, self).__init__(host, port, timeout_in_sec, delay=0, pool=None)
+        self.window = window
+        self._slots = threading.BoundedSemaphore(window)
+        self._pending = {}
+        # _lock protects the transactions in flight, the reader needs it for every response:
+        # it is never held while sending. _send_lock keeps the requests whole on the connection
+        self._lock = threading.RLock()
+        self._send_lock = threading.Lock()
+        self._reader = None
+
+    def _do_connect(self):
+        """Connect and start the thread receiving the responses"""
+        super(PipelinedTcpMaster, self)._do_connect()
+        self._reader = threading.Thread(target=self._run_reader, args=(self._sock, ))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _do_disconnect(self):
+        """Close the connection: the requests in flight fail"""
+        sock, reader = self._sock, self._reader
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        ret = super(PipelinedTcpMaster, self)._do_disconnect()
+        if reader is not None and reader is not threading.current_thread():
+            reader.join()
+        self._reader = None
+        return ret
+
+    def submit(self, slave_id, function_code, starting_address=0,
+               quantity=0, output_value=0, data_format='',
+               expected_length=-1, pdu="", returns_raw=False, timeout=None, write_starting_address_fc23=0):
+        """send a request without waiting for its response. Returns a Future"""
+        plan = self._get_plan(slave_id, function_code, starting_address, quantity,
+                              output_value, data_format, expected_length, pdu, write_starting_address_fc23)
+        return self.submit_plan(plan, returns_raw, timeout)
+
+    def submit_plan(self, plan, returns_raw=False, timeout=None):
+        """send the request of a plan without waiting for its response. Returns a Future"""
+        # wait for a free slot in the window
+        self._slots.acquire()
+        future = Future()
+        query = TcpQuery()
+        request = query.renew_request(plan.request)
+        transaction_id = query.transaction_id
+        deadline = time.monotonic() + (self._timeout if timeout is None else timeout)
+        try:
+            with self._send_lock:
+                self.connect()
+                sock = self._sock
+                with self._lock:
+                    self._pending[transaction_id] = _Transaction(future, plan, query, deadline, returns_raw)
+                sock.sendall(request)
+        except Exception as excpt:
+            with self._lock:
+                self._pending.pop(transaction_id, None)
+            if not future.done():
+                self._slots.release()
+                future.set_exception(excpt)
+        return future
+
+    def execute(self, slave_id, function_code, starting_address=0,
+                quantity=0, output_value=0, data_format='',
+                expected_length=-1, pdu="", returns_raw=False, write_starting_address_fc23=0):
+        """send a request and wait for its response"""
+        return self.submit(slave_id, function_code, starting_address, quantity, output_value, data_format,
+                           expected_length, pdu, returns_raw, None, write_starting_address_fc23).result()
+
+    def execute_plan(self, plan, returns_raw=False):
+        """send the request of a plan and wait for its response"""
+        return self.submit_plan(plan, returns_raw).result()
+
+    def execute_many(self, requests, return_exceptions=False):
+        """
+        send a batch of requests, keeping the window full. requests are tuples of
+        arguments of execute. Returns the list of results in the same order; with
+        return_exceptions the errors are returned instead of raised
+        """
+        futures = [self.submit(*request) for request in requests]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as excpt:
+                if not return_exceptions:
+                    raise
+                results.append(excpt)
+        return results
+
+    def get_nb_in_flight(self):
+        """number of requests waiting for their response"""
+        with self._lock:
+            return len(self._pending)
+
+    def _complete(self, transaction_id, error=None, response=None):
+        """set the result of a transaction and free its slot"""
+        with self._lock:
+            transaction = self._pending.pop(transaction_id, None)
+        if transaction is None:
+            # unknown or already timed out
+            return
+        self._slots.release()
+        if error is None:
+            try:
+                result = self._decode_response(transaction.plan, response, transaction.returns_raw, transaction.query)
+            except Exception as excpt:
+                error = excpt
+        if error is None:
+            transaction.future.set_result(result)
+        else:
+            if hooks.has_hooks():
+                hooks.call_hooks("modbus.Master.on_error", (self, error))
+            transaction.future.set_exception(error)
+
+    def _expire(self, now):
+        """fail the transactions whose deadline is over. Returns the time to the next deadline"""
+        with self._lock:
+            expired = [tid for (tid, transaction) in self._pending.items() if transaction.deadline <= now]
+            deadlines = [transaction.deadline for transaction in self._pending.values() if transaction.deadline > now]
+        for transaction_id in expired:
+            self._complete(transaction_id, ModbusInvalidResponseError("Response timeout"))
+        return (min(deadlines) - now) if deadlines else 0.1
+
+    def _run_reader(self, sock):
+        """main function of the thread receiving the responses"""
+        buffer = bytearray()
+        error = None
+        try:
+            while True:
+                wait = self._expire(time.monotonic())
+                if not select.select([sock], [], [], wait)[0]:
+                    continue
+                data = sock.recv(4096)
+                if not data:
+                    error = ModbusInvalidResponseError("Connection closed by the slave")
+                    break
+                buffer += data
+                while len(buffer) >= _MBAP_LENGTH:
+                    length = _check_response_length(buffer)
+                    if len(buffer) < length:
+                        break
+                    response = buffer[:length]
+                    del buffer[:length]
+                    (transaction_id, ) = _TRANSACTION_ID.unpack_from(response)
+                    self._complete(transaction_id, response=response)
+        except (OSError, ModbusInvalidResponseError) as excpt:
+            error = ModbusInvalidResponseError("Connection lost: {0}".format(excpt))
+        # the connection is lost: all the requests in flight fail
+        with self._lock:
+            transaction_ids = list(self._pending)
+            if self._sock is sock:
+                self._drop_connection()
+        for transaction_id in transaction_ids:
+            self._complete(transaction_id, error)
+
+
+class _TcpConnection(object):
+    """a client connection of the server and its buffers"""
+    __slots__ = ("sock", "address", "inbuf", "outbuf")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+
+class TcpServer(ModbusServer):
+    """
+    Modbus TCP server: one thread serves all the client connections with a
+    selector (epoll on Linux) and non-blocking sockets. The requests are framed
+    by their MBAP header, even when they are received in several parts.
+    A connection is refused when max_connections clients are connected.
+    A subclass can answer the requests later, from another thread: it overrides
+    _dispatch and gives the responses to _complete.
+    """
+
+    # most bytes read from a connection at once
+    recv_size = 4096
+
+    def __init__(self, port=502, address="127.0.0.1", timeout_in_sec=1.0, databank=None,
+                 error_on_missing_slave=True, max_connections=1024, backlog=128):
+        databank = databank if databank else DataBank(error_on_missing_slave=error_on_missing_slave)
+        super(TcpServer, self).__init__(databank)
+        self._address = (address, port)
+        self._timeout = timeout_in_sec
+        self.max_connections = max_connections
+        self._backlog = backlog
+        self._selector = None
+        self._sock = None
+        self._connections = {}
+        # written by stop and _complete to interrupt the select
+        self._waker = None
+        # responses given by other threads: (connection, response)
+        self._completed = collections.deque()
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
+        return TcpQuery()
+
+    def get_nb_connections(self):
+        """number of connected clients"""
+        return len(self._connections)
+
+    @property
+    def port(self):
+        """the port listened: useful when the server is created with port 0"""
+        return self._sock.getsockname()[1] if self._sock is not None else self._address[1]
+
+    def start(self):
+        """Start the server: the socket is listening when this returns"""
+        self._do_listen()
+        super(TcpServer, self).start()
+
+    def stop(self):
+        """stop the server and close all the connections"""
+        if self._thread.is_alive():
+            # cleared before the wake up: the server thread must not select again
+            self._go.clear()
+            self._wake()
+        super(TcpServer, self).stop()
+
+    def _wake(self):
+        """interrupt the select of the server thread"""
+        waker = self._waker
+        if waker is not None:
+            try:
+                waker[1].send(b"\0")
+            except OSError:
+                # full: the server thread is already woken up
+                pass
+
+    def _do_listen(self):
+        """open the listening socket"""
+        if self._sock is not None:
+            return
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self._address)
+        self._sock.listen(self._backlog)
+        self._sock.setblocking(False)
+
+    def _do_init(self):
+        """register the listening socket"""
+        self._do_listen()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        self._waker = socket.socketpair()
+        for sock in self._waker:
+            sock.setblocking(False)
+        self._selector.register(self._waker[0], selectors.EVENT_READ)
+
+    def _do_exit(self):
+        """close all the sockets"""
+        for connection in list(self._connections.values()):
+            self._close_connection(connection)
+        self._selector.close()
+        self._selector = None
+        self._sock.close()
+        self._sock = None
+        for sock in self._waker:
+            sock.close()
+        self._waker = None
+        self._completed.clear()
+
+    def _do_run(self):
+        """wait for the sockets which are ready and serve them"""
+        for (key, events) in self._selector.select(self._timeout):
+            if key.fileobj is self._sock:
+                self._accept()
+            elif key.data is None:
+                # woken up by stop or _complete
+                try:
+                    self._waker[0].recv(4096)
+                except OSError:
+                    pass
+                self._send_completed()
+            else:
+                connection = key.data
+                if events & selectors.EVENT_WRITE:
+                    self._flush(connection)
+                if events & selectors.EVENT_READ and connection.sock.fileno() >= 0:
+                    self._read(connection)
+
+    def _accept(self):
+        """accept the pending connections"""
+        while True:
+            try:
+                (sock, address) = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as excpt:
+                LOGGER.error("Error while accepting a connection: %s", excpt)
+                return
+            if len(self._connections) >= self.max_connections:
+                LOGGER.warning("Connection from %s refused: %d clients connected", address, len(self._connections))
+                sock.close()
+                continue
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _TcpConnection(sock, address)
+            self._connections[sock.fileno()] = connection
+            self._selector.register(sock, selectors.EVENT_READ, connection)
+            if hooks.has_hooks():
+                hooks.call_hooks("modbus_tcp.TcpServer.on_connect", (self, sock, address))
+
+    def _close_connection(self, connection):
+        """unregister and close a client connection"""
+        sock = connection.sock
+        if self._connections.get(sock.fileno()) is not connection:
+            return
+        del self._connections[sock.fileno()]
+        self._selector.unregister(sock)
+        sock.close()
+        if hooks.has_hooks():
+            hooks.call_hooks("modbus_tcp.TcpServer.on_disconnect", (self, connection.address))
+
+    def _read(self, connection):
+        """receive data and handle the complete requests"""
+        try:
+            data = connection.sock.recv(self.recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close_connection(connection)
+            return
+        inbuf = connection.inbuf
+        inbuf += data
+        while len(inbuf) >= _MBAP_LENGTH:
+            length = get_frame_length(inbuf)
+            if length <= _MBAP_LENGTH:
+                # not a Modbus client: the framing can not be recovered
+                self._close_connection(connection)
+                return
+            if len(inbuf) < length:
+                # partial frame: wait for the rest
+                break
+            request = bytes(inbuf[:length])
+            del inbuf[:length]
+            self._dispatch(connection, request)
+        if connection.outbuf:
+            self._flush(connection)
+
+    def _dispatch(self, connection, request):
+        """handle a request received on a connection: answered at once from the databank"""
+        response = self._handle(request)
+        if response:
+            connection.outbuf += response
+
+    def _complete(self, connection, response):
+        """send the response to a request given to _dispatch. Can be called from any thread"""
+        self._completed.append((connection, response))
+        self._wake()
+
+    def _send_completed(self):
+        """send the responses given to _complete"""
+        while self._completed:
+            (connection, response) = self._completed.popleft()
+            self._send_response(connection, response)
+
+    def _send_response(self, connection, response):
+        """queue a response on a connection unless it has been closed"""
+        if self._connections.get(connection.sock.fileno()) is not connection:
+            return
+        connection.outbuf += response
+        self._flush(connection)
+
+    def _flush(self, connection):
+        """send what can be sent of the responses. The connection is not read while they are pending"""
+        try:
+            sent = connection.sock.send(connection.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close_connection(connection)
+            return
+        del connection.outbuf[:sent]
+        events = selectors.EVENT_WRITE if connection.outbuf else selectors.EVENT_READ
+        if self._selector.get_key(connection.sock).events != events:
+            self._selector.modify(connection.sock, events, connection)
@@ -0,0 +1,136 @@
+""" Bus arbiter: the transactions of all the threads go through one worker per master, by priority """
+
+from concurrent.futures import Future
+import heapq
+import threading
+import time
+
+
+# the lower, the sooner
+PRIORITY_COMMAND = 0    # operator commands
+PRIORITY_WRITE = 1      # default of the write functions
+PRIORITY_POLL = 2       # default of the read functions: background polling
+
+
+class _Transaction(object):
+    """a queued transaction"""
+    __slots__ = ("plan", "returns_raw", "future", "priority", "queued")
+
+    def __init__(self, plan, returns_raw, priority):
+        self.plan = plan
+        self.returns_raw = returns_raw
+        self.future = Future()
+        self.priority = priority
+        self.queued = time.monotonic()
+
+
+class BusArbiter(object):
+    """
+    Serialize the transactions of a master (a RtuMaster on a serial port is not
+    thread safe): every thread submits its requests, one worker does them one
+    after the other, highest priority first (writes and operator commands
+    before background polling) and in submission order within a priority.
+    submit returns a concurrent.futures.Future of the result.
+    """
+    def __init__(self, master):
+        """Constructor: the worker is started"""
+        self._master = master
+        self._heap = []
+        self._count = 0
+        self._condition = threading.Condition()
+        self._running = True
+        # statistics
+        self.nb_transactions = 0
+        self.max_depth = 0
+        self._wait_stats = {}
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, *args, **kwargs):
+        """compile a request with the master (see ModbusMaster.prepare)"""
+        return self._master.prepare(*args, **kwargs)
+
+    def submit(self, slave_id, function_code, starting_address=0, quantity=0, output_value=0, data_format='',
+               expected_length=-1, pdu="", returns_raw=False, priority=None, write_starting_address_fc23=0):
+        """queue a request. Returns a Future of its result"""
+        plan = self._master._get_plan(slave_id, function_code, starting_address, quantity,
+                                      output_value, data_format, expected_length, pdu, write_starting_address_fc23)
+        return self.submit_plan(plan, returns_raw, priority)
+
+    def submit_plan(self, plan, returns_raw=False, priority=None):
+        """queue the request of a plan. Returns a Future of its result"""
+        if priority is None:
+            priority = PRIORITY_POLL if plan.is_read_function else PRIORITY_WRITE
+        transaction = _Transaction(plan, returns_raw, priority)
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("The arbiter is stopped")
+            self._count += 1
+            heapq.heappush(self._heap, (priority, self._count, transaction))
+            self.max_depth = max(self.max_depth, len(self._heap))
+            self._condition.notify()
+        return transaction.future
+
+    def execute(self, slave_id, function_code, starting_address=0, quantity=0, output_value=0, data_format='',
+                expected_length=-1, pdu="", returns_raw=False, priority=None, write_starting_address_fc23=0):
+        """queue a request and wait for its result"""
+        return self.submit(slave_id, function_code, starting_address, quantity, output_value, data_format,
+                           expected_length, pdu, returns_raw, priority, write_starting_address_fc23).result()
+
+    def execute_plan(self, plan, returns_raw=False, priority=None):
+        """queue the request of a plan and wait for its result"""
+        return self.submit_plan(plan, returns_raw, priority).result()
+
+    def get_depth(self):
+        """number of transactions waiting"""
+        with self._condition:
+            return len(self._heap)
+
+    def get_stats(self):
+        """returns the queue depth and the time waited in the queue by priority"""
+        with self._condition:
+            return {
+                "depth": len(self._heap),
+                "max_depth": self.max_depth,
+                "transactions": self.nb_transactions,
+                "wait": dict(
+                    (priority, {"count": count, "mean": total / count, "max": worst})
+                    for (priority, (count, total, worst)) in self._wait_stats.items()
+                ),
+            }
+
+    def stop(self):
+        """stop the worker once the queued transactions are done"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        """main function of the worker"""
+        while True:
+            with self._condition:
+                while not self._heap and self._running:
+                    self._condition.wait()
+                if not self._heap:
+                    return
+                transaction = heapq.heappop(self._heap)[-1]
+                wait = time.monotonic() - transaction.queued
+                (count, total, worst) = self._wait_stats.get(transaction.priority, (0, 0.0, 0.0))
+                self._wait_stats[transaction.priority] = (count + 1, total + wait, max(worst, wait))
+            if not transaction.future.set_running_or_notify_cancel():
+                # cancelled while waiting
+                continue
+            try:
+                result = self._master.execute_plan(transaction.plan, transaction.returns_raw)
+                error = None
+            except Exception as excpt:
+                error = excpt
+            with self._condition:
+                self.nb_transactions += 1
+            if error is None:
+                transaction.future.set_result(result)
+            else:
+                transaction.future.set_exception(error)
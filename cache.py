@@ -0,0 +1,160 @@
+""" Read cache of a master: recent readings are given again without a transaction on the bus """
+
+from concurrent.futures import Future
+import threading
+import time
+
+from defines import *
+
+# the read functions whose cached values are changed by a write function
+_INVALIDATED_BY = {
+    WRITE_SINGLE_COIL: (READ_COILS, ),
+    WRITE_MULTIPLE_COILS: (READ_COILS, ),
+    WRITE_MULTIPLE_REGISTERS: (READ_HOLDING_REGISTERS, ),
+    READ_WRITE_MULTIPLE_REGISTERS: (READ_HOLDING_REGISTERS, ),
+}
+
+
+class _Flight(object):
+    """a reading in progress and the callers waiting for it"""
+    __slots__ = ("future", "cacheable")
+
+    def __init__(self):
+        self.future = Future()
+        # cleared when a write to the range happens during the reading
+        self.cacheable = True
+
+
+class ReadCache(object):
+    """
+    Cache of the readings of a master, keyed by (slave, function, start, quantity).
+    A value is given again while it is younger than the ttl of its range
+    (set_ttl) or default_ttl. Identical readings asked at the same time share
+    one transaction. A write invalidates the cached ranges it overlaps.
+    Install it with master.set_cache(cache)
+    """
+    def __init__(self, default_ttl=0.1, max_entries=1024):
+        """Constructor"""
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        # key -> (expiry, value)
+        self._entries = {}
+        # key -> _Flight
+        self._flights = {}
+        # (slave, function, start, end, ttl) of the ranges with their own ttl
+        self._ttls = []
+        self._lock = threading.Lock()
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_shared = 0
+
+    def set_ttl(self, slave_id, function_code, starting_address, quantity, ttl):
+        """the readings within the given range are kept ttl seconds (0: never cached)"""
+        with self._lock:
+            self._ttls.insert(0, (slave_id, function_code, starting_address, starting_address + quantity, ttl))
+
+    def _get_ttl(self, slave_id, function_code, starting_address, quantity):
+        """ttl of the first range containing the reading"""
+        end = starting_address + quantity
+        for (ttl_slave, ttl_function, ttl_start, ttl_end, ttl) in self._ttls:
+            if (ttl_slave == slave_id and ttl_function == function_code
+                    and ttl_start <= starting_address and end <= ttl_end):
+                return ttl
+        return self.default_ttl
+
+    def execute(self, master, plan, starting_address, quantity, data_format, returns_raw):
+        """execute a plan of the master through the cache"""
+        if plan.is_read_function and plan.function_code not in _INVALIDATED_BY:
+            return self._read(master, plan, starting_address, quantity, data_format, returns_raw)
+        if plan.function_code in _INVALIDATED_BY:
+            # the range written by the request (given by prepare), not the range read by a function 23
+            if plan.written is not None:
+                (starting_address, quantity) = plan.written
+            else:
+                quantity = max(quantity, 1)
+            self.invalidate(plan.slave_id, plan.function_code, starting_address, quantity)
+            try:
+                return master.execute_plan(plan, returns_raw)
+            finally:
+                # the readings done during the write are not up to date either
+                self.invalidate(plan.slave_id, plan.function_code, starting_address, quantity)
+        return master.execute_plan(plan, returns_raw)
+
+    def _read(self, master, plan, starting_address, quantity, data_format, returns_raw):
+        """returns the cached value or do the reading, once for all the callers asking for it"""
+        # the values of a range are decoded according to data_format
+        key = (plan.slave_id, plan.function_code, starting_address, quantity, data_format, returns_raw)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.nb_hits += 1
+                return entry[1]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.nb_shared += 1
+                leader = False
+            else:
+                self.nb_misses += 1
+                flight = self._flights[key] = _Flight()
+                leader = True
+        if not leader:
+            return flight.future.result()
+
+        try:
+            value = master.execute_plan(plan, returns_raw)
+        except Exception as excpt:
+            with self._lock:
+                del self._flights[key]
+            flight.future.set_exception(excpt)
+            raise
+        with self._lock:
+            del self._flights[key]
+            ttl = self._get_ttl(plan.slave_id, plan.function_code, starting_address, quantity)
+            if flight.cacheable and ttl > 0:
+                if len(self._entries) >= self.max_entries:
+                    self._purge()
+                self._entries[key] = (time.monotonic() + ttl, value)
+        flight.future.set_result(value)
+        return value
+
+    def _purge(self):
+        """remove the expired entries, or all of them if none is expired"""
+        now = time.monotonic()
+        expired = [key for (key, entry) in self._entries.items() if entry[0] <= now]
+        if not expired:
+            self._entries.clear()
+        for key in expired:
+            del self._entries[key]
+
+    def invalidate(self, slave_id, function_code, starting_address, quantity):
+        """forget the readings overlapping the range written by function_code (slave 0: all the slaves)"""
+        read_functions = _INVALIDATED_BY.get(function_code, (function_code, ))
+        end = starting_address + quantity
+
+        def overlaps(key):
+            return ((slave_id == 0 or key[0] == slave_id) and key[1] in read_functions
+                    and key[2] < end and starting_address < key[2] + key[3])
+
+        with self._lock:
+            for key in [key for key in self._entries if overlaps(key)]:
+                del self._entries[key]
+            for (key, flight) in self._flights.items():
+                if overlaps(key):
+                    flight.cacheable = False
+
+    def clear(self):
+        """forget all the readings"""
+        with self._lock:
+            self._entries.clear()
+            for flight in self._flights.values():
+                flight.cacheable = False
+
+    def get_stats(self):
+        """returns the number of hits, misses and readings shared with a caller already waiting"""
+        with self._lock:
+            return {
+                "hits": self.nb_hits,
+                "misses": self.nb_misses,
+                "shared": self.nb_shared,
+                "entries": len(self._entries),
+            }
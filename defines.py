@@ -2,8 +2,22 @@
 
 """ Function Code Definition """
 READ_COILS = 1  # 读线圈寄存器    Data Type: bit
+READ_DISCRETE_INPUTS = 2    # 读离散输入寄存器  Data Type: bit
 READ_HOLDING_REGISTERS = 3  # 读保持寄存器    Data Type: int, float, string
+READ_INPUT_REGISTERS = 4    # 读输入寄存器    Data Type: int, float, string
 WRITE_SINGLE_COIL = 5   # 写单个线圈寄存器  Data Type: bit
+WRITE_MULTIPLE_COILS = 15   # 写多个线圈寄存器  Data Type: bit
+WRITE_MULTIPLE_REGISTERS = 16   # 写多个保持寄存器  Data Type: int
+READ_WRITE_MULTIPLE_REGISTERS = 23  # 读写多个保持寄存器  Data Type: int
+
+""" maximum quantity of data in one reading """
+MAX_READ_BITS = 2000        # READ_COILS, READ_DISCRETE_INPUTS
+MAX_READ_REGISTERS = 125    # READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS
+
+""" maximum quantity of data in one writing """
+MAX_WRITE_BITS = 1968       # WRITE_MULTIPLE_COILS
+MAX_WRITE_REGISTERS = 123   # WRITE_MULTIPLE_REGISTERS
+MAX_READ_WRITE_REGISTERS = 121  # written by READ_WRITE_MULTIPLE_REGISTERS (read: MAX_READ_REGISTERS)
 
 """ supported block types """
 COILS = 1   # 线圈寄存器     Read/Write  operation: bit
@@ -20,6 +34,8 @@ SLAVE_DEVICE_FAILURE = 4
 COMMAND_ACKNOWLEDGE = 5
 SLAVE_DEVICE_BUSY = 6
 MEMORY_PARITY_ERROR = 8
+GATEWAY_PATH_UNAVAILABLE = 10
+GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND = 11
 
 
 # """ supported block types """
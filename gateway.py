@@ -0,0 +1,267 @@
+""" Modbus TCP to RTU gateway: many TCP clients share the masters of the serial lines """
+
+import collections
+import struct
+import threading
+
+from Modbus import RequestPlan, LOGGER
+from ModbusTcp import TcpServer, TcpQuery
+from defines import *
+from exceptions import *
+from planner import READ_LIMITS
+import utils
+
+_ADDRESS_QUANTITY = struct.Struct(">HH")
+
+# length of the RTU responses to the write functions: slave + echo of the request + crc
+_WRITE_RESPONSE_LENGTHS = {
+    WRITE_SINGLE_COIL: 8,
+    WRITE_MULTIPLE_COILS: 8,
+    WRITE_MULTIPLE_REGISTERS: 8,
+}
+# the functions reading the slaves: they can not be broadcasted (unit 0)
+_READ_FUNCTIONS = frozenset(READ_LIMITS) | frozenset((READ_WRITE_MULTIPLE_REGISTERS, ))
+
+
+class FairQueue(object):
+    """
+    Queue served round robin between its clients: a client sending many requests
+    only gets its turn like the others
+    """
+    def __init__(self):
+        """Constructor"""
+        # client -> deque of items, in the order the clients are served
+        self._queues = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def put(self, client, item):
+        """add an item at the end of the queue of the client"""
+        with self._condition:
+            queue = self._queues.get(client)
+            if queue is None:
+                queue = self._queues[client] = collections.deque()
+            queue.append(item)
+            self._size += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """returns the first item of the next client. None after timeout"""
+        with self._condition:
+            if not self._size and not self._condition.wait_for(lambda: self._size, timeout):
+                return None
+            (client, queue) = self._queues.popitem(last=False)
+            item = queue.popleft()
+            if queue:
+                # the client is served again after the others
+                self._queues[client] = queue
+            self._size -= 1
+            return item
+
+
+class _BusRequest(object):
+    """a transaction on a line and the TCP requests waiting for its response"""
+    __slots__ = ("key", "plan", "waiters")
+
+    def __init__(self, key, plan):
+        self.key = key
+        self.plan = plan
+        # (connection, query) of every TCP request answered by the transaction
+        self.waiters = []
+
+
+class _BusLine(object):
+    """a master and the thread doing its transactions one after the other"""
+    def __init__(self, gateway, master):
+        """Constructor"""
+        self.gateway = gateway
+        self.master = master
+        self.queue = FairQueue()
+        # the reads queued or in progress, by (slave, pdu): identical reads join them
+        self.reads = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.nb_transactions = 0
+
+    def start(self):
+        """start the thread of the line"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """stop the thread of the line after the transaction in progress: the queued requests get an exception"""
+        if self.thread is not None:
+            self.running = False
+            # wake up the thread waiting for a request
+            self.queue.put(None, None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, connection, query, slave_id, request_pdu):
+        """queue a request. Returns True if it has been merged with an identical read"""
+        function_code = request_pdu[0]
+        with self.lock:
+            if function_code in READ_LIMITS and len(request_pdu) == 5 and slave_id != 0:
+                key = (slave_id, bytes(request_pdu))
+                bus_request = self.reads.get(key)
+                if bus_request is not None:
+                    bus_request.waiters.append((connection, query))
+                    return True
+                bus_request = self.reads[key] = _BusRequest(key, self._make_read_plan(slave_id, request_pdu))
+            else:
+                # the reads of this slave queued before a write must not answer the reads sent after it
+                for key in [key for key in self.reads if key[0] == slave_id]:
+                    del self.reads[key]
+                bus_request = _BusRequest(None, self._make_plan(slave_id, request_pdu))
+            bus_request.waiters.append((connection, query))
+        self.queue.put(connection, bus_request)
+        return False
+
+    def _make_read_plan(self, slave_id, request_pdu):
+        """the plan of a read is compiled by the master (and cached)"""
+        (starting_address, quantity) = _ADDRESS_QUANTITY.unpack_from(request_pdu, 1)
+        return self.master._get_plan(slave_id, request_pdu[0], starting_address, quantity, 0, '', -1, "")
+
+    def _make_plan(self, slave_id, request_pdu):
+        """the plan of any other function sends the pdu as received"""
+        query = self.master._make_query()
+        request = query.build_request(bytes(request_pdu), slave_id)
+        expected_length = _WRITE_RESPONSE_LENGTHS.get(request_pdu[0], -1)
+        if request_pdu[0] == READ_WRITE_MULTIPLE_REGISTERS and len(request_pdu) >= 5:
+            # slave + function + byte count + the registers read + crc
+            expected_length = 5 + 2 * _ADDRESS_QUANTITY.unpack_from(request_pdu, 1)[1]
+        return RequestPlan(slave_id, request_pdu[0], query, request, expected_length, False, None)
+
+    def _run(self):
+        """main function of the thread of the line"""
+        while self.running:
+            bus_request = self.queue.get()
+            if bus_request is None:
+                continue
+            response_pdu = self._execute(bus_request.plan)
+            with self.lock:
+                self.nb_transactions += 1
+            self._answer(bus_request, response_pdu)
+        # stopped: the requests still queued are not done
+        while len(self.queue):
+            bus_request = self.queue.get(0)
+            if bus_request is not None and bus_request.plan.slave_id != 0:
+                self._answer(bus_request, struct.pack(
+                    ">BB", bus_request.plan.function_code + 0x80, GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND))
+
+    def _answer(self, bus_request, response_pdu):
+        """give the response to all the TCP requests waiting for a transaction (None: no response)"""
+        with self.lock:
+            if bus_request.key is not None and self.reads.get(bus_request.key) is bus_request:
+                del self.reads[bus_request.key]
+        if response_pdu is None:
+            # broadcast: no response
+            return
+        for (connection, query) in bus_request.waiters:
+            self.gateway._complete(connection, query.build_response(response_pdu))
+
+    def _execute(self, plan):
+        """do a transaction on the line. Returns the response pdu"""
+        function_code = plan.function_code
+        try:
+            data = self.master.execute_plan(plan, returns_raw=True)
+        except ModbusError as excpt:
+            return struct.pack(">BB", function_code + 0x80, excpt.get_exception_code())
+        except Exception as excpt:
+            LOGGER.warning("Gateway: no response from slave %d: %s", plan.slave_id, excpt)
+            return struct.pack(">BB", function_code + 0x80, GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND)
+        if plan.slave_id == 0:
+            return None
+        if plan.is_read_function:
+            return struct.pack(">BB", function_code, len(data)) + data
+        return struct.pack(">B", function_code) + data
+
+
+class TcpRtuGateway(TcpServer):
+    """
+    Modbus TCP server forwarding the requests to the slaves behind masters
+    (RtuMaster on a serial line...) according to their unit id.
+    Every master has a thread doing its transactions one at a time from a queue
+    served round robin between the TCP connections. A read identical to a read
+    which is queued or in progress (same slave, function and range) does not
+    make a new transaction: it gets the same answer.
+    """
+
+    def __init__(self, master=None, port=502, address="127.0.0.1", timeout_in_sec=1.0, max_connections=1024):
+        """Constructor: the requests to a unit without route are sent to master, if any"""
+        super(TcpRtuGateway, self).__init__(port, address, timeout_in_sec, max_connections=max_connections)
+        self._lines = {}
+        self._routes = {}
+        self._default_line = self._get_line(master) if master is not None else None
+        self.nb_requests = 0
+        self.nb_merged = 0
+
+    def _get_line(self, master):
+        """returns the line of a master"""
+        line = self._lines.get(id(master))
+        if line is None:
+            line = self._lines[id(master)] = _BusLine(self, master)
+        return line
+
+    def add_route(self, slave_ids, master):
+        """forward the requests to the given unit ids to master"""
+        if self._thread.is_alive():
+            raise Exception("Routes can not be changed while the gateway is running")
+        line = self._get_line(master)
+        for slave_id in slave_ids:
+            if not 0 < slave_id < 256:
+                raise InvalidArgumentError("Invalid slave id {0}".format(slave_id))
+            self._routes[slave_id] = line
+
+    def get_stats(self):
+        """returns the number of TCP requests, of merged reads and of bus transactions"""
+        return {
+            "requests": self.nb_requests,
+            "merged": self.nb_merged,
+            "transactions": sum(line.nb_transactions for line in self._lines.values()),
+        }
+
+    def _do_init(self):
+        """start the threads of the lines"""
+        super(TcpRtuGateway, self)._do_init()
+        for line in self._lines.values():
+            line.start()
+
+    def _do_exit(self):
+        """stop the threads of the lines and send their last responses before closing the connections"""
+        for line in self._lines.values():
+            line.stop()
+        self._send_completed()
+        super(TcpRtuGateway, self)._do_exit()
+
+    def _dispatch(self, connection, request):
+        """queue the request on the line of its unit id"""
+        if self._verbose:
+            LOGGER.debug(utils.get_log_buffer("-->", request))
+        query = TcpQuery()
+        try:
+            (slave_id, request_pdu) = query.parse_request(request)
+        except ModbusInvalidRequestError:
+            return
+        self.nb_requests += 1
+        if slave_id == 0:
+            if request_pdu[0] in _READ_FUNCTIONS:
+                # a read can not be broadcasted: no response would come
+                connection.outbuf += query.build_response(struct.pack(">BB", request_pdu[0] + 0x80, ILLEGAL_FUNCTION))
+                return
+            # broadcast of a write: on every line
+            for line in self._lines.values():
+                line.submit(connection, query, 0, request_pdu)
+            return
+        line = self._routes.get(slave_id, self._default_line)
+        if line is None:
+            connection.outbuf += query.build_response(struct.pack(">BB", request_pdu[0] + 0x80, GATEWAY_PATH_UNAVAILABLE))
+            return
+        if line.submit(connection, query, slave_id, request_pdu):
+            self.nb_merged += 1
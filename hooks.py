@@ -0,0 +1,65 @@
+""" Hooks: functions called at given points of the modbus transactions
+
+A hook is installed for a name and called with a tuple of arguments. If it
+returns something else than None, the value replaces the data of the hook
+point (for example the request before it is sent).
+
+Hook points:
+    modbus.Master.before_send       (master, request)           -> new request
+    modbus.Master.after_recv        (master, response)          -> new response
+    modbus.Master.on_error          (master, exception)
+    modbus.Slave.on_handle_request  (slave, request_pdu)        -> response pdu
+    modbus.Slave.on_handle_broadcast (slave, response_pdu)
+    modbus.Databank.on_error        (databank, exception, request_pdu)
+    modbus_rtu.RtuMaster.after_close (master, )
+    modbus_rtu.RtuServer.before_open (server, )
+    modbus_rtu.RtuServer.after_open (server, )
+    modbus_rtu.RtuServer.before_close (server, )
+    modbus_rtu.RtuServer.after_close (server, )
+    modbus_tcp.TcpMaster.after_disconnect (master, )
+    modbus_tcp.TcpServer.on_connect (server, client socket, client address)
+    modbus_tcp.TcpServer.on_disconnect (server, client address)
+
+The hot paths only check has_hooks() once per transaction: nothing else is
+paid while no hook is installed.
+"""
+import threading
+
+# name -> tuple of functions. The tuples are replaced, never modified, so a
+# caller can iterate on them while another thread installs a hook
+_HOOKS = {}
+_LOCK = threading.Lock()
+
+
+def install_hook(name, fct):
+    """install a function to call at the hook point name"""
+    with _LOCK:
+        _HOOKS[name] = _HOOKS.get(name, ()) + (fct, )
+
+
+def uninstall_hook(name, fct=None):
+    """remove the function (or all the functions if fct is None) installed for name"""
+    with _LOCK:
+        if fct is None:
+            _HOOKS.pop(name, None)
+            return
+        fcts = list(_HOOKS.get(name, ()))
+        fcts.remove(fct)
+        if fcts:
+            _HOOKS[name] = tuple(fcts)
+        else:
+            del _HOOKS[name]
+
+
+def has_hooks():
+    """returns True if at least one hook is installed"""
+    return bool(_HOOKS)
+
+
+def call_hooks(name, args):
+    """call the hooks of name with args. Returns the first value which is not None"""
+    for fct in _HOOKS.get(name, ()):
+        retval = fct(args)
+        if retval is not None:
+            return retval
+    return None
@@ -0,0 +1,80 @@
+""" Several buses driven in parallel: one worker per bus, the batches are spread over them """
+
+from concurrent.futures import as_completed
+
+from arbiter import BusArbiter
+from exceptions import DuplicatedKeyError, MissingKeyError
+
+
+class BatchResult(object):
+    """The result of one request of a batch: values or error"""
+    def __init__(self, index, request, values, error):
+        """Constructor"""
+        self.index = index
+        self.request = request
+        self.values = values
+        self.error = error
+
+
+class MultiBusMaster(object):
+    """
+    Masters of several buses (one RtuMaster per serial port...) used at the same
+    time: every bus has its own worker (a BusArbiter), the blocking reads of
+    the serial ports release the GIL, so the buses work in parallel and a
+    batch takes the time of its slowest bus instead of the sum of all of them.
+    """
+    def __init__(self, masters=None):
+        """Constructor: masters is a dictionnary {bus name: master}"""
+        self._buses = {}
+        for (name, master) in (masters or {}).items():
+            self.add_bus(name, master)
+
+    def add_bus(self, name, master):
+        """add the master of a bus"""
+        if name in self._buses:
+            raise DuplicatedKeyError("Bus {0} already exists".format(name))
+        self._buses[name] = BusArbiter(master)
+
+    def get_bus(self, name):
+        """returns the arbiter of a bus"""
+        if name not in self._buses:
+            raise MissingKeyError("Bus {0} doesn't exist".format(name))
+        return self._buses[name]
+
+    def submit(self, bus, slave_id, function_code, *args, **kwargs):
+        """queue a request on a bus (arguments of BusArbiter.submit). Returns a Future"""
+        return self.get_bus(bus).submit(slave_id, function_code, *args, **kwargs)
+
+    def execute(self, bus, slave_id, function_code, *args, **kwargs):
+        """execute a request on a bus and wait for its result"""
+        return self.submit(bus, slave_id, function_code, *args, **kwargs).result()
+
+    def execute_batch(self, requests):
+        """
+        execute a batch of requests (bus, slave, function code, start, quantity...)
+        on their buses at the same time. Yields a BatchResult as soon as every
+        request is done: the order is the order of completion
+        """
+        futures = {}
+        for (index, request) in enumerate(requests):
+            futures[self.submit(*request)] = (index, request)
+        for future in as_completed(futures):
+            (index, request) = futures[future]
+            error = future.exception()
+            yield BatchResult(index, request, None if error else future.result(), error)
+
+    def execute_many(self, requests):
+        """execute a batch of requests and returns their BatchResult in the order of the requests"""
+        results = [None] * len(requests)
+        for result in self.execute_batch(requests):
+            results[result.index] = result
+        return results
+
+    def get_stats(self):
+        """returns the statistics of the arbiter of every bus"""
+        return dict((name, bus.get_stats()) for (name, bus) in self._buses.items())
+
+    def stop(self):
+        """stop the workers of all the buses"""
+        for bus in self._buses.values():
+            bus.stop()
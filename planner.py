@@ -0,0 +1,107 @@
+""" Read coalescing: merge the reads of single addresses into the fewest requests """
+
+from defines import *
+from exceptions import InvalidArgumentError
+
+# maximum quantity of one reading for every read function
+READ_LIMITS = {
+    READ_COILS: MAX_READ_BITS,
+    READ_DISCRETE_INPUTS: MAX_READ_BITS,
+    READ_HOLDING_REGISTERS: MAX_READ_REGISTERS,
+    READ_INPUT_REGISTERS: MAX_READ_REGISTERS,
+}
+
+
+class ReadRequest(object):
+    """One request of a plan: the range to read and the addresses it serves"""
+    def __init__(self, slave_id, function_code, starting_address, quantity, addresses):
+        """Constructor"""
+        self.slave_id = slave_id
+        self.function_code = function_code
+        self.starting_address = starting_address
+        self.quantity = quantity
+        self.addresses = addresses
+
+    def __repr__(self):
+        return "ReadRequest(slave={0}, fc={1}, start={2}, qty={3})".format(
+            self.slave_id, self.function_code, self.starting_address, self.quantity
+        )
+
+
+class PlanReport(object):
+    """Statistics of a read plan"""
+    def __init__(self, nb_points, requests):
+        """Constructor"""
+        self.nb_points = nb_points
+        self.nb_requests = len(requests)
+        # addresses read only because they are in a gap between two points
+        self.nb_gap_values = sum(request.quantity - len(request.addresses) for request in requests)
+
+    @property
+    def round_trips_saved(self):
+        """round trips saved compared with one request per point"""
+        return self.nb_points - self.nb_requests
+
+    def __str__(self):
+        return "{0} points read with {1} requests: {2} round trips saved, {3} values read in gaps".format(
+            self.nb_points, self.nb_requests, self.round_trips_saved, self.nb_gap_values
+        )
+
+
+class ReadPlanner(object):
+    """
+    Merge a set of (slave, address) points into the fewest read requests.
+    Two points are read by the same request when they are separated by at most
+    max_gap unused addresses and the request stays within the limit of the function.
+    The addresses of the gaps are read too: they must exist on the slave
+    """
+    def __init__(self, function_code=READ_HOLDING_REGISTERS, max_gap=0):
+        """Constructor"""
+        if function_code not in READ_LIMITS:
+            raise InvalidArgumentError("Function {0} can not be coalesced".format(function_code))
+        if max_gap < 0:
+            raise InvalidArgumentError("max_gap must be zero or positive number")
+        self.function_code = function_code
+        self.max_gap = max_gap
+        self.limit = READ_LIMITS[function_code]
+
+    def plan(self, points):
+        """returns the list of ReadRequest reading all the points"""
+        addresses_by_slave = {}
+        for (slave_id, address) in points:
+            addresses_by_slave.setdefault(slave_id, set()).add(address)
+
+        requests = []
+        for slave_id in sorted(addresses_by_slave):
+            addresses = sorted(addresses_by_slave[slave_id])
+            # greedy: extend the current request as long as the gap and the limit allow it
+            group = [addresses[0]]
+            for address in addresses[1:]:
+                if (address - group[-1] - 1 > self.max_gap) or (address - group[0] + 1 > self.limit):
+                    requests.append(self._make_request(slave_id, group))
+                    group = []
+                group.append(address)
+            requests.append(self._make_request(slave_id, group))
+        return requests
+
+    def _make_request(self, slave_id, addresses):
+        """returns the request reading the given sorted addresses"""
+        starting_address = addresses[0]
+        return ReadRequest(
+            slave_id, self.function_code, starting_address, addresses[-1] - starting_address + 1, addresses
+        )
+
+    def read(self, master, points):
+        """
+        read the points with the master. Returns a dictionnary {(slave, address): value}
+        and the PlanReport of the reading
+        """
+        points = set(points)
+        requests = self.plan(points)
+        values = {}
+        for request in requests:
+            result = master.execute(request.slave_id, request.function_code,
+                                    request.starting_address, request.quantity)
+            for address in request.addresses:
+                values[(request.slave_id, address)] = result[address - request.starting_address]
+        return values, PlanReport(len(points), requests)
@@ -0,0 +1,91 @@
+""" Response timeouts adapted to the round trip time of every slave (like the RTO of TCP, RFC 6298) """
+
+import threading
+
+
+class RttStats(object):
+    """Round trip time estimation of one (slave, function code)"""
+    def __init__(self):
+        """Constructor"""
+        # smoothed round trip time and its mean deviation, in seconds
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.rto = 0.0
+        self.nb_samples = 0
+        self.nb_timeouts = 0
+        # doubled after every timeout, reset by the next response
+        self.backoff = 1
+
+    def as_dict(self):
+        """returns the estimation as a dictionnary"""
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "rto": self.rto,
+            "samples": self.nb_samples,
+            "timeouts": self.nb_timeouts,
+        }
+
+
+class RttEstimator(object):
+    """
+    Estimate the round trip time of every key (slave, function code) from the
+    responses received and compute the time to wait for the next response:
+    srtt + max(granularity, 4 x rttvar), doubled after every timeout, and kept
+    between floor and ceiling. Without any response yet, ceiling is waited for.
+    """
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+    MAX_BACKOFF = 64
+
+    def __init__(self, floor=0.05, ceiling=1.0, granularity=0.01):
+        """Constructor"""
+        self.floor = floor
+        self.ceiling = ceiling
+        self.granularity = granularity
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get_timeout(self, key, transmission_time=0.0):
+        """time to wait for the response: transmission_time is the time the response takes on the line"""
+        stats = self._stats.get(key)
+        if stats is None or not stats.nb_samples:
+            return self.ceiling
+        timeout = stats.rto * stats.backoff + transmission_time
+        return min(max(timeout, self.floor), self.ceiling)
+
+    def add_sample(self, key, rtt):
+        """a response has been received rtt seconds after the request"""
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RttStats()
+            if stats.nb_samples:
+                stats.rttvar = (1 - self.BETA) * stats.rttvar + self.BETA * abs(stats.srtt - rtt)
+                stats.srtt = (1 - self.ALPHA) * stats.srtt + self.ALPHA * rtt
+            else:
+                stats.srtt = rtt
+                stats.rttvar = rtt / 2
+            stats.rto = stats.srtt + max(self.granularity, self.K * stats.rttvar)
+            stats.nb_samples += 1
+            stats.backoff = 1
+
+    def add_timeout(self, key):
+        """no response has been received"""
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RttStats()
+            stats.nb_timeouts += 1
+            stats.backoff = min(stats.backoff * 2, self.MAX_BACKOFF)
+
+    def get_stats(self):
+        """returns the estimations of every key as dictionnaries"""
+        with self._lock:
+            return dict((key, stats.as_dict()) for (key, stats) in self._stats.items())
+
+    def reset(self):
+        """forget all the estimations"""
+        with self._lock:
+            self._stats.clear()
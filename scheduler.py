@@ -0,0 +1,216 @@
+""" Deadline driven polling of several slaves through one master """
+
+import heapq
+import threading
+import time
+
+from exceptions import InvalidArgumentError, DuplicatedKeyError, MissingKeyError
+
+
+class PollResult(object):
+    """The result of one poll: values or error"""
+    def __init__(self, name, values, error, timestamp):
+        """Constructor"""
+        self.name = name
+        self.values = values
+        self.error = error
+        self.timestamp = timestamp
+
+
+class PollGroup(object):
+    """A request polled periodically and its timing statistics"""
+    def __init__(self, name, period, plan, priority=0, callback=None):
+        """Constructor"""
+        self.name = name
+        self.period = period
+        self.plan = plan
+        self.priority = priority
+        self.callback = callback
+        # scheduled time of the next poll
+        self.release = 0.0
+        # statistics
+        self.nb_polls = 0
+        self.nb_errors = 0
+        self.nb_overruns = 0
+        self.nb_skipped = 0
+        self.max_jitter = 0.0
+        self._total_jitter = 0.0
+
+    @property
+    def deadline(self):
+        """the poll must be done before the next one is due"""
+        return self.release + self.period
+
+    @property
+    def mean_jitter(self):
+        """mean delay between the scheduled and the actual start of the polls"""
+        return self._total_jitter / self.nb_polls if self.nb_polls else 0.0
+
+    def get_stats(self):
+        """returns the statistics as a dictionnary"""
+        return {
+            "polls": self.nb_polls,
+            "errors": self.nb_errors,
+            "overruns": self.nb_overruns,
+            "skipped": self.nb_skipped,
+            "mean_jitter": self.mean_jitter,
+            "max_jitter": self.max_jitter,
+        }
+
+
+class PollScheduler(object):
+    """
+    Poll groups of requests at different periods through one master.
+    The bus transactions are ordered earliest deadline first (the priority breaks
+    the ties). A poll which ends after its deadline is an overrun; when the bus
+    is saturated the periods missed are skipped and counted.
+    Results are given to the callback of the group and put in the queue if any.
+    """
+    def __init__(self, master, queue=None):
+        """Constructor"""
+        self._master = master
+        self._queue = queue
+        self._groups = {}
+        self._heap = []
+        self._count = 0
+        self._lock = threading.RLock()
+        self._thread = None
+        self._go = threading.Event()
+        # interrupts the wait for the next poll
+        self._wakeup = threading.Event()
+
+    def add_group(self, name, period, slave_id, function_code, starting_address=0, quantity=0,
+                  priority=0, callback=None, **kwargs):
+        """add a request polled every period seconds. kwargs are given to master.prepare"""
+        if period <= 0:
+            raise InvalidArgumentError("period must be a positive number")
+        with self._lock:
+            if name in self._groups:
+                raise DuplicatedKeyError("Poll group {0} already exists".format(name))
+            plan = self._master.prepare(slave_id, function_code, starting_address, quantity, **kwargs)
+            group = PollGroup(name, period, plan, priority, callback)
+            group.release = time.monotonic()
+            self._groups[name] = group
+            self._push(group)
+        self._wakeup.set()
+        return group
+
+    def remove_group(self, name):
+        """stop polling the given group"""
+        with self._lock:
+            if name not in self._groups:
+                raise MissingKeyError("Poll group {0} doesn't exist".format(name))
+            group = self._groups.pop(name)
+            self._heap = [entry for entry in self._heap if entry[-1] is not group]
+            heapq.heapify(self._heap)
+
+    def get_group(self, name):
+        """get the group with the given name"""
+        with self._lock:
+            if name not in self._groups:
+                raise MissingKeyError("Poll group {0} doesn't exist".format(name))
+            return self._groups[name]
+
+    def get_stats(self):
+        """returns the statistics of every group"""
+        with self._lock:
+            return dict((name, group.get_stats()) for (name, group) in self._groups.items())
+
+    def _push(self, group):
+        """schedule the next poll of the group"""
+        self._count += 1
+        heapq.heappush(self._heap, (group.deadline, -group.priority, self._count, group))
+
+    def _next_group(self, now):
+        """returns the released group with the earliest deadline, or the time to wait"""
+        with self._lock:
+            pending = []
+            group = None
+            # the groups not released yet are put back in the heap
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                if entry[-1].release <= now:
+                    group = entry[-1]
+                    break
+                pending.append(entry)
+            for entry in pending:
+                heapq.heappush(self._heap, entry)
+            if group is not None:
+                return group, 0.0
+            if not self._heap:
+                return None, None
+            return None, min(entry[-1].release for entry in self._heap) - now
+
+    def run_once(self, timeout=None):
+        """do the next poll: wait for it at most timeout seconds. Returns the group polled or None"""
+        group, wait = self._next_group(time.monotonic())
+        if group is None:
+            if wait is None:
+                # no group: nothing to wait for except a new group
+                wait = timeout
+            elif timeout is not None:
+                wait = min(wait, timeout)
+            if wait is None:
+                return None
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+            group, wait = self._next_group(time.monotonic())
+            if group is None:
+                return None
+        self._poll(group)
+        return group
+
+    def _poll(self, group):
+        """execute the request of the group, update the statistics and deliver the result"""
+        start = time.monotonic()
+        values, error = None, None
+        try:
+            values = self._master.execute_plan(group.plan)
+        except Exception as excpt:
+            error = excpt
+        end = time.monotonic()
+
+        with self._lock:
+            jitter = start - group.release
+            group.nb_polls += 1
+            group._total_jitter += jitter
+            group.max_jitter = max(group.max_jitter, jitter)
+            if error is not None:
+                group.nb_errors += 1
+            if end > group.deadline:
+                group.nb_overruns += 1
+            # next period: the periods already over are skipped
+            group.release += group.period
+            if group.release + group.period <= end:
+                skipped = int((end - group.release) // group.period)
+                group.nb_skipped += skipped
+                group.release += skipped * group.period
+            if self._groups.get(group.name) is group:
+                self._push(group)
+
+        result = PollResult(group.name, values, error, end)
+        if group.callback:
+            group.callback(result)
+        if self._queue is not None:
+            self._queue.put(result)
+
+    def _run(self):
+        """main function of the polling thread"""
+        while self._go.is_set():
+            self.run_once(timeout=1.0)
+
+    def start(self):
+        """start polling in a thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._go.set()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """stop polling"""
+        self._go.clear()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
@@ -0,0 +1,79 @@
+""" bus arbiter: threads sharing one master, writes and commands before the polling """
+
+import threading
+import time
+
+import ModbusTcp
+import arbiter
+import hooks
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL
+
+HOST = "127.0.0.1"
+PORT = 15026
+SLAVE_DELAY = 0.005
+NB_POLLS = 40
+NB_THREADS = 4
+
+
+def main():
+    """main"""
+    server = ModbusTcp.TcpServer(PORT, HOST)
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.add_block('1', COILS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    server.start()
+    hooks.install_hook("modbus.Slave.on_handle_request", lambda args: time.sleep(SLAVE_DELAY))
+
+    bus = arbiter.BusArbiter(ModbusTcp.TcpMaster(HOST, PORT, pool=None))
+    try:
+        # several threads use the master at the same time
+        errors = []
+
+        def poll(index):
+            try:
+                for i in range(10):
+                    assert bus.execute(1, READ_HOLDING_REGISTERS, index + i, 2) == (index + i, index + i + 1)
+            except Exception as excpt:
+                errors.append(excpt)
+
+        threads = [threading.Thread(target=poll, args=(i * 10, )) for i in range(NB_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+
+        # a write and an operator command go ahead of the polling already queued
+        done = []
+        polls = [bus.submit(1, READ_HOLDING_REGISTERS, 0, 10) for _ in range(NB_POLLS)]
+        for future in polls:
+            future.add_done_callback(lambda future: done.append("poll"))
+        write = bus.submit(1, WRITE_SINGLE_COIL, 5, output_value=1)
+        write.add_done_callback(lambda future: done.append("write"))
+        command = bus.submit(1, READ_COILS, 0, 8, priority=arbiter.PRIORITY_COMMAND)
+        command.add_done_callback(lambda future: done.append("command"))
+        assert write.result() == (5, 0xff00)
+        # the command has the highest priority: it is done before the write
+        assert command.result() == (0, ) * 8
+        for future in polls:
+            assert future.result() == tuple(range(10))
+        # at most the transaction in progress is done before them
+        assert done.index("command") <= 1 and done.index("write") == done.index("command") + 1, done
+        assert bus.execute(1, READ_COILS, 0, 8) == (0, 0, 0, 0, 0, 1, 0, 0)
+
+        stats = bus.get_stats()
+        for (priority, wait) in sorted(stats["wait"].items()):
+            print('priority %d: %3d transactions, mean wait %6.2f ms, max %6.2f ms' % (
+                priority, wait["count"], wait["mean"] * 1000, wait["max"] * 1000))
+        print('max queue depth %d' % stats["max_depth"])
+        assert stats["transactions"] == NB_THREADS * 10 + NB_POLLS + 3
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+        bus.stop()
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
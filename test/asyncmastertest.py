@@ -0,0 +1,99 @@
+""" AsyncRtuMaster on in-memory streams: one event loop drives several lines """
+
+import asyncio
+import time
+
+import Modbus
+import ModbusAsync
+import ModbusSerial
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, READ_WRITE_MULTIPLE_REGISTERS, \
+    WRITE_SINGLE_COIL
+from exceptions import ModbusError, ModbusInvalidResponseError
+
+NB_LINES = 4
+LINE_DELAY = 0.01
+
+
+class LoopbackWriter(object):
+    """stream writer answering the requests with a databank after a delay (the slave)"""
+    def __init__(self, reader, databank, delay):
+        self._reader = reader
+        self._databank = databank
+        self._delay = delay
+
+    def write(self, data):
+        response = self._databank.handle_request(ModbusSerial.RtuQuery(), bytearray(data))
+        if response:
+            asyncio.get_running_loop().call_later(self._delay, self._reader.feed_data, response)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_line(slave_id):
+    """returns a master connected to a databank holding one slave"""
+    databank = Modbus.DataBank()
+    slave = databank.add_slave(slave_id)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.add_block('1', COILS, 0, 100)
+    slave.set_values('0', 0, [slave_id * 100 + i for i in range(100)])
+    reader = asyncio.StreamReader()
+    return ModbusAsync.AsyncRtuMaster(reader, LoopbackWriter(reader, databank, LINE_DELAY))
+
+
+async def poll(master, slave_id, count):
+    """read the registers of a line count times"""
+    for _ in range(count):
+        values = await master.execute(slave_id, READ_HOLDING_REGISTERS, 0, 10)
+        assert values == tuple(slave_id * 100 + i for i in range(10))
+
+
+async def run():
+    """main coroutine"""
+    masters = [make_line(slave_id) for slave_id in range(1, NB_LINES + 1)]
+
+    master = masters[0]
+    assert await master.execute(1, WRITE_SINGLE_COIL, 3, output_value=1) == (3, 0xff00)
+    assert (await master.execute(1, READ_COILS, 0, 5)) == (0, 0, 0, 1, 0)
+    assert await master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, 0, 2, output_value=[7, 8],
+                                write_starting_address_fc23=90) == (100, 101)
+    assert await master.execute(1, READ_HOLDING_REGISTERS, 90, 2) == (7, 8)
+    try:
+        await master.execute(1, READ_HOLDING_REGISTERS, 500, 10)
+        assert False, "ModbusError expected"
+    except ModbusError as excpt:
+        assert excpt.get_exception_code() == 2
+
+    # a response coming after the timeout is not taken for the response of the next request
+    master.set_timeout(LINE_DELAY * 3)
+    master._writer._delay = LINE_DELAY * 5
+    try:
+        await master.execute(1, READ_HOLDING_REGISTERS, 0, 10)
+        assert False, "ModbusInvalidResponseError expected"
+    except ModbusInvalidResponseError:
+        pass
+    master._writer._delay = LINE_DELAY
+    assert await master.execute(1, READ_HOLDING_REGISTERS, 20, 10) == tuple(range(120, 130))
+    assert await master.execute(1, READ_HOLDING_REGISTERS, 30, 2) == (130, 131)
+    master.set_timeout(1.0)
+
+    # the lines are polled concurrently: the total time is the time of one line
+    count = 20
+    begin = time.perf_counter()
+    await asyncio.gather(*[poll(master, i + 1, count) for (i, master) in enumerate(masters)])
+    duration = time.perf_counter() - begin
+    print('%d lines x %d transactions in %.3fs (%.3fs per line)' % (NB_LINES, count, duration, count * LINE_DELAY))
+    assert duration < 2 * count * LINE_DELAY
+
+
+def main():
+    """main"""
+    asyncio.run(run())
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+""" AsyncRtuServer: several TCP links served by one event loop, requests framed by length """
+
+import asyncio
+import time
+
+import ModbusAsync
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL
+from exceptions import ModbusError
+
+PORT = 15020
+NB_CLIENTS = 3
+# a request must not wait for this timeout
+INTERFRAME_TIMEOUT = 0.5
+
+
+async def client(slave_id, count):
+    """a master polling its slave"""
+    master = await ModbusAsync.AsyncRtuMaster.open_tcp("127.0.0.1", PORT)
+    try:
+        for i in range(count):
+            values = await master.execute(slave_id, READ_HOLDING_REGISTERS, 0, 4)
+            assert values == (slave_id, slave_id + 1, slave_id + 2, slave_id + 3)
+        assert await master.execute(slave_id, WRITE_SINGLE_COIL, 2, output_value=1) == (2, 0xff00)
+        assert await master.execute(slave_id, READ_COILS, 0, 4) == (0, 0, 1, 0)
+        try:
+            await master.execute(slave_id, READ_HOLDING_REGISTERS, 100, 4)
+            assert False, "ModbusError expected"
+        except ModbusError as excpt:
+            assert excpt.get_exception_code() == 2
+    finally:
+        master.disconnect()
+
+
+async def run():
+    """main coroutine"""
+    server = ModbusAsync.AsyncRtuServer()
+    for slave_id in range(1, NB_CLIENTS + 1):
+        slave = server.add_slave(slave_id)
+        slave.add_block('0', HOLDING_REGISTERS, 0, 10)
+        slave.add_block('1', COILS, 0, 10)
+        slave.set_values('0', 0, [slave_id + i for i in range(10)])
+    await server.start_tcp("127.0.0.1", PORT, interframe_timeout=INTERFRAME_TIMEOUT)
+
+    count = 100
+    begin = time.perf_counter()
+    await asyncio.gather(*[client(slave_id, count) for slave_id in range(1, NB_CLIENTS + 1)])
+    duration = time.perf_counter() - begin
+    print('%d clients x %d transactions in %.3fs' % (NB_CLIENTS, count + 3, duration))
+    assert duration < INTERFRAME_TIMEOUT
+
+    await server.stop()
+
+
+def main():
+    """main"""
+    asyncio.run(run())
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
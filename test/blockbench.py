@@ -0,0 +1,45 @@
+""" benchmark: block lookup and insertion with 1000 blocks per type """
+
+import random
+import struct
+import time
+
+import Modbus
+from defines import COILS, DISCRETE_INPUTS, HOLDING_REGISTERS, ANALOG_INPUTS, READ_HOLDING_REGISTERS
+
+NB_BLOCKS = 1000
+BLOCK_SIZE = 10
+NB_LOOKUPS = 100000
+
+
+def main():
+    """main"""
+    slave = Modbus.ModbusSlave(1)
+    # insert the blocks in random order
+    starts = [i * 2 * BLOCK_SIZE for i in range(NB_BLOCKS)]
+    random.shuffle(starts)
+
+    begin = time.perf_counter()
+    for block_type in (COILS, DISCRETE_INPUTS, HOLDING_REGISTERS, ANALOG_INPUTS):
+        for start in starts:
+            slave.add_block('%d-%d' % (block_type, start), block_type, start, BLOCK_SIZE)
+    duration = time.perf_counter() - begin
+    print('add_block        %8.2fus per block' % (duration / (4 * NB_BLOCKS) * 1e6))
+
+    addresses = [random.choice(starts) + random.randrange(BLOCK_SIZE) for _ in range(NB_LOOKUPS)]
+    begin = time.perf_counter()
+    for address in addresses:
+        slave._get_block_and_offset(HOLDING_REGISTERS, address, 1)
+    duration = time.perf_counter() - begin
+    print('lookup           %8.2fus' % (duration / NB_LOOKUPS * 1e6))
+
+    requests = [struct.pack(">BHH", READ_HOLDING_REGISTERS, address, 1) for address in addresses[:10000]]
+    begin = time.perf_counter()
+    for request in requests:
+        slave.handle_request(request)
+    duration = time.perf_counter() - begin
+    print('handle_request   %8.2fus' % (duration / len(requests) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
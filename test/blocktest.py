@@ -0,0 +1,103 @@
+""" memory of the slaves: packed bits at the byte boundaries, typed registers and the checks of set_values """
+
+import random
+import struct
+
+import Modbus
+import utils
+from defines import COILS, HOLDING_REGISTERS, READ_COILS
+from exceptions import InvalidArgumentError, OutOfModbusBlockError
+
+
+def check_packed_bits():
+    """every slice of the bits, whatever its alignment on the bytes, reads back what was written"""
+    for size in (1, 7, 8, 9, 16, 17, 33):
+        bits = Modbus.PackedBits(size)
+        reference = [0] * size
+        assert len(bits) == size and bits[:] == reference
+        for _ in range(50):
+            start = random.randrange(size)
+            stop = random.randrange(start, size + 1)
+            values = [random.randrange(2) for _ in range(stop - start)]
+            bits[start:stop] = values
+            reference[start:stop] = values
+            assert bits[:] == reference
+            # packed as in a response: same as utils.pack_bits
+            buffer = bytearray(1 + (stop - start + 7) // 8)
+            bits.pack_into(buffer, 1, start, stop - start)
+            assert bytes(buffer[1:]) == utils.pack_bits(reference[start:stop])
+            # unpacked from a request
+            copy = bits.copy()
+            copy.unpack_from(buffer, 1, start, stop - start)
+            assert copy[:] == reference
+        # single bits, negative index, out of range
+        bits[size - 1] = 1
+        assert bits[-1] == 1
+        bits[-1] = 0
+        assert bits[size - 1] == 0
+        for index in (size, -size - 1):
+            try:
+                bits[index]
+                assert False, "IndexError expected"
+            except IndexError:
+                pass
+        try:
+            bits[0:1] = [1, 1]
+            assert False, "ValueError expected"
+        except ValueError:
+            pass
+        # extended slices
+        bits[:] = [0] * size
+        bits[::2] = [1] * len(range(0, size, 2))
+        assert bits[:] == [int(i % 2 == 0) for i in range(size)]
+        assert bits[1::2] == [0] * len(range(1, size, 2))
+
+
+def check_slave():
+    """the values of set_values are checked before being written"""
+    slave = Modbus.ModbusSlave(1)
+    slave.add_block('coils', COILS, 3, 13)
+    slave.add_block('registers', HOLDING_REGISTERS, 0, 10)
+
+    # the coils of a block which doesn't start on a byte boundary
+    slave.set_values('coils', 3, [1, 0, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0, 1])
+    response = slave.handle_request(struct.pack(">BHH", READ_COILS, 10, 6))
+    assert response == bytes([READ_COILS, 1, 0b00100110])
+    assert slave.get_values('coils', 15) == (1, )
+
+    slave.set_values('registers', 0, [0, 65535, 7])
+    assert slave.get_values('registers', 0, 3) == (0, 65535, 7)
+    for values in (70000, -1, 1.5, "1", [1, 65536], [2, None]):
+        try:
+            slave.set_values('registers', 0, values)
+            assert False, "InvalidArgumentError expected for {0!r}".format(values)
+        except InvalidArgumentError:
+            pass
+    # nothing has been written
+    assert slave.get_values('registers', 0, 3) == (0, 65535, 7)
+    try:
+        slave.set_values('registers', 8, [1, 2, 3])
+        assert False, "OutOfModbusBlockError expected"
+    except OutOfModbusBlockError:
+        pass
+
+    signed = Modbus.ModbusSlave(2, unsigned=False)
+    signed.add_block('registers', HOLDING_REGISTERS, 0, 2)
+    signed.set_values('registers', 0, [-32768, 32767])
+    assert signed.get_values('registers', 0, 2) == (-32768, 32767)
+    try:
+        signed.set_values('registers', 0, 40000)
+        assert False, "InvalidArgumentError expected"
+    except InvalidArgumentError:
+        pass
+
+
+def main():
+    """main"""
+    check_packed_bits()
+    check_slave()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
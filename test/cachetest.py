@@ -0,0 +1,96 @@
+""" read cache of a master: ttl, single flight and invalidation by the writes """
+
+import threading
+import time
+
+import ModbusTcp
+import cache
+import hooks
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL, \
+    WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS
+
+HOST = "127.0.0.1"
+PORT = 15025
+SLAVE_DELAY = 0.05
+NB_CALLERS = 8
+
+nb_transactions = 0
+
+
+def count_and_wait(args):
+    """hook of the slave: count the transactions and make them long enough to overlap"""
+    global nb_transactions
+    nb_transactions += 1
+    time.sleep(SLAVE_DELAY)
+
+
+def main():
+    """main"""
+    global nb_transactions
+    server = ModbusTcp.TcpServer(PORT, HOST)
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.add_block('1', COILS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    server.start()
+    hooks.install_hook("modbus.Slave.on_handle_request", count_and_wait)
+
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+    read_cache = cache.ReadCache(default_ttl=0.5)
+    read_cache.set_ttl(1, READ_HOLDING_REGISTERS, 50, 50, 0)
+    master.set_cache(read_cache)
+    try:
+        # within the ttl, the range is read once
+        for _ in range(5):
+            assert master.execute(1, READ_HOLDING_REGISTERS, 0, 10) == tuple(range(10))
+        assert nb_transactions == 1
+        # a range whose ttl is 0 is never cached
+        for _ in range(3):
+            assert master.execute(1, READ_HOLDING_REGISTERS, 60, 2) == (60, 61)
+        assert nb_transactions == 4
+        # the ttl is over
+        time.sleep(0.6)
+        master.execute(1, READ_HOLDING_REGISTERS, 0, 10)
+        assert nb_transactions == 5
+
+        # callers asking for the same range at the same time share one transaction
+        nb_transactions = 0
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(master.execute(1, READ_HOLDING_REGISTERS, 20, 5)))
+                   for _ in range(NB_CALLERS)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        assert results == [tuple(range(20, 25))] * NB_CALLERS
+        assert nb_transactions == 1
+
+        # a write of a coil invalidates the cached coils it overlaps only
+        assert master.execute(1, READ_COILS, 0, 8) == (0, ) * 8
+        assert master.execute(1, READ_COILS, 10, 8) == (0, ) * 8
+        nb_transactions = 0
+        master.execute(1, WRITE_SINGLE_COIL, 3, output_value=1)
+        assert master.execute(1, READ_COILS, 0, 8) == (0, 0, 0, 1, 0, 0, 0, 0)
+        assert master.execute(1, READ_COILS, 10, 8) == (0, ) * 8
+        assert nb_transactions == 2
+
+        # the registers written are counted from the values packed: 2 floats are 4 registers
+        assert master.execute(1, READ_HOLDING_REGISTERS, 2, 2) == (2, 3)
+        assert master.execute(1, READ_HOLDING_REGISTERS, 4, 2) == (4, 5)
+        master.execute(1, WRITE_MULTIPLE_REGISTERS, 0, output_value=[1.5, 2.5], data_format='>ff')
+        assert master.execute(1, READ_HOLDING_REGISTERS, 2, 2) == (16416, 0)
+        assert master.execute(1, READ_HOLDING_REGISTERS, 4, 2) == (4, 5)
+        # a write of several coils invalidates all of them
+        assert master.execute(1, READ_COILS, 20, 8) == (0, ) * 8
+        master.execute(1, WRITE_MULTIPLE_COILS, 18, output_value=[1, 1, 1, 1])
+        assert master.execute(1, READ_COILS, 20, 8) == (1, 1, 0, 0, 0, 0, 0, 0)
+        print(read_cache.get_stats())
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+        master.disconnect()
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
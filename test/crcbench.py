@@ -0,0 +1,73 @@
+""" benchmark: per frame cost of the CRC16 engine against utils.calculate_crc """
+
+import os
+import random
+import struct
+import time
+import timeit
+
+import crc
+import utils
+
+FRAME_SIZES = (8, 16, 32, 64, 128, 256)
+NUMBER = 100000
+
+
+def crc16_by_byte(data):
+    """CRC16 with the 8 bits table only, whatever the length"""
+    value = crc.CRC16_INIT
+    for byte in data:
+        value = (value >> 8) ^ crc._BYTE_TABLE[(value ^ byte) & 0xFF]
+    return value
+
+
+def measure(function):
+    """time of one call, best of 3 runs"""
+    return min(timeit.repeat(function, number=NUMBER, repeat=3)) / NUMBER
+
+
+def check():
+    """the new engine must give the same result as the reference implementation"""
+    for size in range(0, 300):
+        data = bytes(random.randrange(256) for _ in range(size))
+        expected = utils.calculate_crc(data)
+        assert utils.swap_bytes(crc.crc16(data)) == expected
+        assert utils.swap_bytes(crc.crc16(memoryview(bytearray(data)))) == expected
+        # incremental calculation, with odd sized parts
+        engine = crc.Crc16()
+        for i in range(0, size, 7):
+            engine.update(data[i:i + 7])
+        assert engine.digest() == struct.pack(">H", expected)
+        # a frame followed by its crc is valid
+        assert crc.check_frame(data + crc.pack_crc(crc.crc16(data))) or size == 0
+        # both tables give the same result, from any offset
+        assert crc16_by_byte(data) == crc._crc16_words(data, crc.CRC16_INIT, 0, size)
+        if size > 10:
+            assert crc.crc16(data, offset=3, length=size - 10) == crc.crc16(data[3:size - 7])
+
+
+def main():
+    """main"""
+    # the 16 bits table is not built by the import, only by the first calculation
+    assert crc._word_table is None
+    begin = time.perf_counter()
+    crc._get_word_table()
+    print('16 bits table built in %.1f ms' % ((time.perf_counter() - begin) * 1000))
+    check()
+    print('%6s %14s %14s %14s %14s %8s' % ('bytes', 'calculate_crc', '8 bits table', '16 bits table', 'crc16',
+                                           'speedup'))
+    for size in FRAME_SIZES:
+        frame = os.urandom(size)
+        legacy = measure(lambda: utils.calculate_crc(frame))
+        by_byte = measure(lambda: crc16_by_byte(frame))
+        by_word = measure(lambda: crc._crc16_words(frame, crc.CRC16_INIT, 0, size))
+        new = measure(lambda: crc.crc16(frame))
+        print('%6d %12.2fus %12.2fus %12.2fus %12.2fus %7.1fx' % (
+            size, legacy * 1e6, by_byte * 1e6, by_word * 1e6, new * 1e6, legacy / new))
+        # the requests and most of the responses are short: they must be faster too
+        assert legacy / new > 1.2, size
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+""" TCP to RTU gateway: local TCP clients, RtuMaster and RtuServer on a virtual serial pair """
+
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import tty
+
+import serial
+
+import ModbusSerial
+import ModbusTcp
+import gateway
+import hooks
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL
+from defines import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND, ILLEGAL_FUNCTION
+from exceptions import ModbusError
+
+HOST = "127.0.0.1"
+PORT = 15024
+NB_CLIENTS = 8
+COUNT = 25
+
+
+def make_virtual_pair():
+    """two pseudo terminals connected to each other (like socat): returns their paths"""
+    fds = []
+    paths = []
+    for _ in range(2):
+        (master_fd, slave_fd) = os.openpty()
+        tty.setraw(slave_fd)
+        fds.append(master_fd)
+        paths.append(os.ttyname(slave_fd))
+
+    def bridge():
+        while True:
+            for fd in select.select(fds, [], [])[0]:
+                data = os.read(fd, 1024)
+                os.write(fds[1 - fds.index(fd)], data)
+
+    thread = threading.Thread(target=bridge)
+    thread.daemon = True
+    thread.start()
+    return paths
+
+
+def client(results, index):
+    """a SCADA client polling the same registers as the others"""
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+    for _ in range(COUNT):
+        results[index].append(master.execute(1, READ_HOLDING_REGISTERS, 0, 10))
+    master.disconnect()
+
+
+def main():
+    """main"""
+    (slave_path, master_path) = make_virtual_pair()
+
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=115200))
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.add_block('1', COILS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    server.start()
+
+    master = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=115200), delay=0)
+    master.set_timeout(0.1)
+    rtu_gateway = gateway.TcpRtuGateway(port=PORT, address=HOST)
+    rtu_gateway.add_route([1, 2], master)
+    rtu_gateway.start()
+    try:
+        tcp_master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+        assert tcp_master.execute(1, READ_HOLDING_REGISTERS, 5, 3) == (5, 6, 7)
+        assert tcp_master.execute(1, WRITE_SINGLE_COIL, 2, output_value=1) == (2, 0xff00)
+        assert tcp_master.execute(1, READ_COILS, 0, 4) == (0, 0, 1, 0)
+        # exception of the slave
+        try:
+            tcp_master.execute(1, READ_HOLDING_REGISTERS, 500, 3)
+            assert False, "ModbusError expected"
+        except ModbusError as excpt:
+            assert excpt.get_exception_code() == 2
+        # no slave 2 on the line
+        try:
+            tcp_master.execute(2, READ_HOLDING_REGISTERS, 0, 3)
+            assert False, "ModbusError expected"
+        except ModbusError as excpt:
+            assert excpt.get_exception_code() == GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND
+        # no route
+        try:
+            tcp_master.execute(3, READ_HOLDING_REGISTERS, 0, 3)
+            assert False, "ModbusError expected"
+        except ModbusError as excpt:
+            assert excpt.get_exception_code() == GATEWAY_PATH_UNAVAILABLE
+        # a read can not be broadcasted: it is refused at once, every time
+        # (a master does not wait for the response to unit 0: the request is sent on a socket)
+        sock = socket.create_connection((HOST, PORT), 1.0)
+        for _ in range(2):
+            query = ModbusTcp.TcpQuery()
+            sock.sendall(query.build_request(struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, 3), 0))
+            assert bytes(query.parse_response(sock.recv(1024))) == bytes([READ_HOLDING_REGISTERS + 0x80, ILLEGAL_FUNCTION])
+        sock.close()
+        # a write is broadcasted
+        tcp_master.execute(0, WRITE_SINGLE_COIL, 3, output_value=1)
+        time.sleep(0.05)
+        assert tcp_master.execute(1, READ_COILS, 0, 4) == (0, 0, 1, 1)
+        tcp_master.disconnect()
+
+        # concurrent clients reading the same registers share the bus transactions
+        stats = rtu_gateway.get_stats()
+        results = [[] for _ in range(NB_CLIENTS)]
+        threads = [threading.Thread(target=client, args=(results, i)) for i in range(NB_CLIENTS)]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - begin
+        for values in results:
+            assert values == [tuple(range(10))] * COUNT
+        nb_requests = rtu_gateway.get_stats()["requests"] - stats["requests"]
+        nb_transactions = rtu_gateway.get_stats()["transactions"] - stats["transactions"]
+        print('%d requests from %d clients in %.3fs: %d bus transactions, %d merged' % (
+            nb_requests, NB_CLIENTS, duration, nb_transactions, nb_requests - nb_transactions))
+        assert nb_requests == NB_CLIENTS * COUNT
+        assert nb_transactions < nb_requests
+
+        # stopped with requests queued: every request gets an answer
+        hooks.install_hook("modbus.Slave.on_handle_request", lambda args: time.sleep(0.02))
+        pipelined = ModbusTcp.PipelinedTcpMaster(HOST, PORT, timeout_in_sec=2.0, window=8)
+        futures = [pipelined.submit(1, READ_HOLDING_REGISTERS, i, 1) for i in range(8)]
+        time.sleep(0.05)
+        rtu_gateway.stop()
+        nb_failed = 0
+        for (i, future) in enumerate(futures):
+            try:
+                assert future.result() == (i, )
+            except ModbusError as excpt:
+                assert excpt.get_exception_code() == GATEWAY_TARGET_DEVICE_FAILED_TO_RESPOND
+                nb_failed += 1
+        print('stopped with requests queued: %d done, %d answered with an exception' % (8 - nb_failed, nb_failed))
+        assert nb_failed > 0
+        pipelined.disconnect()
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+        rtu_gateway.stop()
+        server.stop()
+        master.disconnect()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+""" hooks: install, call and uninstall, hooks of the slaves and the logger of utils """
+
+import logging
+import struct
+
+import hooks
+import Modbus
+import utils
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS, SLAVE_DEVICE_BUSY
+from exceptions import ModbusError
+
+
+def check_hooks():
+    """the first value which is not None is returned, the hooks can be removed one by one"""
+    calls = []
+
+    def first(args):
+        calls.append(("first", args))
+
+    def second(args):
+        calls.append(("second", args))
+        return args[0] * 2
+
+    def third(args):
+        calls.append(("third", args))
+        return -1
+
+    assert not hooks.has_hooks()
+    assert hooks.call_hooks("test.point", (1, )) is None
+    hooks.install_hook("test.point", first)
+    hooks.install_hook("test.point", second)
+    hooks.install_hook("test.point", third)
+    assert hooks.has_hooks()
+    assert hooks.call_hooks("test.point", (21, )) == 42
+    assert calls == [("first", (21, )), ("second", (21, ))]
+    assert hooks.call_hooks("other.point", (1, )) is None
+
+    del calls[:]
+    hooks.uninstall_hook("test.point", second)
+    assert hooks.call_hooks("test.point", (21, )) == -1
+    assert calls == [("first", (21, )), ("third", (21, ))]
+    hooks.uninstall_hook("test.point", first)
+    hooks.uninstall_hook("test.point", third)
+    assert not hooks.has_hooks()
+    try:
+        hooks.uninstall_hook("test.point", first)
+        assert False, "ValueError expected"
+    except ValueError:
+        pass
+
+    # all the hooks of a point at once
+    hooks.install_hook("test.point", first)
+    hooks.install_hook("test.point", second)
+    hooks.uninstall_hook("test.point")
+    hooks.uninstall_hook("test.point")
+    assert not hooks.has_hooks()
+
+
+def check_slave_hooks():
+    """a hook of the slave can answer for it or raise a modbus exception"""
+    slave = Modbus.ModbusSlave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 10)
+    request_pdu = struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, 1)
+
+    def answer(args):
+        return b"\x03\x02\x12\x34"
+
+    def busy(args):
+        raise ModbusError(SLAVE_DEVICE_BUSY)
+
+    hooks.install_hook("modbus.Slave.on_handle_request", answer)
+    try:
+        assert slave.handle_request(request_pdu) == b"\x03\x02\x12\x34"
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+    hooks.install_hook("modbus.Slave.on_handle_request", busy)
+    try:
+        assert slave.handle_request(request_pdu) == bytes([READ_HOLDING_REGISTERS + 128, SLAVE_DEVICE_BUSY])
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+    assert slave.handle_request(request_pdu) == b"\x03\x02\x00\x00"
+
+
+def check_logger():
+    """create_logger adds its handler once"""
+    logger = utils.create_logger("modbus.hookstest", level=logging.WARNING)
+    assert utils.create_logger("modbus.hookstest", level=logging.WARNING) is logger
+    assert len(logger.handlers) == 1
+    logger.removeHandler(logger.handlers[0])
+    # the modbus logger has a handler: its messages don't go to the last resort handler
+    assert logging.getLogger("modbus").handlers
+
+
+def main():
+    """main"""
+    check_hooks()
+    check_slave_hooks()
+    check_logger()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+""" discrete inputs (function 2) and input registers (function 4) read from their own blocks """
+
+import ModbusTcp
+import planner
+from defines import DISCRETE_INPUTS, ANALOG_INPUTS, HOLDING_REGISTERS, READ_DISCRETE_INPUTS, READ_INPUT_REGISTERS, \
+    READ_HOLDING_REGISTERS, ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE
+from exceptions import ModbusError
+
+HOST = "127.0.0.1"
+PORT = 15027
+
+
+def expect_error(master, exception_code, *args):
+    """check that a request is refused by the slave"""
+    try:
+        master.execute(*args)
+    except ModbusError as excpt:
+        assert excpt.get_exception_code() == exception_code
+    else:
+        assert False, "the slave has accepted the request"
+
+
+def main():
+    """main"""
+    server = ModbusTcp.TcpServer(PORT, HOST)
+    slave = server.add_slave(1)
+    slave.add_block('inputs', DISCRETE_INPUTS, 0, 2000)
+    slave.add_block('sensors', ANALOG_INPUTS, 0, 500)
+    slave.add_block('setpoints', HOLDING_REGISTERS, 0, 10)
+    slave.set_values('inputs', 0, [i % 5 == 0 for i in range(2000)])
+    slave.set_values('sensors', 0, list(range(1000, 1500)))
+    server.start()
+
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+    try:
+        assert master.execute(1, READ_DISCRETE_INPUTS, 3, 12) == (0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0)
+        assert master.execute(1, READ_DISCRETE_INPUTS, 0, 2000) == tuple(int(i % 5 == 0) for i in range(2000))
+        assert master.execute(1, READ_INPUT_REGISTERS, 10, 125) == tuple(range(1010, 1135))
+        # the input registers and the holding registers are different memories
+        assert master.execute(1, READ_HOLDING_REGISTERS, 0, 2) == (0, 0)
+        expect_error(master, ILLEGAL_DATA_ADDRESS, 1, READ_INPUT_REGISTERS, 490, 20)
+        expect_error(master, ILLEGAL_DATA_VALUE, 1, READ_INPUT_REGISTERS, 0, 126)
+        expect_error(master, ILLEGAL_DATA_VALUE, 1, READ_DISCRETE_INPUTS, 0, 2001)
+
+        # the read-only data is polled in large requests of its own
+        reader = planner.ReadPlanner(READ_INPUT_REGISTERS, max_gap=10)
+        values, report = reader.read(master, [(1, address) for address in range(0, 500, 4)])
+        assert all(value == 1000 + address for ((slave_id, address), value) in values.items())
+        print('125 input registers points read with %d requests' % report.nb_requests)
+        assert report.nb_requests == 4
+    finally:
+        master.disconnect()
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
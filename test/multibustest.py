@@ -0,0 +1,74 @@
+""" MultiBusMaster: batches over several virtual serial lines done in parallel """
+
+import time
+
+import serial
+
+import ModbusSerial
+import hooks
+import multibus
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+from exceptions import ModbusInvalidResponseError
+from gatewaytest import make_virtual_pair
+
+NB_BUSES = 4
+NB_REQUESTS = 10
+SLAVE_DELAY = 0.01
+
+
+def main():
+    """main"""
+    servers = []
+    masters = {}
+    for bus in range(NB_BUSES):
+        (slave_path, master_path) = make_virtual_pair()
+        server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=115200))
+        # one slave per bus: slave 1 on bus 0, slave 2 on bus 1...
+        slave = server.add_slave(bus + 1)
+        slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+        slave.set_values('0', 0, [(bus + 1) * 100 + i for i in range(100)])
+        server.start()
+        servers.append(server)
+        masters["line%d" % bus] = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=115200, timeout=0.5))
+    # every transaction of the slaves takes some time
+    hooks.install_hook("modbus.Slave.on_handle_request", lambda args: time.sleep(SLAVE_DELAY))
+
+    master = multibus.MultiBusMaster(masters)
+    requests = [("line%d" % bus, bus + 1, READ_HOLDING_REGISTERS, i, 4)
+                for i in range(NB_REQUESTS) for bus in range(NB_BUSES)]
+    try:
+        # warm up: the rtt of every slave is known
+        master.execute_many(requests)
+
+        # one bus after the other
+        begin = time.perf_counter()
+        for request in requests:
+            master.execute(*request)
+        sequential = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        nb_results = 0
+        for result in master.execute_batch(requests):
+            (bus, slave_id, function_code, starting_address, quantity) = result.request
+            assert result.error is None, result.error
+            assert result.values == tuple(slave_id * 100 + starting_address + i for i in range(quantity))
+            nb_results += 1
+        parallel = time.perf_counter() - begin
+        assert nb_results == len(requests)
+        print('%d buses x %d requests: one bus after the other %.3fs, in parallel %.3fs' % (
+            NB_BUSES, NB_REQUESTS, sequential, parallel))
+        assert parallel < sequential / 2
+
+        # an error on a bus is given back without stopping the others
+        results = master.execute_many([("line0", 9, READ_HOLDING_REGISTERS, 0, 4), requests[1]])
+        assert isinstance(results[0].error, ModbusInvalidResponseError) and results[1].error is None
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+        master.stop()
+        for server in servers:
+            server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
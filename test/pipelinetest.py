@@ -0,0 +1,193 @@
+""" pipelined Modbus TCP masters against a local server answering after random delays (out of order) """
+
+import asyncio
+import random
+import socketserver
+import threading
+import time
+
+import hooks
+import Modbus
+import ModbusAsync
+import ModbusTcp
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS, READ_WRITE_MULTIPLE_REGISTERS
+from exceptions import ModbusInvalidResponseError
+
+HOST = "127.0.0.1"
+PORT = 15022
+LATENCY = 0.02
+NUMBER = 64
+
+databank = Modbus.DataBank()
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """Modbus TCP server answering every request after a random delay: the responses are not in order"""
+    def handle(self):
+        sock = self.request
+        lock = threading.Lock()
+        buffer = bytearray()
+        while True:
+            data = sock.recv(1024)
+            if not data:
+                break
+            buffer += data
+            while len(buffer) >= 7 and len(buffer) >= ModbusTcp.get_frame_length(buffer):
+                length = ModbusTcp.get_frame_length(buffer)
+                request = buffer[:length]
+                del buffer[:length]
+                response = databank.handle_request(ModbusTcp.TcpQuery(), request)
+                # slave 9 never answers
+                if response and request[6] != 9:
+                    timer = threading.Timer(random.uniform(0.5, 1.5) * LATENCY, self.answer, (sock, lock, response))
+                    timer.start()
+
+    def answer(self, sock, lock, response):
+        with lock:
+            try:
+                sock.sendall(response)
+            except OSError:
+                pass
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def check_threaded():
+    """PipelinedTcpMaster: out of order responses, timeouts and throughput"""
+    master = ModbusTcp.PipelinedTcpMaster(HOST, PORT, timeout_in_sec=1.0, window=16)
+
+    # the results are given back in the order of the requests
+    requests = [(1, READ_HOLDING_REGISTERS, i, 4) for i in range(32)]
+    results = master.execute_many(requests)
+    assert results == [tuple(range(i, i + 4)) for i in range(32)]
+
+    # a request without response times out without blocking the others
+    slow = master.submit(9, READ_HOLDING_REGISTERS, 0, 1, timeout=0.2)
+    assert master.execute(1, READ_HOLDING_REGISTERS, 10, 2) == (10, 11)
+    try:
+        slow.result()
+        assert False, "timeout expected"
+    except ModbusInvalidResponseError:
+        pass
+    assert master.get_nb_in_flight() == 0
+
+    # while a request is being sent, the responses of the others are still received
+    future = master.submit(1, READ_HOLDING_REGISTERS, 20, 1)
+    with master._send_lock:
+        assert future.result(timeout=1.0) == (20, )
+
+    # function 23 writes at its own address
+    assert master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, 10, 2, output_value=[7, 8],
+                          write_starting_address_fc23=90) == (10, 11)
+    assert master.execute(1, READ_HOLDING_REGISTERS, 90, 2) == (7, 8)
+
+    sequential = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+    begin = time.perf_counter()
+    for i in range(NUMBER):
+        assert sequential.execute(1, READ_HOLDING_REGISTERS, i, 1) == (i, )
+    sequential_duration = time.perf_counter() - begin
+    sequential.disconnect()
+
+    begin = time.perf_counter()
+    results = master.execute_many([(1, READ_HOLDING_REGISTERS, i, 1) for i in range(NUMBER)])
+    pipelined_duration = time.perf_counter() - begin
+    assert results == [(i, ) for i in range(NUMBER)]
+    master.disconnect()
+
+    print('sequential         %6.0f transactions/s' % (NUMBER / sequential_duration))
+    print('pipelined (16)     %6.0f transactions/s' % (NUMBER / pipelined_duration))
+    assert pipelined_duration * 4 < sequential_duration
+
+
+async def check_async():
+    """AsyncTcpMaster: same checks on asyncio"""
+    master = await ModbusAsync.AsyncTcpMaster.open(HOST, PORT, timeout_in_sec=1.0, window=16)
+    results = await master.execute_many([(1, READ_HOLDING_REGISTERS, i, 4) for i in range(32)])
+    assert results == [tuple(range(i, i + 4)) for i in range(32)]
+
+    plan = master.prepare(9, READ_HOLDING_REGISTERS, 0, 1)
+    slow = asyncio.ensure_future(master.execute_plan(plan, timeout=0.2))
+    assert await master.execute(1, READ_HOLDING_REGISTERS, 10, 2) == (10, 11)
+    try:
+        await slow
+        assert False, "timeout expected"
+    except ModbusInvalidResponseError:
+        pass
+    assert master.get_nb_in_flight() == 0
+
+    # the hooks see the request with its transaction id and the response
+    calls = []
+    hooks.install_hook("modbus.Master.before_send", lambda args: calls.append(("send", bytes(args[1]))))
+    hooks.install_hook("modbus.Master.after_recv", lambda args: calls.append(("recv", bytes(args[1]))))
+    try:
+        assert await master.execute(1, READ_HOLDING_REGISTERS, 30, 1) == (30, )
+    finally:
+        hooks.uninstall_hook("modbus.Master.before_send")
+        hooks.uninstall_hook("modbus.Master.after_recv")
+    assert [name for (name, frame) in calls] == ["send", "recv"]
+    assert calls[0][1][:2] == calls[1][1][:2]
+
+    assert await master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, 10, 2, output_value=[5, 6],
+                                write_starting_address_fc23=92) == (10, 11)
+    assert await master.execute(1, READ_HOLDING_REGISTERS, 92, 2) == (5, 6)
+
+    begin = time.perf_counter()
+    results = await master.execute_many([(1, READ_HOLDING_REGISTERS, i, 1) for i in range(NUMBER)])
+    duration = time.perf_counter() - begin
+    assert results == [(i, ) for i in range(NUMBER)]
+    print('async pipelined    %6.0f transactions/s' % (NUMBER / duration))
+    master.disconnect()
+
+
+async def check_async_lost():
+    """AsyncTcpMaster: a response with an invalid length drops the connection, the next requests fail at once"""
+    async def garbage(reader, writer):
+        request = await reader.readexactly(12)
+        # MBAP length 0xFFFF: more than the largest frame
+        writer.write(request[:4] + b"\xff\xff" + request[6:8])
+        await writer.drain()
+
+    server = await asyncio.start_server(garbage, HOST, PORT + 100)
+    master = await ModbusAsync.AsyncTcpMaster.open(HOST, PORT + 100, timeout_in_sec=2.0)
+    try:
+        for _ in range(2):
+            begin = time.perf_counter()
+            try:
+                await master.execute(1, READ_HOLDING_REGISTERS, 0, 1)
+                assert False, "ModbusInvalidResponseError expected"
+            except ModbusInvalidResponseError as excpt:
+                assert "Invalid MBAP length" in str(excpt), excpt
+            assert time.perf_counter() - begin < 0.5
+        assert not master.is_connect
+    finally:
+        master.disconnect()
+        server.close()
+        await server.wait_closed()
+
+
+def main():
+    """main"""
+    slave = databank.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    databank.add_slave(9).add_block('0', HOLDING_REGISTERS, 0, 100)
+
+    server = Server((HOST, PORT), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        check_threaded()
+        asyncio.run(check_async())
+        asyncio.run(check_async_lost())
+    finally:
+        server.shutdown()
+        server.server_close()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
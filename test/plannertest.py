@@ -0,0 +1,59 @@
+""" read planner: merging across gaps, splitting at the limit of the function, slicing of the responses """
+
+import planner
+from defines import READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL, MAX_READ_BITS, MAX_READ_REGISTERS
+from exceptions import InvalidArgumentError
+
+
+class RangeMaster(object):
+    """a master whose registers hold slave * 1000 + address: records the requests"""
+    def __init__(self):
+        self.requests = []
+
+    def execute(self, slave_id, function_code, starting_address, quantity):
+        self.requests.append((slave_id, function_code, starting_address, quantity))
+        return tuple(slave_id * 1000 + starting_address + i for i in range(quantity))
+
+
+def ranges(requests):
+    """(slave, start, quantity) of the requests of a plan"""
+    return [(request.slave_id, request.starting_address, request.quantity) for request in requests]
+
+
+def main():
+    """main"""
+    # gaps up to max_gap are read, larger gaps split the requests
+    reader = planner.ReadPlanner(READ_HOLDING_REGISTERS, max_gap=3)
+    assert ranges(reader.plan([(1, 10), (1, 14), (1, 18), (1, 23)])) == [(1, 10, 9), (1, 23, 1)]
+    assert ranges(planner.ReadPlanner(max_gap=0).plan([(1, 10), (1, 11), (1, 13)])) == [(1, 10, 2), (1, 13, 1)]
+    # the same address asked twice is read once, the slaves are planned separately
+    assert ranges(reader.plan([(2, 5), (1, 5), (1, 5), (2, 6)])) == [(1, 5, 1), (2, 5, 2)]
+
+    # a request never reads more than the limit of the function
+    reader = planner.ReadPlanner(READ_HOLDING_REGISTERS, max_gap=10)
+    requests = reader.plan([(1, address) for address in range(0, 300)])
+    assert ranges(requests) == [(1, 0, MAX_READ_REGISTERS), (1, 125, MAX_READ_REGISTERS), (1, 250, 50)]
+    requests = planner.ReadPlanner(READ_COILS, max_gap=10).plan([(1, address) for address in range(0, 2500, 5)])
+    assert all(request.quantity <= MAX_READ_BITS for request in requests)
+    assert [request.starting_address for request in requests] == [0, 2000]
+    try:
+        planner.ReadPlanner(WRITE_SINGLE_COIL)
+        assert False, "InvalidArgumentError expected"
+    except InvalidArgumentError:
+        pass
+
+    # every point gets its own value out of the merged responses
+    master = RangeMaster()
+    points = [(1, 3), (1, 5), (1, 40), (2, 7), (2, 200), (2, 209)]
+    values, report = planner.ReadPlanner(READ_HOLDING_REGISTERS, max_gap=10).read(master, points)
+    assert values == dict(((slave_id, address), slave_id * 1000 + address) for (slave_id, address) in points)
+    assert master.requests == [(1, READ_HOLDING_REGISTERS, 3, 3), (1, READ_HOLDING_REGISTERS, 40, 1),
+                               (2, READ_HOLDING_REGISTERS, 7, 1), (2, READ_HOLDING_REGISTERS, 200, 10)]
+    assert report.nb_points == 6 and report.nb_requests == 4
+    assert report.nb_gap_values == 1 + 8 and report.round_trips_saved == 2
+    print('%d points read with %d requests' % (report.nb_points, report.nb_requests))
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" request plans of the masters: cache of the plans and checks of the decoded responses """
+
+import struct
+
+import ModbusTcp
+from defines import HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS
+from exceptions import ModbusInvalidResponseError
+
+HOST = "127.0.0.1"
+PORT = 15029
+
+
+def make_response(plan, response_pdu):
+    """the TCP response to the request of a plan"""
+    (transaction_id, protocol_id, length, unit_id) = struct.unpack_from(">HHHB", plan.request)
+    return struct.pack(">HHHB", transaction_id, protocol_id, len(response_pdu) + 1, unit_id) + response_pdu
+
+
+def main():
+    """main"""
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+
+    # the same request gets the same plan
+    plan = master._get_plan(1, READ_HOLDING_REGISTERS, 0, 10, 0, '', -1, "")
+    assert master._get_plan(1, READ_HOLDING_REGISTERS, 0, 10, 0, '', -1, "") is plan
+    # an argument which can not be a key of the cache: the plan is compiled every time
+    other = master._get_plan(1, READ_HOLDING_REGISTERS, 0, 10, 0, '', -1, bytearray(b"\x03"))
+    assert other is not plan and other.request[6:] == plan.request[6:]
+
+    # a response too short for the bits asked for is invalid
+    plan = master.prepare(1, READ_COILS, 0, 10)
+    assert master._decode_response(plan, make_response(plan, bytes([READ_COILS, 2, 0xff, 0x01])), False) == \
+        (1, ) * 9 + (0, )
+    try:
+        master._decode_response(plan, make_response(plan, bytes([READ_COILS, 1, 0xff])), False)
+        assert False, "ModbusInvalidResponseError expected"
+    except ModbusInvalidResponseError:
+        pass
+
+    # execute with a bytearray pdu
+    server = ModbusTcp.TcpServer(PORT, HOST)
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 10)
+    slave.set_values('0', 0, list(range(10)))
+    server.start()
+    try:
+        assert master.execute(1, READ_HOLDING_REGISTERS, 2, 3, pdu=bytearray(b"\x03")) == (2, 3, 4)
+    finally:
+        master.disconnect()
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
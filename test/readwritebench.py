@@ -0,0 +1,65 @@
+""" benchmark: a control cycle writing setpoints and reading process values, with functions 16 + 3 or 23 """
+
+import time
+
+import serial
+
+import ModbusSerial
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS, WRITE_MULTIPLE_REGISTERS, \
+    READ_WRITE_MULTIPLE_REGISTERS, ILLEGAL_DATA_ADDRESS
+from exceptions import ModbusError
+from gatewaytest import make_virtual_pair
+
+BAUDRATE = 9600
+NB_CYCLES = 20
+SETPOINTS = 0       # 10 registers written every cycle
+PROCESS_VALUES = 50  # 20 registers read every cycle
+
+
+def main():
+    """main"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=BAUDRATE))
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.set_values('0', PROCESS_VALUES, list(range(20)))
+    server.start()
+    master = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=BAUDRATE))
+    master.set_timeout(0.5)
+    try:
+        begin = time.perf_counter()
+        for cycle in range(NB_CYCLES):
+            master.execute(1, WRITE_MULTIPLE_REGISTERS, SETPOINTS, output_value=[cycle] * 10)
+            assert master.execute(1, READ_HOLDING_REGISTERS, PROCESS_VALUES, 20) == tuple(range(20))
+        two_transactions = (time.perf_counter() - begin) / NB_CYCLES
+
+        begin = time.perf_counter()
+        for cycle in range(NB_CYCLES):
+            assert master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, PROCESS_VALUES, 20, output_value=[cycle] * 10,
+                                  write_starting_address_fc23=SETPOINTS) == tuple(range(20))
+        one_transaction = (time.perf_counter() - begin) / NB_CYCLES
+        assert slave.get_values('0', SETPOINTS, 10) == (NB_CYCLES - 1, ) * 10
+
+        print('cycle at %d bauds: functions 16 + 3 %.1f ms, function 23 %.1f ms' % (
+            BAUDRATE, two_transactions * 1000, one_transaction * 1000))
+        assert one_transaction < two_transactions * 0.7
+
+        # the registers are written before being read
+        assert master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, 0, 3, output_value=[7, -1],
+                              write_starting_address_fc23=1) == (NB_CYCLES - 1, 7, 0xffff)
+        # nothing is written when the range read is out of the block
+        try:
+            master.execute(1, READ_WRITE_MULTIPLE_REGISTERS, 99, 2, output_value=[5], write_starting_address_fc23=0)
+        except ModbusError as excpt:
+            assert excpt.get_exception_code() == ILLEGAL_DATA_ADDRESS
+        else:
+            assert False, "the slave has accepted the request"
+        assert slave.get_values('0', 0, 1) == (NB_CYCLES - 1, )
+    finally:
+        server.stop()
+        master.disconnect()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
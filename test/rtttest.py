@@ -0,0 +1,99 @@
+""" adaptive response timeouts of RtuMaster: a fast slave and a slow slave on a virtual serial link """
+
+import time
+
+import serial
+
+import ModbusSerial
+import hooks
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+from exceptions import ModbusError, ModbusInvalidResponseError
+from gatewaytest import make_virtual_pair
+
+SLOW_SLAVE = 2
+SLOW_DELAY = 0.03
+TIMEOUT = 0.5
+COUNT = 20
+
+
+class CountingSerial(serial.Serial):
+    """serial port counting the changes of its timeout (every change reconfigures the port)"""
+    nb_timeout_changes = 0
+
+    def _set_timeout(self, timeout):
+        self.nb_timeout_changes += 1
+        serial.Serial.timeout.fset(self, timeout)
+
+    timeout = property(serial.Serial.timeout.fget, _set_timeout)
+
+
+def slow_down(args):
+    """hook making the slow slave answer late"""
+    (slave, request_pdu) = args
+    if slave._id == SLOW_SLAVE:
+        time.sleep(SLOW_DELAY)
+
+
+def main():
+    """main"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=115200))
+    for slave_id in (1, SLOW_SLAVE):
+        slave = server.add_slave(slave_id)
+        slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    hooks.install_hook("modbus.Slave.on_handle_request", slow_down)
+    server.start()
+    port = CountingSerial(master_path, baudrate=115200, timeout=TIMEOUT)
+    master = ModbusSerial.RtuMaster(port)
+    try:
+        # the slow slave answers after 30 ms: more than 3.5 characters, less than the timeout
+        for _ in range(COUNT):
+            for slave_id in (1, SLOW_SLAVE):
+                assert master.execute(slave_id, READ_HOLDING_REGISTERS, 0, 10) == (0, ) * 10
+        stats = master.get_rtt_stats()
+        for slave_id in (1, SLOW_SLAVE):
+            key = (slave_id, READ_HOLDING_REGISTERS)
+            print('slave %d: srtt %.2f ms, rttvar %.2f ms, rto %.2f ms' % (
+                slave_id, stats[key]["srtt"] * 1000, stats[key]["rttvar"] * 1000, stats[key]["rto"] * 1000))
+            assert stats[key]["samples"] == COUNT and stats[key]["timeouts"] == 0
+        # the pty doesn't pace the bytes: the estimation is short of the transmission time of the response
+        slow_srtt = stats[(SLOW_SLAVE, READ_HOLDING_REGISTERS)]["srtt"]
+        assert slow_srtt > stats[(1, READ_HOLDING_REGISTERS)]["srtt"] + SLOW_DELAY / 2
+
+        # the timeout of the fast slave is the floor: the port is not reconfigured for every transaction
+        master.execute(1, READ_HOLDING_REGISTERS, 0, 10)
+        port.nb_timeout_changes = 0
+        for _ in range(COUNT):
+            master.execute(1, READ_HOLDING_REGISTERS, 0, 10)
+        assert port.nb_timeout_changes == 0, port.nb_timeout_changes
+
+        # the exception responses are not round trip time samples
+        try:
+            master.execute(1, READ_HOLDING_REGISTERS, 500, 10)
+            assert False, "ModbusError expected"
+        except ModbusError:
+            pass
+        assert master.get_rtt_stats()[(1, READ_HOLDING_REGISTERS)]["samples"] == 2 * COUNT + 1
+
+        # the fast slave stops answering: the error is known long before the timeout of the master
+        server.remove_slave(1)
+        begin = time.perf_counter()
+        try:
+            master.execute(1, READ_HOLDING_REGISTERS, 0, 10)
+            assert False, "timeout expected"
+        except ModbusInvalidResponseError:
+            pass
+        duration = time.perf_counter() - begin
+        print('no response from slave 1 detected in %.2f ms (timeout of the master %.0f ms)' % (
+            duration * 1000, TIMEOUT * 1000))
+        assert duration < TIMEOUT / 2
+        assert master.get_rtt_stats()[(1, READ_HOLDING_REGISTERS)]["timeouts"] == 1
+    finally:
+        hooks.uninstall_hook("modbus.Slave.on_handle_request")
+        server.stop()
+        master.disconnect()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
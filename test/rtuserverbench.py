@@ -0,0 +1,62 @@
+""" benchmark: latency of RtuServer over a virtual serial link, requests framed by length or by silence """
+
+import struct
+import time
+
+import serial
+
+import ModbusSerial
+import crc
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+from gatewaytest import make_virtual_pair
+
+BAUDRATE = 9600
+NUMBER = 200
+QUANTITY = 10
+# a function the server doesn't know: its request can only end with the silence of the line
+UNKNOWN_FUNCTION = 0x41
+
+
+def make_request(pdu):
+    """RTU request to slave 1"""
+    data = struct.pack(">B", 1) + pdu
+    return data + crc.pack_crc(crc.crc16(data))
+
+
+def measure(port, request, response_length):
+    """returns the mean and the max latency between the request and the end of the response"""
+    latencies = []
+    for _ in range(NUMBER):
+        begin = time.perf_counter()
+        port.write(request)
+        response = port.read(response_length)
+        latencies.append(time.perf_counter() - begin)
+        assert len(response) == response_length
+    return sum(latencies) / NUMBER, max(latencies)
+
+
+def main():
+    """main"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=BAUDRATE))
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    server.start()
+    port = serial.Serial(master_path, baudrate=BAUDRATE, timeout=1.0)
+    try:
+        print('interframe timeout of the server at %d bauds: %.2f ms' % (BAUDRATE, server.get_timeout() * 1000))
+        # slave + function + byte count + registers + crc
+        (mean, worst) = measure(
+            port, make_request(struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, QUANTITY)), 5 + 2 * QUANTITY
+        )
+        print('FC03, framed by length     mean %6.2f ms  max %6.2f ms' % (mean * 1000, worst * 1000))
+        # the exception response: slave + function + exception code + crc
+        (mean, worst) = measure(port, make_request(struct.pack(">BHH", UNKNOWN_FUNCTION, 0, QUANTITY)), 5)
+        print('unknown, framed by silence mean %6.2f ms  max %6.2f ms' % (mean * 1000, worst * 1000))
+    finally:
+        server.stop()
+        port.close()
+
+
+if __name__ == "__main__":
+    main()
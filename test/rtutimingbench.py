@@ -0,0 +1,75 @@
+""" benchmark: RTU transactions per second with the t3.5 timing engine, at 9600 and 115200 bauds """
+
+import time
+
+import serial
+
+import ModbusSerial
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS, WRITE_MULTIPLE_REGISTERS
+from gatewaytest import make_virtual_pair
+
+BAUDRATES = (9600, 115200)
+DURATION = 1.0
+
+
+def run(baudrate, delay, no_delay):
+    """returns the number of transactions per second"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=baudrate), no_delay=no_delay)
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    server.start()
+    master = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=baudrate), delay=delay, no_delay=no_delay)
+    master.set_timeout(0.5)
+    try:
+        count = 0
+        begin = time.perf_counter()
+        while time.perf_counter() - begin < DURATION:
+            assert master.execute(1, READ_HOLDING_REGISTERS, 0, 10) == tuple(range(10))
+            count += 1
+        return count / (time.perf_counter() - begin)
+    finally:
+        server.stop()
+        master.disconnect()
+
+
+def check_broadcast(broadcast_delay):
+    """the request following a broadcast is sent broadcast_delay seconds after it: returns the time waited"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=115200))
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    server.start()
+    master = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=115200), broadcast_delay=broadcast_delay)
+    master.set_timeout(0.5)
+    try:
+        master.execute(0, WRITE_MULTIPLE_REGISTERS, 5, output_value=[55])
+        begin = time.perf_counter()
+        assert master.execute(1, READ_HOLDING_REGISTERS, 5, 1) == (55, )
+        duration = time.perf_counter() - begin
+        # only the first request after the broadcast waits
+        begin = time.perf_counter()
+        master.execute(1, READ_HOLDING_REGISTERS, 5, 1)
+        assert time.perf_counter() - begin < broadcast_delay or broadcast_delay == 0
+        return duration
+    finally:
+        server.stop()
+        master.disconnect()
+
+
+def main():
+    """main"""
+    for baudrate in BAUDRATES:
+        timing = ModbusSerial.RtuTiming(baudrate)
+        print('%6d bauds (t3.5 = %.2f ms)' % (baudrate, timing.silence_ns / 1e6))
+        print('    fixed 50 ms delay   %7.0f transactions/s' % run(baudrate, 0.05, False))
+        print('    t3.5 silence only   %7.0f transactions/s' % run(baudrate, 0, False))
+        print('    no delay            %7.0f transactions/s' % run(baudrate, 0, True))
+    duration = check_broadcast(0.05)
+    print('request after a broadcast: %.1f ms (broadcast_delay 50 ms)' % (duration * 1000))
+    assert duration >= 0.05
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+""" poll scheduler: earliest deadline first, jitter, overruns and skipped periods with a slow master """
+
+import queue
+import time
+
+import scheduler
+from defines import READ_HOLDING_REGISTERS
+from exceptions import ModbusInvalidResponseError
+
+
+class SlowMaster(object):
+    """a master whose transactions take delay seconds: the plan is the slave id"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.polled = []
+
+    def prepare(self, slave_id, function_code, starting_address=0, quantity=0, **kwargs):
+        return slave_id
+
+    def execute_plan(self, plan, returns_raw=False):
+        self.polled.append(plan)
+        time.sleep(self.delay)
+        if plan == 99:
+            raise ModbusInvalidResponseError("Response timeout")
+        return (plan, )
+
+
+def reschedule(poll_scheduler, release):
+    """give the same release time to all the groups (they are added one after the other)"""
+    poll_scheduler._heap = []
+    for name in sorted(poll_scheduler.get_stats()):
+        group = poll_scheduler.get_group(name)
+        group.release = release
+        poll_scheduler._push(group)
+
+
+def check_order():
+    """the group whose deadline is the earliest is polled first, the priority breaks the ties"""
+    master = SlowMaster()
+    poll_scheduler = scheduler.PollScheduler(master)
+    poll_scheduler.add_group("slow", 0.3, 1, READ_HOLDING_REGISTERS, 0, 1)
+    poll_scheduler.add_group("fast", 0.1, 2, READ_HOLDING_REGISTERS, 0, 1)
+    poll_scheduler.add_group("medium", 0.2, 3, READ_HOLDING_REGISTERS, 0, 1)
+    poll_scheduler.add_group("urgent", 0.2, 4, READ_HOLDING_REGISTERS, 0, 1, priority=5)
+    reschedule(poll_scheduler, time.monotonic())
+    for _ in range(4):
+        poll_scheduler.run_once(timeout=0)
+    assert master.polled == [2, 4, 3, 1], master.polled
+    # nothing is released yet: run_once waits at most timeout
+    begin = time.monotonic()
+    assert poll_scheduler.run_once(timeout=0.02) is None
+    assert time.monotonic() - begin < 0.05
+    # the fast group comes back first
+    assert poll_scheduler.run_once(timeout=0.2).name == "fast"
+
+
+def check_overrun():
+    """a poll longer than its period is an overrun and the periods missed are skipped"""
+    master = SlowMaster(delay=0.25)
+    results = queue.Queue()
+    poll_scheduler = scheduler.PollScheduler(master, results)
+    group = poll_scheduler.add_group("slow", 0.1, 1, READ_HOLDING_REGISTERS, 0, 1)
+    release = group.release
+    poll_scheduler.run_once(timeout=0)
+    stats = group.get_stats()
+    assert stats["polls"] == 1 and stats["overruns"] == 1, stats
+    # the poll ended after 0.25s: the period from 0.1 to 0.2 is skipped, the next poll is due at 0.2
+    assert stats["skipped"] == 1, stats
+    assert abs(group.release - (release + 0.2)) < 1e-9
+    assert results.get_nowait().values == (1, )
+
+    # the next poll starts late: its jitter is about 0.05s
+    poll_scheduler.run_once(timeout=0)
+    stats = group.get_stats()
+    assert 0.04 < stats["max_jitter"] < 0.1, stats
+    assert stats["overruns"] == 2
+
+    # errors are counted and given with the result
+    master.delay = 0
+    poll_scheduler.add_group("missing", 1.0, 99, READ_HOLDING_REGISTERS, 0, 1)
+    poll_scheduler.remove_group("slow")
+    poll_scheduler.run_once(timeout=0)
+    result = results.get_nowait()
+    result = results.get_nowait() if result.name != "missing" else result
+    assert isinstance(result.error, ModbusInvalidResponseError)
+    assert poll_scheduler.get_stats()["missing"]["errors"] == 1
+
+
+def check_thread():
+    """polling in the thread: the polls start on time"""
+    master = SlowMaster(delay=0.001)
+    results = []
+    poll_scheduler = scheduler.PollScheduler(master)
+    poll_scheduler.add_group("a", 0.05, 1, READ_HOLDING_REGISTERS, 0, 1, callback=results.append)
+    poll_scheduler.add_group("b", 0.1, 2, READ_HOLDING_REGISTERS, 0, 1, callback=results.append)
+    poll_scheduler.start()
+    time.sleep(0.5)
+    poll_scheduler.stop()
+    stats = poll_scheduler.get_stats()
+    for (name, group_stats) in sorted(stats.items()):
+        print('group %s: %2d polls, %d overruns, mean jitter %.2f ms, max %.2f ms' % (
+            name, group_stats["polls"], group_stats["overruns"],
+            group_stats["mean_jitter"] * 1000, group_stats["max_jitter"] * 1000))
+    assert 8 <= stats["a"]["polls"] <= 12 and 4 <= stats["b"]["polls"] <= 7, stats
+    assert stats["a"]["skipped"] == stats["b"]["skipped"] == 0
+    assert len(results) == stats["a"]["polls"] + stats["b"]["polls"]
+
+
+def main():
+    """main"""
+    check_order()
+    check_overrun()
+    check_thread()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
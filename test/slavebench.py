@@ -0,0 +1,44 @@
+""" micro benchmark of the ModbusSlave read handlers """
+
+import struct
+import timeit
+
+import Modbus
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS
+
+NUMBER = 20000
+
+
+def legacy_read_registers(values):
+    """response built by concatenation (previous implementation)"""
+    response = struct.pack(">B", 2 * len(values))
+    for reg in values:
+        response += struct.pack(">H", reg)
+    return response
+
+
+def main():
+    """main"""
+    slave = Modbus.ModbusSlave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 125)
+    slave.add_block('1', COILS, 0, 2000)
+    slave.set_values('0', 0, list(range(125)))
+    slave.set_values('1', 0, [1, 0, 0, 1, 1] * 400)
+
+    registers_pdu = struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, 125)
+    coils_pdu = struct.pack(">BHH", READ_COILS, 0, 2000)
+    values = slave.get_values('0', 0, 125)
+    assert legacy_read_registers(values) == slave.handle_request(registers_pdu)[1:]
+
+    cases = (
+        ('legacy 125 registers', lambda: legacy_read_registers(values)),
+        ('read 125 registers', lambda: slave.handle_request(registers_pdu)),
+        ('read 2000 coils', lambda: slave.handle_request(coils_pdu)),
+    )
+    for name, func in cases:
+        duration = timeit.timeit(func, number=NUMBER) / NUMBER
+        print('%-24s %8.2fus' % (name, duration * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+""" benchmark: latency of a server while a reader thread reads big ranges, with the lock or with snapshots """
+
+import threading
+import time
+
+import ModbusTcp
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS, WRITE_MULTIPLE_REGISTERS
+from exceptions import OutOfModbusBlockError
+
+HOST = "127.0.0.1"
+PORT = 15028
+NB_REGISTERS = 10000
+NB_TRANSACTIONS = 400
+
+
+def percentile(samples, ratio):
+    """returns the given percentile of the samples"""
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * ratio), len(samples) - 1)]
+
+
+def read_with_lock(slave):
+    """returns all the registers and the time the lock of the slave has been held"""
+    begin = time.perf_counter()
+    values = slave.get_values('0', 0, NB_REGISTERS)
+    return values, time.perf_counter() - begin
+
+
+def read_snapshot(slave):
+    """returns all the registers and the time the lock of the slave may have been held"""
+    begin = time.perf_counter()
+    snapshot = slave.snapshot()
+    held = time.perf_counter() - begin
+    return snapshot.get_values('0', 0, NB_REGISTERS), held
+
+
+def measure(master, slave, reader):
+    """returns the latencies of the transactions while the reader runs (None: no reader) and the times held"""
+    running = [True]
+    held = []
+
+    def read_all():
+        while running[0]:
+            (values, time_held) = reader(slave)
+            # the writings are never seen half done
+            assert values[0] == values[99]
+            held.append(time_held)
+
+    thread = threading.Thread(target=read_all) if reader else None
+    if thread:
+        thread.start()
+    latencies = []
+    try:
+        for i in range(NB_TRANSACTIONS):
+            begin = time.perf_counter()
+            if i % 2:
+                master.execute(1, WRITE_MULTIPLE_REGISTERS, 0, output_value=[i] * 100)
+            else:
+                master.execute(1, READ_HOLDING_REGISTERS, 0, 100)
+            latencies.append(time.perf_counter() - begin)
+    finally:
+        running[0] = False
+        if thread:
+            thread.join()
+    return latencies, held
+
+
+def main():
+    """main"""
+    server = ModbusTcp.TcpServer(PORT, HOST)
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, NB_REGISTERS)
+    server.start()
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=None)
+    try:
+        readers = (
+            ("no reader", None),
+            ("get_values", read_with_lock),
+            ("snapshot", read_snapshot),
+        )
+        lock_held = {}
+        for (name, reader) in readers:
+            (latencies, held) = measure(master, slave, reader)
+            print('%-10s transactions p50 %6.3f ms p99 %6.3f ms max %6.3f ms' % (
+                name, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+            if held:
+                lock_held[name] = sum(held) / len(held)
+                print('           %5d readings of %d registers, lock held %.3f ms per reading' % (
+                    len(held), NB_REGISTERS, lock_held[name] * 1000))
+
+        # the snapshot is given again while nothing is written, and copied again after a write
+        snapshot = slave.snapshot()
+        assert slave.snapshot() is snapshot
+        master.execute(1, WRITE_MULTIPLE_REGISTERS, 5000, output_value=[7, 8])
+        assert snapshot.get_values('0', 5000, 2) == (0, 0)
+        assert slave.snapshot() is not snapshot
+        assert slave.snapshot().get_values('0', 5000, 2) == (7, 8)
+        # a block added is in the next snapshot
+        slave.add_block('1', HOLDING_REGISTERS, NB_REGISTERS, 10)
+        assert slave.snapshot().get_block_names() == ['0', '1']
+        try:
+            snapshot.get_values('0', NB_REGISTERS - 1, 2)
+        except OutOfModbusBlockError:
+            pass
+        else:
+            assert False, "read out of the block"
+        # the transactions wait for the reader as long as it holds the lock
+        assert lock_held["snapshot"] < lock_held["get_values"] / 5
+    finally:
+        master.disconnect()
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+""" benchmark: Modbus TCP transactions per second on loopback, with and without the connection pool """
+
+import socketserver
+import threading
+import time
+
+import Modbus
+import ModbusTcp
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+from exceptions import ModbusInvalidResponseError
+
+HOST = "127.0.0.1"
+PORT = 15021
+NUMBER = 2000
+# the requests to this unit get a response whose MBAP length is 0
+BAD_UNIT = 9
+
+databank = Modbus.DataBank()
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """minimal Modbus TCP server: one thread per connection"""
+    def handle(self):
+        sock = self.request
+        buffer = bytearray()
+        while True:
+            data = sock.recv(1024)
+            if not data:
+                break
+            buffer += data
+            while len(buffer) >= 7 and len(buffer) >= ModbusTcp.get_frame_length(buffer):
+                length = ModbusTcp.get_frame_length(buffer)
+                request = buffer[:length]
+                del buffer[:length]
+                if request[6] == BAD_UNIT:
+                    sock.sendall(request[:4] + bytes([0, 0, BAD_UNIT]))
+                    continue
+                response = databank.handle_request(ModbusTcp.TcpQuery(), request)
+                if response:
+                    sock.sendall(response)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def run(pool, reconnect):
+    """returns the number of transactions per second"""
+    master = ModbusTcp.TcpMaster(HOST, PORT, pool=pool)
+    begin = time.perf_counter()
+    for _ in range(NUMBER):
+        assert master.execute(1, READ_HOLDING_REGISTERS, 0, 10) == tuple(range(10))
+        if reconnect:
+            # a short lived master: one connection per call
+            master.disconnect()
+    duration = time.perf_counter() - begin
+    master.disconnect()
+    return NUMBER / duration
+
+
+def check_invalid_length():
+    """a response with an invalid MBAP length is refused and its connection is not reused"""
+    pool = ModbusTcp.TcpConnectionPool()
+    master = ModbusTcp.TcpMaster(HOST, PORT, timeout_in_sec=1.0, pool=pool)
+    try:
+        master.execute(BAD_UNIT, READ_HOLDING_REGISTERS, 0, 10)
+    except ModbusInvalidResponseError:
+        pass
+    else:
+        assert False, "the response has been accepted"
+    assert master.execute(1, READ_HOLDING_REGISTERS, 0, 10) == tuple(range(10))
+    master.disconnect()
+    assert pool.nb_connections == 2
+    pool.close_all()
+
+
+def main():
+    """main"""
+    slave = databank.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+
+    server = Server((HOST, PORT), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        pool = ModbusTcp.TcpConnectionPool()
+        print('connect per call, no pool   %8.0f transactions/s' % run(None, True))
+        print('connect per call, pool      %8.0f transactions/s (%d connections)' % (
+            run(pool, True), pool.nb_connections))
+        print('persistent connection       %8.0f transactions/s' % run(None, False))
+        pool.close_all()
+        check_invalid_length()
+        print('OK')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+""" load test of TcpServer: requests per second and latency as the number of clients grows """
+
+import asyncio
+import multiprocessing
+import struct
+import time
+
+import ModbusTcp
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+
+HOST = "127.0.0.1"
+PORT = 15023
+DURATION = 2.0
+NB_CLIENTS = (1, 10, 100, 1000)
+QUANTITY = 10
+# MBAP + function code + byte count + registers
+RESPONSE_LENGTH = 7 + 2 + 2 * QUANTITY
+
+
+async def client(latencies, end):
+    """send read requests one after the other until end"""
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    request = ModbusTcp.TcpQuery().build_request(struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, QUANTITY), 1)
+    while time.perf_counter() < end:
+        begin = time.perf_counter()
+        writer.write(request)
+        await reader.readexactly(RESPONSE_LENGTH)
+        latencies.append(time.perf_counter() - begin)
+    writer.close()
+
+
+async def load(nb_clients):
+    """run nb_clients clients during DURATION seconds"""
+    latencies = []
+    end = time.perf_counter() + DURATION
+    await asyncio.gather(*[client(latencies, end) for _ in range(nb_clients)])
+    return latencies
+
+
+def run_clients(nb_clients):
+    """in the process of the clients: returns requests per second and 99th percentile latency"""
+    latencies = asyncio.run(load(nb_clients))
+    latencies.sort()
+    return len(latencies) / DURATION, latencies[int(len(latencies) * 0.99)]
+
+
+class SlowWakeServer(ModbusTcp.TcpServer):
+    """the server thread runs as soon as it is woken up, before stop goes on"""
+    def _wake(self):
+        super(SlowWakeServer, self)._wake()
+        time.sleep(0.05)
+
+
+def check_stop():
+    """stop doesn't wait for the timeout of the select: the server thread is woken up when it must stop"""
+    server = SlowWakeServer(PORT, HOST, timeout_in_sec=2.0)
+    server.start()
+    time.sleep(0.05)
+    begin = time.perf_counter()
+    server.stop()
+    duration = time.perf_counter() - begin
+    assert duration < 0.5, duration
+
+
+def main():
+    """main"""
+    check_stop()
+    server = ModbusTcp.TcpServer(PORT, HOST, max_connections=max(NB_CLIENTS))
+    slave = server.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+    slave.set_values('0', 0, list(range(100)))
+    server.start()
+    try:
+        # the clients run in another process: they do not share the GIL with the server
+        with multiprocessing.Pool(1) as pool:
+            for nb_clients in NB_CLIENTS:
+                (rate, p99) = pool.apply(run_clients, (nb_clients, ))
+                print('%5d clients  %8.0f requests/s  p99 latency %7.2f ms' % (nb_clients, rate, p99 * 1000))
+    finally:
+        server.stop()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
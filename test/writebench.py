@@ -0,0 +1,77 @@
+""" benchmark: writing 100 coils one by one (function 5) or at once (function 15), then checks of function 16 """
+
+import time
+
+import serial
+
+import ModbusSerial
+from defines import COILS, HOLDING_REGISTERS, READ_COILS, READ_HOLDING_REGISTERS, WRITE_SINGLE_COIL, \
+    WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS, ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE
+from exceptions import ModbusError
+from gatewaytest import make_virtual_pair
+
+BAUDRATE = 9600
+NB_COILS = 100
+
+
+def expect_error(master, exception_code, *args, **kwargs):
+    """check that a request is refused by the slave"""
+    try:
+        master.execute(*args, **kwargs)
+    except ModbusError as excpt:
+        assert excpt.get_exception_code() == exception_code
+    else:
+        assert False, "the slave has accepted the request"
+
+
+def main():
+    """main"""
+    (slave_path, master_path) = make_virtual_pair()
+    server = ModbusSerial.RtuServer(serial.Serial(slave_path, baudrate=BAUDRATE))
+    slave = server.add_slave(1)
+    slave.add_block('0', COILS, 0, NB_COILS)
+    slave.add_block('1', HOLDING_REGISTERS, 0, 100)
+    server.start()
+    master = ModbusSerial.RtuMaster(serial.Serial(master_path, baudrate=BAUDRATE))
+    master.set_timeout(0.5)
+    try:
+        values = [i % 3 == 0 for i in range(NB_COILS)]
+
+        begin = time.perf_counter()
+        for (address, value) in enumerate(values):
+            master.execute(1, WRITE_SINGLE_COIL, address, output_value=value)
+        single = time.perf_counter() - begin
+        assert master.execute(1, READ_COILS, 0, NB_COILS) == tuple(int(value) for value in values)
+
+        values = [not value for value in values]
+        begin = time.perf_counter()
+        assert master.execute(1, WRITE_MULTIPLE_COILS, 0, output_value=values) == (0, NB_COILS)
+        multiple = time.perf_counter() - begin
+        assert master.execute(1, READ_COILS, 0, NB_COILS) == tuple(int(value) for value in values)
+
+        print('%d coils at %d bauds: function 5 %.1f ms, function 15 %.1f ms (x%.0f)' % (
+            NB_COILS, BAUDRATE, single * 1000, multiple * 1000, single / multiple))
+        assert multiple < single / 10
+
+        # registers: unsigned, signed and packed with a format
+        assert master.execute(1, WRITE_MULTIPLE_REGISTERS, 10, output_value=list(range(1000, 1090))) == (10, 90)
+        assert master.execute(1, READ_HOLDING_REGISTERS, 10, 90) == tuple(range(1000, 1090))
+        master.execute(1, WRITE_MULTIPLE_REGISTERS, 0, output_value=[-1, 2])
+        assert master.execute(1, READ_HOLDING_REGISTERS, 0, 2) == (0xffff, 2)
+        master.execute(1, WRITE_MULTIPLE_REGISTERS, 0, output_value=[1.5], data_format=">f")
+        assert master.execute(1, READ_HOLDING_REGISTERS, 0, 2, data_format=">f") == (1.5, )
+
+        # out of the block: nothing is written
+        expect_error(master, ILLEGAL_DATA_ADDRESS, 1, WRITE_MULTIPLE_REGISTERS, 95, output_value=[7] * 10)
+        assert master.execute(1, READ_HOLDING_REGISTERS, 95, 5) == (1085, 1086, 1087, 1088, 1089)
+        expect_error(master, ILLEGAL_DATA_ADDRESS, 1, WRITE_MULTIPLE_COILS, 99, output_value=[1, 1])
+        # too many values in one writing
+        expect_error(master, ILLEGAL_DATA_VALUE, 1, WRITE_MULTIPLE_REGISTERS, 0, output_value=[0] * 124)
+    finally:
+        server.stop()
+        master.disconnect()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+""" check that a received RTU frame is not copied between the serial read and the function handler """
+
+import struct
+import tracemalloc
+
+import crc
+import Modbus
+import ModbusSerial
+from defines import HOLDING_REGISTERS, READ_HOLDING_REGISTERS
+
+
+def make_frame(slave_id, pdu):
+    """returns a RTU frame as it is received from the serial line"""
+    data = struct.pack(">B", slave_id) + pdu
+    return bytearray(data + crc.pack_crc(crc.crc16(data)))
+
+
+def test_handler_sees_received_buffer():
+    """the pdu given to the function handler is a view on the received frame"""
+    databank = Modbus.DataBank()
+    slave = databank.add_slave(1)
+    slave.add_block('0', HOLDING_REGISTERS, 0, 100)
+
+    seen = []
+    handler = slave._fn_code_map[READ_HOLDING_REGISTERS]
+
+    def spy(request_pdu):
+        seen.append(request_pdu)
+        return handler(request_pdu)
+    slave._fn_code_map[READ_HOLDING_REGISTERS] = spy
+
+    request = make_frame(1, struct.pack(">BHH", READ_HOLDING_REGISTERS, 0, 10))
+    response = databank.handle_request(ModbusSerial.RtuQuery(), request)
+
+    assert len(seen) == 1
+    assert isinstance(seen[0], memoryview)
+    assert seen[0].obj is request
+    assert crc.check_frame(response)
+
+
+def test_parse_request_allocations():
+    """parsing a frame must not allocate a copy of it"""
+    size = 64 * 1024
+    request = make_frame(1, bytes(size))
+    query = ModbusSerial.RtuQuery()
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        slave_id, pdu = query.parse_request(request)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert slave_id == 1
+    assert len(pdu) == size
+    assert peak - before < size // 4, "parse_request allocated {0} bytes".format(peak - before)
+
+
+def main():
+    """main"""
+    test_handler_sees_received_buffer()
+    test_parse_request_allocations()
+    print('OK')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
+import logging
 import sys
 
+from exceptions import ModbusInvalidResponseError
+
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 
@@ -9,12 +12,55 @@ def to_data(string_data):
     else:
         return bytearray(string_data, 'ascii')
 
+def create_logger(name="modbus", level=logging.DEBUG, record_format="%(asctime)s\t%(levelname)s\t%(message)s"):
+    """
+    Send the messages of the modbus logger to the console. The masters and the servers
+    only log when they are verbose (see set_verbose)
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    # already sent somewhere: don't print every message twice
+    if any(not isinstance(handler, logging.NullHandler) for handler in logger.handlers):
+        return logger
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(record_format))
+    logger.addHandler(handler)
+    return logger
+
+def get_log_buffer(prefix, buff):
+    """returns a string with the bytes of buff for logging"""
+    return prefix + "-".join(str(byte) for byte in bytes(buff))
+
 def swap_bytes(word_val):
     """swap lsb and msb of a word"""
     msb = (word_val >> 8) & 0xFF
     lsb = word_val & 0xFF
     return (lsb << 8) + msb
 
+# maps every byte value to the ascii digit of its boolean value
+_BIT_DIGITS = bytes.maketrans(bytes(range(256)), b"0" + b"1" * 255)
+
+def pack_bits(values):
+    """pack a sequence of bits in bytes, the first bit being the lsb of the first byte"""
+    nb_bits = len(values)
+    if nb_bits == 0:
+        return b""
+    try:
+        raw = bytes(values)
+    except (ValueError, TypeError):
+        raw = bytes(map(bool, values))
+    # the bits are converted all at once: as a binary number, the last bit comes first
+    return int(raw[::-1].translate(_BIT_DIGITS), 2).to_bytes((nb_bits + 7) // 8, "little")
+
+def unpack_bits(data, nb_bits):
+    """returns the nb_bits first bits packed in data, the first bit being the lsb of the first byte"""
+    if nb_bits <= 0:
+        return ()
+    if 8 * len(data) < nb_bits:
+        raise ModbusInvalidResponseError("{0} bytes can not hold {1} bits".format(len(data), nb_bits))
+    bits = format(int.from_bytes(data, "little"), "0{0}b".format(8 * len(data)))
+    return tuple(map(int, bits[:-nb_bits - 1:-1]))
+
 def calculate_rtu_inter_char(baudrate):
     """calculates the interchar delay from the baudrate"""
     if baudrate <= 19200: